@@ -0,0 +1,148 @@
+"""
+Mesure de la latence de la boucle asyncio pendant les accès au stockage
+
+Génère un user_data.json synthétique (10 000 utilisateurs par défaut) dans un
+répertoire temporaire, puis simule un flux de messages qui appellent les
+helpers de bot/database.py pendant qu'une tâche témoin mesure le retard de
+la boucle. Le mode "legacy" rejoue l'ancienne implémentation (lecture et
+réécriture complètes du fichier à chaque appel) pour comparaison.
+
+Usage :
+    python benchmarks/storage_loop_lag.py [--users 10000] [--messages 500]
+    STORAGE_BACKEND=sqlite python benchmarks/storage_loop_lag.py
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TICK = 0.005
+ARRIVAL_INTERVAL = 0.001
+
+def build_dataset(path, users):
+    data = {
+        "licenses": {},
+        "connections": {},
+        "redirections": {},
+        "transformations": {},
+        "whitelists": {},
+        "blacklists": {},
+        "chats": {}
+    }
+    now = datetime.now().isoformat()
+    for i in range(users):
+        user_id = str(1000000000 + i)
+        phone = f"229{i:08d}"
+        data["licenses"][user_id] = {"license": f"{user_id}LICENSE", "validated_at": now, "active": True}
+        data["connections"][user_id] = [{"phone": f"+{phone}", "connected_at": now, "active": True}]
+        data["redirections"][user_id] = {
+            f"redir{i}": {
+                "phone": phone,
+                "name": f"redir{i}",
+                "channel_name": f"📺 redir{i}",
+                "source_id": str(1002000000000 + i),
+                "destination_id": str(1003000000000 + i),
+                "created_at": now,
+                "active": True
+            }
+        }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+class LegacyStorage:
+    """The original helpers: full parse per read, full rewrite per write"""
+
+    path = "user_data.json"
+
+    def load_data(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save_data(self, data):
+        with open(self.path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    async def is_user_licensed(self, user_id):
+        data = self.load_data()
+        user_license = data["licenses"].get(str(user_id))
+        return user_license and user_license.get("active", False)
+
+    async def get_user_connections(self, user_id):
+        return self.load_data()["connections"].get(str(user_id), [])
+
+    async def store_license(self, user_id, license_code):
+        data = self.load_data()
+        data["licenses"][str(user_id)] = {"license": license_code, "validated_at": datetime.now().isoformat(), "active": True}
+        self.save_data(data)
+
+async def watch_loop(lags, stop):
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+async def run_workload(storage, users, messages):
+    if hasattr(storage, "init_storage"):
+        await storage.init_storage()
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, stop))
+    started = time.perf_counter()
+    for i in range(messages):
+        user_id = 1000000000 + (i * 7919) % users
+        await storage.is_user_licensed(user_id)
+        await storage.get_user_connections(user_id)
+        if i % 10 == 0:
+            # One command in ten writes (e.g. a license validated with /valide)
+            await storage.store_license(user_id, f"{user_id}LICENSE")
+        # Messages arrive roughly every millisecond
+        await asyncio.sleep(ARRIVAL_INTERVAL)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    return elapsed, lags
+
+def report(label, elapsed, lags):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(
+        f"{label:<10} {elapsed:8.2f} s   "
+        f"lag p50 {statistics.median(lags_ms):7.2f} ms   p99 {p99:7.2f} ms   max {lags_ms[-1]:7.2f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="telefeed-bench-")
+    os.chdir(workdir)
+    build_dataset("user_data.json", args.users)
+    size_mb = os.path.getsize("user_data.json") / 1024 / 1024
+    print(f"Dataset: {args.users} users, {size_mb:.1f} MB in {workdir}")
+
+    elapsed, lags = asyncio.run(run_workload(LegacyStorage(), args.users, args.messages))
+    report("legacy", elapsed, lags)
+
+    sys.path.insert(0, ROOT)
+    from bot import database
+
+    async def run_current():
+        result = await run_workload(database, args.users, args.messages)
+        database.data_store.flush()
+        return result
+
+    elapsed, lags = asyncio.run(run_current())
+    report(database.STORAGE_BACKEND, elapsed, lags)
+
+if __name__ == "__main__":
+    main()
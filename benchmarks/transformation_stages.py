@@ -0,0 +1,110 @@
+"""
+Coût par étape de la chaîne de transformations
+
+Compile une chaîne représentative (substitutions power, removeLines par
+numéro et par motif, modèle format) puis l'applique à des messages
+synthétiques avec entités de mise en forme, emoji compris. Affiche le coût
+moyen de chaque étape par message, ainsi que la conversion des entités et
+la chaîne complète.
+
+Usage :
+    python benchmarks/transformation_stages.py [--messages 20000] [--lines 8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bot.transform_engine import (  # noqa: E402
+    TransformationChain, build_entities, compile_step, entity_spans, parse_transformation
+)
+
+STEPS = [
+    ("power", ["@\\w+ => @moncanal", "https?://\\S+ => ", "(?i)\\bpromo\\b => PROMO"]),
+    ("removeLines", ["1", "-1"]),
+    ("removeLines", ["/t\\.me\\//", "\"rejoignez-nous\"", "publicité"]),
+    ("format", ["📢 {text}", "", "— Relayé par TeleFeed"]),
+]
+
+WORDS = ["signal", "promo", "achat", "vente", "objectif", "stop", "marché", "analyse", "🎯", "🚀", "📈"]
+
+class Entity:
+    """Stand-in for a Telethon MessageEntity (offset and length in UTF-16 units)"""
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+def utf16_length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+def build_message(rng, lines):
+    parts, entities, offset = [], [], 0
+    for index in range(lines):
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12)))
+        if index % 3 == 1:
+            line += " @source_channel https://t.me/source_channel/123"
+        elif index % 5 == 4:
+            line = "Rejoignez-nous sur t.me/source_channel"
+        # Bold first word of each line
+        first = line.split(" ", 1)[0]
+        entities.append(Entity(offset, utf16_length(first)))
+        parts.append(line)
+        offset += utf16_length(line) + 1
+    return "\n".join(parts), entities
+
+async def run(messages, stages):
+    timings = [0] * len(stages)
+    convert_in = convert_out = 0
+    for text, entities in messages:
+        started = time.perf_counter_ns()
+        spans = entity_spans(text, entities)
+        convert_in += time.perf_counter_ns() - started
+        for index, stage in enumerate(stages):
+            started = time.perf_counter_ns()
+            text, spans = await stage(text, spans)
+            timings[index] += time.perf_counter_ns() - started
+        started = time.perf_counter_ns()
+        build_entities(text, spans)
+        convert_out += time.perf_counter_ns() - started
+
+    chain = TransformationChain(stages)
+    started = time.perf_counter_ns()
+    for text, entities in messages:
+        await chain.apply(text, entities)
+    total = time.perf_counter_ns() - started
+    return convert_in, timings, convert_out, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--lines", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    messages = [build_message(rng, args.lines) for _ in range(args.messages)]
+    stages = []
+    labels = []
+    for transform_type, lines in STEPS:
+        for stage in compile_step({"type": transform_type, "spec": parse_transformation(transform_type, lines)}):
+            stages.append(stage)
+            labels.append(f"{stage.kind}:{len(labels) + 1}")
+
+    convert_in, timings, convert_out, total = asyncio.run(run(messages, stages))
+
+    count = len(messages)
+    print(f"{count} messages, {args.lines} lines, {len(stages)} stages")
+    print(f"{'entities in':<16} {convert_in / count / 1000:8.2f} µs/message")
+    for label, elapsed in zip(labels, timings):
+        print(f"{label:<16} {elapsed / count / 1000:8.2f} µs/message")
+    print(f"{'entities out':<16} {convert_out / count / 1000:8.2f} µs/message")
+    print(f"{'chain.apply':<16} {total / count / 1000:8.2f} µs/message")
+
+if __name__ == "__main__":
+    main()
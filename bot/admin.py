@@ -160,11 +160,9 @@ async def handle_generate_license(event, client):
 async def handle_list_users(event, client):
     """List registered users"""
     try:
-        from bot.database import load_data
+        from bot.database import get_user_overview
         
-        data = load_data()
-        licenses = data.get("licenses", {})
-        connections = data.get("connections", {})
+        licenses, connections = await get_user_overview()
         
         user_list = f"""
 👥 **LISTE DES UTILISATEURS**
@@ -176,16 +174,15 @@ async def handle_list_users(event, client):
 🔐 **Utilisateurs avec licence :**
 """
         
-        for user_id, license_data in licenses.items():
-            status = "✅ Actif" if license_data.get("active", False) else "❌ Inactif"
+        for user_id, active in licenses.items():
+            status = "✅ Actif" if active else "❌ Inactif"
             user_list += f"• {user_id} - {status}\n"
         
         if not licenses:
             user_list += "Aucun utilisateur avec licence\n"
         
         user_list += "\n📱 **Utilisateurs connectés :**\n"
-        for user_id, user_connections in connections.items():
-            phone_count = len(user_connections)
+        for user_id, phone_count in connections.items():
             user_list += f"• {user_id} - {phone_count} numéro(s)\n"
         
         if not connections:
@@ -200,29 +197,43 @@ async def handle_list_users(event, client):
 async def handle_stats(event, client):
     """Show bot statistics"""
     try:
-        from bot.database import load_data
-        
-        data = load_data()
-        
-        total_licenses = len(data.get("licenses", {}))
-        active_licenses = sum(1 for license_data in data.get("licenses", {}).values() 
-                            if license_data.get("active", False))
-        total_connections = len(data.get("connections", {}))
-        total_redirections = sum(len(redirections) for redirections in data.get("redirections", {}).values())
+        from bot.database import get_storage_stats
+        from bot.send_scheduler import scheduler_stats
+        from bot.dedup import deduplicator
+        from bot.command_router import command_router
+        
+        stats = await get_storage_stats()
+        sending = scheduler_stats()
+        commands = "\n".join(
+            f"• `{command['command']}` : {command['count']} × {command['average'] * 1000:.0f} ms (max {command['max'] * 1000:.0f} ms)"
+            for command in command_router.stats()[:5]
+        ) or "• Aucune commande traitée"
         
         stats_message = f"""
 📊 **STATISTIQUES DU BOT**
 
 👥 **Utilisateurs :**
-• Total licences : {total_licenses}
-• Licences actives : {active_licenses}
-• Connexions : {total_connections}
+• Total licences : {stats["licenses"]}
+• Licences actives : {stats["active_licenses"]}
+• Connexions : {stats["connections"]}
 
 ⚙️ **Fonctionnalités :**
-• Redirections configurées : {total_redirections}
-• Transformations : {len(data.get("transformations", {}))}
-• Listes blanches : {len(data.get("whitelists", {}))}
-• Listes noires : {len(data.get("blacklists", {}))}
+• Redirections configurées : {stats["redirections"]}
+• Transformations : {stats["transformations"]}
+• Listes blanches : {stats["whitelists"]}
+• Listes noires : {stats["blacklists"]}
+
+📤 **Envois :**
+• Comptes actifs : {sending["accounts"]}
+• En file d'attente : {sending["queued"]}
+• Comptes en pause (FloodWait) : {sending["parked"]}
+• Messages envoyés : {sending["sent"]}
+• Attente moyenne : {sending["average_wait"]:.2f} s
+• Doublons ignorés : {deduplicator.dropped}
+
+⏱️ **Commandes :**
+{commands}
+• Commandes inconnues : {command_router.unknown}
 
 🚀 **Statut :** Bot opérationnel
         """
@@ -236,26 +247,39 @@ async def handle_stats(event, client):
 async def handle_sessions(event, client):
     """Show active sessions and redirections"""
     try:
-        from bot.database import load_data
-        from bot.connection import active_connections
+        from bot.database import get_all_data
+        from bot.conversation import conversation_states, AWAITING_CODE
+        from bot.client_registry import client_registry
         
-        data = load_data()
+        data = await get_all_data()
         connections = data.get("connections", {})
         redirections = data.get("redirections", {})
+        pending_logins = conversation_states.users(AWAITING_CODE)
         
         # Build sessions message
         sessions_message = "📱 **SESSIONS ACTIVES**\n\n"
         
-        # Active connection attempts (temporary sessions)
-        if active_connections:
+        # Connection attempts waiting for their code (temporary sessions)
+        if pending_logins:
             sessions_message += "🔄 **Connexions en cours :**\n"
-            for user_id, conn_data in active_connections.items():
-                phone = conn_data.get('phone', 'Inconnu')
+            for user_id, state in pending_logins.items():
+                phone = state.data.get('phone', 'Inconnu')
                 sessions_message += f"• Utilisateur {user_id} - {phone}\n"
             sessions_message += "\n"
         else:
             sessions_message += "🔄 **Connexions en cours :** Aucune\n\n"
         
+        # Clients currently open, one per (user, phone)
+        if client_registry.entries:
+            sessions_message += "🔌 **Clients ouverts :**\n"
+            for entry in client_registry.entries.values():
+                status = "🟢" if entry.connected else "💤" if entry.idle else "🔴"
+                holders = ', '.join(
+                    f"{name}×{count}" if count > 1 else name for name, count in sorted(entry.holders.items())
+                )
+                sessions_message += f"• {status} Utilisateur {entry.user_id} - +{entry.phone} ({holders})\n"
+            sessions_message += "\n"
+        
         # Established connections
         if connections:
             sessions_message += "✅ **Connexions établies :**\n"
@@ -305,7 +329,8 @@ async def handle_sessions(event, client):
         
         # Summary
         total_active_connections = sum(len(conns) for conns in connections.values())
-        total_temp_connections = len(active_connections)
+        total_temp_connections = len(pending_logins)
+        client_stats = client_registry.stats()
         total_active_redirections = sum(
             sum(1 for redir in user_redirections.values() if redir.get('active', True))
             for user_redirections in redirections.values()
@@ -314,6 +339,8 @@ async def handle_sessions(event, client):
         sessions_message += f"\n📊 **RÉSUMÉ :**\n"
         sessions_message += f"• Connexions temporaires : {total_temp_connections}\n"
         sessions_message += f"• Connexions établies : {total_active_connections}\n" 
+        sessions_message += f"• Clients ouverts : {client_stats['connected']}/{client_stats['clients']} ({client_stats['users']} utilisateur(s))\n"
+        sessions_message += f"• Clients en veille : {client_stats['idle']} ({client_stats['evictions']} mise(s) en veille, {client_stats['reconnects']} reconnexion(s))\n"
         sessions_message += f"• Redirections actives : {total_active_redirections}\n"
         
         await event.respond(sessions_message)
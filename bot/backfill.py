@@ -0,0 +1,182 @@
+"""
+Rattrapage manuel de l'historique d'une source
+/redirection backfill NOM on NUMERO [N|since DATE] parcourt l'historique
+par pages, le transfère par lots de 100 sous le budget d'envoi du compte et
+enregistre sa progression pour pouvoir reprendre après une interruption
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from bot.client_registry import client_registry
+from bot.database import redirection_destinations, store_backfill
+from bot.forwarding import FORWARD_BATCH_SIZE, forwarder
+from bot.routing import RedirectionRule
+
+logger = logging.getLogger(__name__)
+
+# Messages forwarded when no count or date is given
+DEFAULT_BACKFILL_COUNT = 100
+
+# Minimum seconds between two edits of the status message
+STATUS_EDIT_INTERVAL = 3.0
+
+# Running backfills: (user_id, name) -> task
+running_backfills = {}
+
+def parse_backfill_range(args):
+    """Parse "[N|since DATE]"; returns (count, since) or raises ValueError"""
+    if not args:
+        return DEFAULT_BACKFILL_COUNT, None
+    if len(args) == 1 and args[0].isdigit():
+        count = int(args[0])
+        if count <= 0:
+            raise ValueError("count")
+        return count, None
+    if len(args) == 2 and args[0].lower() == "since":
+        for date_format in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                return None, datetime.strptime(args[1], date_format).replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+    raise ValueError("range")
+
+async def _plan(client, source, count, since):
+    """Id range [start, end) of the history to forward"""
+    latest = await client.get_messages(source, limit=1)
+    if not latest:
+        return None
+    end_id = latest[0].id + 1
+    if since is not None:
+        first = await client.get_messages(source, limit=1, offset_date=since, reverse=True)
+        start_id = first[0].id - 1 if first else end_id - 1
+    else:
+        oldest = await client.get_messages(source, limit=1, add_offset=count - 1)
+        start_id = oldest[0].id - 1 if oldest else 0
+    return max(0, start_id), end_id
+
+def backfill_running(user_id, name):
+    task = running_backfills.get((user_id, name))
+    return task is not None and not task.done()
+
+def start_backfill(status_message, client, user_id, name, redirection, job):
+    """Run a backfill in the background, reporting on `status_message`
+
+    The task drops the "backfill" holder of the account's client when it
+    ends; nothing is started (None) while a backfill of `name` is running.
+    """
+    key = (user_id, name)
+    if backfill_running(user_id, name):
+        return None
+    task = asyncio.get_running_loop().create_task(
+        _run_backfill(status_message, client, user_id, name, redirection, job)
+    )
+    running_backfills[key] = task
+    task.add_done_callback(lambda _: running_backfills.pop(key, None))
+    return task
+
+async def _run_backfill(status_message, client, user_id, name, redirection, job):
+    try:
+        await _walk_history(status_message, client, user_id, name, redirection, job)
+    finally:
+        # Once no redirection holds it either, the client can disconnect
+        await client_registry.release(user_id, job['phone'], "backfill")
+
+async def _walk_history(status_message, client, user_id, name, redirection, job):
+    source = int(redirection['source_id'])
+    rule = RedirectionRule(user_id, name, redirection['source_id'], redirection_destinations(redirection), None)
+    last_edit = 0.0
+
+    async def report(text, force=False):
+        nonlocal last_edit
+        if not force and time.monotonic() - last_edit < STATUS_EDIT_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await status_message.edit(text)
+        except Exception as e:
+            if "not modified" not in str(e):
+                logger.warning(f"Could not update backfill status for {name}: {e}")
+
+    # The client must stay connected for the whole history walk
+    with client_registry.busy(user_id, job['phone']):
+        try:
+            if job.get('end_id') is None:
+                planned = await _plan(client, source, job.get('count'), _since(job))
+                if planned is None:
+                    job['status'] = 'done'
+                    await store_backfill(user_id, name, job)
+                    await report(f"✅ **Backfill {name}** : aucun message dans la source.", force=True)
+                    return
+                job['start_id'], job['end_id'] = planned
+                job['position'] = job['start_id']
+                await store_backfill(user_id, name, job)
+
+            chunk = []
+            async for message in client.iter_messages(source, min_id=job['position'], max_id=job['end_id'], reverse=True):
+                if getattr(message, 'action', None) is not None:
+                    continue
+                chunk.append(message)
+                if len(chunk) >= FORWARD_BATCH_SIZE:
+                    await _forward_chunk(client, rule, source, chunk, job)
+                    await store_backfill(user_id, name, job)
+                    await report(_progress(name, job))
+                    chunk = []
+            if chunk:
+                await _forward_chunk(client, rule, source, chunk, job)
+
+            job['status'] = 'done'
+            job['finished_at'] = datetime.now().isoformat()
+            await store_backfill(user_id, name, job)
+            await report(_progress(name, job), force=True)
+            logger.info(f"Backfill of {name} for user {user_id} done: {job['forwarded']} message(s)")
+
+        except asyncio.CancelledError:
+            job['status'] = 'paused'
+            await store_backfill(user_id, name, job)
+            raise
+        except Exception as e:
+            job['status'] = 'paused'
+            job['error'] = str(e)
+            await store_backfill(user_id, name, job)
+            logger.error(f"Backfill of {name} for user {user_id} interrupted: {e}")
+            await report(
+                f"⚠️ **Backfill {name} interrompu** après {job['forwarded']} message(s)\n\n"
+                f"Erreur : {e}\nRelancez `/redirection backfill {name} on {job['phone']}` pour reprendre.",
+                force=True
+            )
+
+async def _forward_chunk(client, rule, source, chunk, job):
+    results = await forwarder.forward_history(client, rule, source, chunk)
+    job['forwarded'] += len(chunk)
+    job['failed'] += sum(failed for _, failed, _ in results.values())
+    job['position'] = chunk[-1].id
+
+def _since(job):
+    return datetime.fromisoformat(job['since']) if job.get('since') else None
+
+def _progress(name, job):
+    done = job.get('status') == 'done'
+    header = f"✅ **Backfill {name} terminé**" if done else f"⏳ **Backfill {name} en cours...**"
+    span = max(1, job['end_id'] - 1 - job['start_id'])
+    percent = 100 if done else min(99, int(100 * (job['position'] - job['start_id']) / span))
+    text = f"{header}\n\n📨 Messages traités : {job['forwarded']}\n📊 Progression : {percent}%"
+    if job['failed']:
+        text += f"\n⚠️ Échecs : {job['failed']}"
+    return text
+
+def new_job(phone_number, count, since):
+    return {
+        "phone": phone_number,
+        "count": count,
+        "since": since.isoformat() if since else None,
+        "start_id": None,
+        "position": None,
+        "end_id": None,
+        "forwarded": 0,
+        "failed": 0,
+        "status": "running",
+        "started_at": datetime.now().isoformat()
+    }
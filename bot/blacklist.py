@@ -1,4 +1,7 @@
 import logging
+import re
+
+from bot.filter_engine import filters, parse_filter_terms
 
 logger = logging.getLogger(__name__)
 
@@ -23,25 +26,34 @@ async def handle_blacklist_command(event, client):
 **Fonctionnalité :**
 La blacklist ignore tous les messages contenant certains mots ou regex.
 
+Un terme par ligne sous la commande : un mot, une phrase entre guillemets ou une regex entre `/`. NOM est le nom de la redirection filtrée.
+
 **Exemple :**
-`/blacklist add motInterdit on 229900112233`
+```
+/blacklist add motInterdit on 229900112233
+promo
+"code secret"
+/\\d{6}/
+```
             """
             await event.respond(usage_message)
             return
         
         # Parse command
-        parts = message_text.split()
+        lines = message_text.splitlines()
+        parts = lines[0].split()
+        terms = lines[1:]
         if len(parts) < 2:
             await event.respond("❌ Format incorrect. Tapez `/blacklist` pour voir l'utilisation.")
             return
         
         # Handle different blacklist actions
         if parts[1] == "add" and len(parts) == 5 and parts[3] == "on":
-            await add_blacklist(event, client, parts[2], parts[4])
+            await add_blacklist(event, client, parts[2], parts[4], terms)
         elif parts[1] == "remove" and len(parts) == 5 and parts[3] == "on":
             await remove_blacklist(event, client, parts[2], parts[4])
         elif parts[1] == "change" and len(parts) == 5 and parts[3] == "on":
-            await change_blacklist(event, client, parts[2], parts[4])
+            await change_blacklist(event, client, parts[2], parts[4], terms)
         elif parts[1] == "clear" and len(parts) == 4 and parts[2] == "on":
             await clear_blacklist(event, client, parts[3])
         else:
@@ -51,7 +63,7 @@ La blacklist ignore tous les messages contenant certains mots ou regex.
         logger.error(f"Error in blacklist command: {e}")
         await event.respond("❌ Erreur lors de la gestion de la blacklist. Veuillez réessayer.")
 
-async def add_blacklist(event, client, name, phone_number):
+async def add_blacklist(event, client, name, phone_number, terms):
     """Add a blacklist filter"""
     try:
         user_id = event.sender_id
@@ -61,8 +73,12 @@ async def add_blacklist(event, client, name, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.\nUtilisez `/valide` pour activer votre licence.")
             return
         
+        keywords, regexes = await parse_terms(event, terms)
+        if keywords is None:
+            return
+        
         # Store blacklist
-        await store_blacklist(user_id, name, phone_number, "add")
+        await store_blacklist(user_id, name, phone_number, "add", keywords, regexes)
         
         success_message = f"""
 ✅ **Filtre blacklist ajouté**
@@ -70,6 +86,7 @@ async def add_blacklist(event, client, name, phone_number):
 📝 **Nom :** {name}
 📞 **Numéro :** {phone_number}
 🔄 **Action :** Ajout
+🔤 **Termes :** {len(keywords)} mot(s), {len(regexes)} regex
 
 Le filtre blacklist est maintenant actif !
 Les messages contenant les mots interdits seront ignorés.
@@ -112,7 +129,7 @@ Le filtre blacklist a été désactivé.
         logger.error(f"Error removing blacklist: {e}")
         await event.respond("❌ Erreur lors de la suppression du filtre blacklist.")
 
-async def change_blacklist(event, client, name, phone_number):
+async def change_blacklist(event, client, name, phone_number, terms):
     """Change a blacklist filter"""
     try:
         user_id = event.sender_id
@@ -122,8 +139,12 @@ async def change_blacklist(event, client, name, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
             return
         
+        keywords, regexes = await parse_terms(event, terms)
+        if keywords is None:
+            return
+        
         # Change blacklist
-        await store_blacklist(user_id, name, phone_number, "change")
+        await store_blacklist(user_id, name, phone_number, "change", keywords, regexes)
         
         success_message = f"""
 ✅ **Filtre blacklist modifié**
@@ -131,6 +152,7 @@ async def change_blacklist(event, client, name, phone_number):
 📝 **Nom :** {name}
 📞 **Numéro :** {phone_number}
 🔄 **Action :** Modification
+🔤 **Termes :** {len(keywords)} mot(s), {len(regexes)} regex
 
 Le filtre blacklist a été mis à jour.
         """
@@ -171,19 +193,36 @@ Tous les filtres blacklist ont été supprimés pour ce numéro.
         logger.error(f"Error clearing blacklist: {e}")
         await event.respond("❌ Erreur lors du nettoyage des filtres blacklist.")
 
+async def parse_terms(event, terms):
+    """Parse the filter terms given under the command; (None, None) after replying on error"""
+    try:
+        keywords, regexes = parse_filter_terms(terms)
+    except re.error as e:
+        await event.respond(f"❌ **Regex invalide :** {e}")
+        return None, None
+    if not keywords and not regexes:
+        await event.respond("❌ Aucun terme fourni. Ajoutez un mot ou une regex par ligne sous la commande.\nTapez `/blacklist` pour voir l'utilisation.")
+        return None, None
+    return keywords, regexes
+
 async def is_premium_user(user_id):
     """Check if user has premium access"""
     from bot.database import is_user_licensed
     return await is_user_licensed(user_id)
 
-async def store_blacklist(user_id, name, phone_number, action):
+async def store_blacklist(user_id, name, phone_number, action, keywords=(), regexes=()):
     """Store blacklist in database"""
+    from bot.database import remove_filter, store_filter
+    if action == "remove":
+        await remove_filter("blacklists", user_id, name)
+    else:
+        await store_filter("blacklists", user_id, name, phone_number, list(keywords), list(regexes), replace=action == "change")
+    filters.invalidate(user_id)
     logger.info(f"Blacklist {action} for user {user_id}: {name} on {phone_number}")
-    # In real implementation, save to database
-    pass
 
 async def clear_user_blacklist(user_id, phone_number):
     """Clear all blacklist filters for a user and phone number"""
-    logger.info(f"Blacklist cleared for user {user_id} on {phone_number}")
-    # In real implementation, clear from database
-    pass
\ No newline at end of file
+    from bot.database import clear_filters
+    removed = await clear_filters("blacklists", user_id, phone_number)
+    filters.invalidate(user_id)
+    logger.info(f"Blacklist cleared for user {user_id} on {phone_number}: {removed} filter(s)")
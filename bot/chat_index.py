@@ -0,0 +1,123 @@
+"""
+Index de recherche des noms de chats pour /chats search
+Préfixes des mots (liste triée) et trigrammes du nom complet, sans accents
+ni casse, tenus à jour avec l'instantané des dialogues : une recherche
+parmi des dizaines de milliers de dialogues ne fait aucun appel Telegram
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+WORD = re.compile(r"\w+")
+
+def normalize(text):
+    """Lowercase, accents removed: "Équipe Projet" -> "equipe projet" """
+    if not text or text.isascii():
+        return (text or "").lower()
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def trigrams(text):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+class ChatNameIndex:
+    """Name search over the dialogs of one account
+
+    Short terms (under three characters) are matched as word prefixes with
+    a bisect over the sorted words; longer ones through the intersection of
+    their trigram postings, checked against the normalized name.
+    """
+
+    def __init__(self):
+        self.names = {}  # peer id -> normalized "name @username"
+        self.words = []  # sorted (word, peer id)
+        self.postings = {}  # trigram -> set of peer ids
+
+    def _index_text(self, info):
+        text = normalize(info['name'])
+        if info.get('username'):
+            text += f" @{normalize(info['username'])}"
+        self.names[info['id']] = text
+        for trigram in trigrams(text):
+            self.postings.setdefault(trigram, set()).add(info['id'])
+        return text
+
+    def build(self, infos):
+        """Index many dialogs at once (the word list is sorted once)"""
+        words = []
+        for info in infos:
+            if info['id'] in self.names:
+                self.remove(info['id'])
+            text = self._index_text(info)
+            words.extend((word, info['id']) for word in set(WORD.findall(text)))
+        self.words.extend(words)
+        self.words.sort()
+
+    def add(self, info):
+        if info['id'] in self.names:
+            self.remove(info['id'])
+        text = self._index_text(info)
+        for word in set(WORD.findall(text)):
+            insort(self.words, (word, info['id']))
+
+    def remove(self, peer_id):
+        text = self.names.pop(peer_id, None)
+        if text is None:
+            return
+        for word in set(WORD.findall(text)):
+            position = bisect_left(self.words, (word, peer_id))
+            if position < len(self.words) and self.words[position] == (word, peer_id):
+                del self.words[position]
+        for trigram in trigrams(text):
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.discard(peer_id)
+                if not posting:
+                    del self.postings[trigram]
+
+    def _prefix(self, term):
+        found = set()
+        position = bisect_left(self.words, (term,))
+        while position < len(self.words) and self.words[position][0].startswith(term):
+            found.add(self.words[position][1])
+            position += 1
+        return found
+
+    def _substring(self, term):
+        postings = sorted((self.postings.get(trigram, ()) for trigram in trigrams(term)), key=len)
+        if not postings or not postings[0]:
+            return set()
+        found = set(postings[0])
+        for posting in postings[1:]:
+            found &= posting
+            if not found:
+                return found
+        return {peer_id for peer_id in found if term in self.names[peer_id]}
+
+    def search(self, query):
+        """Peer ids whose name contains every term of the query, best first"""
+        terms = WORD.findall(normalize(query))
+        if not terms:
+            return []
+        found = None
+        for term in sorted(terms, key=len, reverse=True):
+            matches = self._prefix(term) if len(term) < 3 else self._substring(term)
+            found = matches if found is None else found & matches
+            if not found:
+                return []
+        phrase = " ".join(terms)
+        starts = [f" {term}" for term in terms]
+
+        def rank(peer_id):
+            # Exact name, then names starting with the query, then names
+            # whose words start with every term, shorter names first
+            text = self.names[peer_id]
+            return (
+                text != phrase,
+                not text.startswith(phrase),
+                not all(text.startswith(term) or start in text for term, start in zip(terms, starts)),
+                len(text)
+            )
+
+        return sorted(found, key=rank)
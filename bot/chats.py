@@ -1,7 +1,23 @@
 import logging
+from telethon import Button
 
 logger = logging.getLogger(__name__)
 
+# Chats listed per page; names are cut so a page stays well below
+# Telegram's 4096-character message limit
+CHATS_PAGE_SIZE = 25
+CHAT_NAME_LENGTH = 60
+
+TYPE_INFO = {
+    'user': {'emoji': '👤', 'name': 'Utilisateurs'},
+    'bot': {'emoji': '🤖', 'name': 'Bots'},
+    'group': {'emoji': '👥', 'name': 'Groupes'},
+    'channel': {'emoji': '📢', 'name': 'Canaux'}
+}
+
+# Latest search of each user per phone, replayed by the page buttons
+last_searches = {}
+
 async def handle_chats_command(event, client):
     """
     Handle /chats command
@@ -29,6 +45,9 @@ Utilisez cette commande pour obtenir tous les ID de chats à utiliser avec d'aut
 `/chats bot 2759205517`
 `/chats group 2759205517`
 `/chats channel 2759205517`
+
+**Rechercher un chat par son nom :**
+`/chats search TEXTE 2759205517`
             """
             await event.respond(usage_message)
             return
@@ -40,7 +59,13 @@ Utilisez cette commande pour obtenir tous les ID de chats à utiliser avec d'aut
             return
         
         # Handle different chat filters
-        if len(parts) == 2:
+        if parts[1] == "search":
+            # The search text may contain spaces: the phone number comes last
+            if len(parts) < 4:
+                await event.respond("❌ Format incorrect. Utilisez : `/chats search TEXTE NUMERO`")
+                return
+            await show_chat_search(event, client, " ".join(parts[2:-1]), parts[-1])
+        elif len(parts) == 2:
             # Show all chats
             await show_all_chats(event, client, parts[1])
         elif len(parts) == 3:
@@ -69,10 +94,11 @@ async def show_all_chats(event, client, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.\nUtilisez `/valide` pour activer votre licence.")
             return
         
-        # Get real chats from active connection
-        chats = await get_real_user_chats(user_id, phone_number)
+        # Counts come straight from the per-type partitions of the snapshot
+        from bot.dialog_snapshot import dialog_snapshots
+        counts = (await dialog_snapshots.load(user_id, phone_number)).counts()
         
-        if not chats:
+        if not sum(counts.values()):
             message = f"""
 📡 **Chats pour {phone_number}**
 
@@ -81,21 +107,15 @@ Aucun chat trouvé pour ce numéro.
 💡 **Astuce :** Assurez-vous que le numéro est correctement connecté avec `/connect`.
             """
         else:
-            # Group chats by type
-            users = [c for c in chats if c['type'] == 'user']
-            bots = [c for c in chats if c['type'] == 'bot']
-            groups = [c for c in chats if c['type'] == 'group']
-            channels = [c for c in chats if c['type'] == 'channel']
-            
             message = f"""
 📡 **Chats pour {phone_number}**
 
-👤 **Utilisateurs :** {len(users)}
-🤖 **Bots :** {len(bots)}
-👥 **Groupes :** {len(groups)}
-📢 **Canaux :** {len(channels)}
+👤 **Utilisateurs :** {counts['user']}
+🤖 **Bots :** {counts['bot']}
+👥 **Groupes :** {counts['group']}
+📢 **Canaux :** {counts['channel']}
 
-📊 **Total :** {len(chats)} chat(s)
+📊 **Total :** {sum(counts.values())} chat(s)
 
 💡 **Astuce :** Utilisez `/chats TYPE {phone_number}` pour voir les détails avec IDs.
             """
@@ -107,8 +127,29 @@ Aucun chat trouvé pour ce numéro.
         logger.error(f"Error showing all chats: {e}")
         await event.respond("❌ Erreur lors de l'affichage des chats.")
 
+def render_chat_page(title, chats, page, data, show_type=False):
+    """Text and navigation buttons of one page of a chat listing
+
+    `data` prefixes the callback data of the buttons ("chats|KIND|PHONE").
+    """
+    pages = max(1, -(-len(chats) // CHATS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    lines = []
+    for chat in chats[page * CHATS_PAGE_SIZE:(page + 1) * CHATS_PAGE_SIZE]:
+        name = chat['name'] if len(chat['name']) <= CHAT_NAME_LENGTH else chat['name'][:CHAT_NAME_LENGTH - 1] + "…"
+        prefix = f"{TYPE_INFO[chat['type']]['emoji']} " if show_type else ""
+        lines.append(f"• {prefix}{name} - ID: `{chat['id']}`")
+    text = f"{title}\n\n" + "\n".join(lines) + f"\n\n📊 **Total :** {len(chats)} chat(s) — page {page + 1}/{pages}"
+
+    buttons = []
+    if page > 0:
+        buttons.append(Button.inline("◀️ Précédent", f"{data}|{page - 1}".encode()))
+    if page < pages - 1:
+        buttons.append(Button.inline("Suivant ▶️", f"{data}|{page + 1}".encode()))
+    return text, [buttons] if buttons else None
+
 async def show_chats_by_type(event, client, chat_type, phone_number):
-    """Show chats of a specific type for a phone number"""
+    """Show chats of a specific type for a phone number, one page at a time"""
     try:
         user_id = event.sender_id
         
@@ -117,20 +158,12 @@ async def show_chats_by_type(event, client, chat_type, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
             return
         
-        # Get real chats from active connection
+        # Get real chats from the account's dialog snapshot
         chats = await get_real_user_chats_by_type(user_id, phone_number, chat_type)
         logger.info(f"Retrieved {len(chats)} chats of type {chat_type} for user {user_id}")
         
-        # Get type emoji and name
-        type_info = {
-            'user': {'emoji': '👤', 'name': 'Utilisateurs'},
-            'bot': {'emoji': '🤖', 'name': 'Bots'},
-            'group': {'emoji': '👥', 'name': 'Groupes'},
-            'channel': {'emoji': '📢', 'name': 'Canaux'}
-        }
-        
-        emoji = type_info[chat_type]['emoji']
-        name = type_info[chat_type]['name']
+        emoji = TYPE_INFO[chat_type]['emoji']
+        name = TYPE_INFO[chat_type]['name']
         
         if not chats:
             message = f"""
@@ -138,111 +171,89 @@ async def show_chats_by_type(event, client, chat_type, phone_number):
 
 Aucun {chat_type} trouvé pour ce numéro.
             """
+            await event.respond(message)
         else:
-            chat_list = "\n".join([f"• {c['name']} - ID: `{c['id']}` - {c['status']}" for c in chats])
-            message = f"""
-{emoji} **{name} pour {phone_number}**
-
-{chat_list}
-
-📊 **Total :** {len(chats)} {chat_type}(s)
-            """
-        
-        await event.respond(message)
+            message, buttons = render_chat_page(
+                f"{emoji} **{name} pour {phone_number}**", chats, 0, f"chats|{chat_type}|{phone_number}"
+            )
+            await event.respond(message, buttons=buttons)
         logger.info(f"Chats of type {chat_type} shown for user {user_id} on {phone_number}")
         
     except Exception as e:
         logger.error(f"Error showing chats by type: {e}")
         await event.respond("❌ Erreur lors de l'affichage des chats.")
 
+async def show_chat_search(event, client, query, phone_number):
+    """Show the chats of a phone number whose name matches a search"""
+    try:
+        user_id = event.sender_id
+        
+        # Check if user has premium access
+        if not await is_premium_user(user_id):
+            await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
+            return
+        
+        from bot.dialog_snapshot import dialog_snapshots
+        chats = await (await dialog_snapshots.load(user_id, phone_number)).search(query)
+        
+        if not chats:
+            await event.respond(f"🔎 **Aucun chat trouvé pour « {query} » sur {phone_number}**\n\n💡 **Astuce :** Essayez un mot plus court ou une partie du nom.")
+            return
+        
+        last_searches[(user_id, phone_number)] = query
+        message, buttons = render_chat_page(
+            f"🔎 **Chats « {query} » sur {phone_number}**", chats, 0, f"chats|search|{phone_number}", show_type=True
+        )
+        await event.respond(message, buttons=buttons)
+        logger.info(f"Chat search by user {user_id} on {phone_number}: {len(chats)} result(s)")
+        
+    except Exception as e:
+        logger.error(f"Error searching chats: {e}")
+        await event.respond("❌ Erreur lors de la recherche des chats.")
+
+async def handle_chats_page(event, client):
+    """Handle the next/previous buttons of a chat listing"""
+    try:
+        user_id = event.sender_id
+        _, kind, phone_number, page = event.data.decode().split("|")
+        
+        if not await is_premium_user(user_id):
+            await event.answer("Accès premium requis", alert=True)
+            return
+        
+        from bot.dialog_snapshot import dialog_snapshots
+        snapshot = await dialog_snapshots.load(user_id, phone_number)
+        if kind == "search":
+            query = last_searches.get((user_id, phone_number))
+            if query is None:
+                await event.answer("Recherche expirée, relancez /chats search", alert=True)
+                return
+            title = f"🔎 **Chats « {query} » sur {phone_number}**"
+            chats = await snapshot.search(query)
+        else:
+            title = f"{TYPE_INFO[kind]['emoji']} **{TYPE_INFO[kind]['name']} pour {phone_number}**"
+            chats = snapshot.chats(kind)
+        
+        message, buttons = render_chat_page(
+            title, chats, int(page), f"chats|{kind}|{phone_number}", show_type=kind == "search"
+        )
+        await event.edit(message, buttons=buttons)
+        await event.answer()
+        
+    except Exception as e:
+        logger.error(f"Error paging chats: {e}")
+        await event.answer("Erreur lors de l'affichage des chats.")
+
 async def is_premium_user(user_id):
     """Check if user has premium access"""
     from bot.database import is_user_licensed
     return await is_user_licensed(user_id)
 
 async def get_real_user_chats(user_id, phone_number):
-    """Get all real chats for a user and phone number from active connection"""
+    """Get all real chats for a user and phone number from the dialog snapshot"""
     try:
-        from bot.connection import active_connections
-        
-        # Check if user has an active connection for this phone
-        if user_id not in active_connections:
-            logger.warning(f"No active connection found for user {user_id}")
-            return []
-            
-        connection_data = active_connections[user_id]
-        active_client = connection_data.get('client')
-        connection_phone = connection_data.get('phone', '').replace('+', '')
-        target_phone = phone_number.replace('+', '')
-        
-        if not active_client or not active_client.is_connected():
-            logger.warning(f"Client not connected for user {user_id}")
-            return []
-            
-        # Check if the phone numbers match
-        if connection_phone != target_phone:
-            logger.warning(f"Phone mismatch: connected {connection_phone}, requested {target_phone}")
-            return []
-        
-        # Update session activity
-        from bot.session_manager import session_manager
-        await session_manager.update_session_activity(user_id, connection_data.get('phone'))
-            
-        # Get all dialogs (chats) from the active client
-        chats = []
-        async for dialog in active_client.iter_dialogs():
-            try:
-                chat_entity = dialog.entity
-                chat_type = 'user'
-                
-                # Determine chat type based on entity type
-                entity_type = type(chat_entity).__name__
-                
-                if entity_type == 'User':
-                    if getattr(chat_entity, 'bot', False):
-                        chat_type = 'bot'
-                    else:
-                        chat_type = 'user'
-                elif entity_type == 'Chat':
-                    chat_type = 'group'
-                elif entity_type == 'Channel':
-                    if getattr(chat_entity, 'megagroup', False):
-                        chat_type = 'group'
-                    elif getattr(chat_entity, 'broadcast', False):
-                        chat_type = 'channel'
-                    elif getattr(chat_entity, 'gigagroup', False):
-                        chat_type = 'group'
-                    else:
-                        chat_type = 'channel'
-                
-                # Get chat name safely
-                chat_name = 'Chat inconnu'
-                if hasattr(chat_entity, 'title') and chat_entity.title:
-                    chat_name = chat_entity.title
-                elif hasattr(chat_entity, 'first_name'):
-                    chat_name = chat_entity.first_name
-                    if hasattr(chat_entity, 'last_name') and chat_entity.last_name:
-                        chat_name += f' {chat_entity.last_name}'
-                elif hasattr(chat_entity, 'username') and chat_entity.username:
-                    chat_name = f'@{chat_entity.username}'
-                else:
-                    chat_name = f'Chat {chat_entity.id}'
-                
-                chat_data = {
-                    'id': chat_entity.id,
-                    'name': chat_name,
-                    'type': chat_type,
-                    'username': getattr(chat_entity, 'username', None)
-                }
-                chats.append(chat_data)
-                
-            except Exception as e:
-                logger.error(f"Error processing chat entity: {str(e)}")
-                import traceback
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-                continue
-            
-        return chats
+        from bot.dialog_snapshot import dialog_snapshots
+        return (await dialog_snapshots.load(user_id, phone_number)).chats()
         
     except Exception as e:
         logger.error(f"Error getting real chats: {e}")
@@ -253,18 +264,9 @@ async def get_real_user_chats(user_id, phone_number):
 async def get_real_user_chats_by_type(user_id, phone_number, chat_type):
     """Get real chats of a specific type for a user and phone number"""
     try:
-        logger.info(f"Getting chats of type '{chat_type}' for user {user_id}")
-        all_chats = await get_real_user_chats(user_id, phone_number)
-        logger.info(f"Retrieved {len(all_chats)} total chats")
-        
-        filtered_chats = []
-        for chat in all_chats:
-            if chat.get('type') == chat_type:
-                filtered_chats.append(chat)
-        
-        logger.info(f"Filtered to {len(filtered_chats)} chats of type '{chat_type}'")
-        return filtered_chats
+        from bot.dialog_snapshot import dialog_snapshots
+        return (await dialog_snapshots.load(user_id, phone_number)).chats(chat_type)
         
     except Exception as e:
         logger.error(f"Error in get_real_user_chats_by_type: {e}")
-        return []
\ No newline at end of file
+        return []
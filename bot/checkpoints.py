@@ -0,0 +1,81 @@
+"""
+Points de reprise par (source, destination)
+Dernier ID de message transféré, gardé en mémoire et écrit par lots, pour
+rattraper après un redémarrage les messages publiés pendant l'arrêt
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+
+from bot.database import data_store, get_checkpoints, store_checkpoints
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checkpoint writes
+CHECKPOINT_FLUSH_DELAY = float(os.getenv("CHECKPOINT_FLUSH_DELAY", "5.0"))
+
+class CheckpointStore:
+    """Last forwarded message id per (source, destination)"""
+
+    def __init__(self, flush_delay=CHECKPOINT_FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self.positions = {}  # source_key -> {destination_key (str): message id}
+        self.dirty = set()
+        self._flush_handle = None
+
+    async def load(self, source):
+        """Positions of a source, read from storage the first time"""
+        source_key = bare_peer_id(source)
+        positions = self.positions.get(source_key)
+        if positions is None:
+            positions = self.positions[source_key] = await get_checkpoints(source_key)
+        return positions
+
+    async def get(self, source, destination):
+        positions = await self.load(source)
+        return positions.get(str(bare_peer_id(destination)))
+
+    def peek(self, source, destination):
+        """Position if already loaded, without touching storage"""
+        positions = self.positions.get(bare_peer_id(source))
+        if positions is None:
+            return None
+        return positions.get(str(bare_peer_id(destination)))
+
+    async def advance(self, source, destination, message_id):
+        """Move a checkpoint forward (never backwards)"""
+        positions = await self.load(source)
+        destination_key = str(bare_peer_id(destination))
+        if message_id <= positions.get(destination_key, 0):
+            return
+        positions[destination_key] = message_id
+        self.dirty.add(bare_peer_id(source))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write every changed source in one pass"""
+        dirty, self.dirty = self.dirty, set()
+        for source_key in dirty:
+            try:
+                await store_checkpoints(source_key, self.positions[source_key])
+            except Exception as e:
+                self.dirty.add(source_key)
+                logger.error(f"Error saving checkpoints of {source_key}: {e}")
+
+    def close(self):
+        """Write pending checkpoints synchronously (interpreter exit)"""
+        for source_key in self.dirty:
+            data_store.put("checkpoints", source_key, dict(self.positions[source_key]))
+        self.dirty.clear()
+
+# Global checkpoint store, advanced by the forwarder
+checkpoints = CheckpointStore()
+atexit.register(checkpoints.close)
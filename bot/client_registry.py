@@ -0,0 +1,324 @@
+"""
+Registre unique des clients Telegram des comptes connectés
+Un seul TelegramClient par (utilisateur, numéro), partagé par le
+gestionnaire de sessions, les restaurations, /chats et les redirections ;
+chaque sous-système qui en a besoin y tient une référence. Les clients
+sans redirection active sont mis en veille après un délai d'inactivité et
+reconnectés à la demande
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from telethon import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+# Longest a client may take to connect outside of startup
+CLIENT_CONNECT_TIMEOUT = float(os.getenv("CLIENT_CONNECT_TIMEOUT", "30"))
+
+# Seconds without use after which a client with no live redirection is
+# disconnected (0 keeps every client connected), and how often to check
+CLIENT_IDLE_TIMEOUT = float(os.getenv("CLIENT_IDLE_TIMEOUT", "900"))
+CLIENT_IDLE_CHECK = float(os.getenv("CLIENT_IDLE_CHECK", "60"))
+
+def normalize_phone(phone):
+    """Phone number as stored in redirections: digits only, no "+" """
+    return str(phone).strip().lstrip("+")
+
+def find_session_file(user_id, phone):
+    """Session file of an account, trying the names used over time"""
+    for session_file in (
+        f"session_{user_id}_{phone}.session",
+        f"{user_id}_{phone}.session",
+        f"session_{phone}.session",
+        f"{phone}.session"
+    ):
+        if os.path.exists(session_file):
+            return session_file
+    return None
+
+async def _connect(client, user_id):
+    await asyncio.wait_for(client.connect(), CLIENT_CONNECT_TIMEOUT)
+    return await client.is_user_authorized()
+
+class ClientEntry:
+    """One account's client and the subsystems holding it"""
+
+    __slots__ = (
+        "user_id", "phone", "client", "session_name", "holders",
+        "connected_at", "last_used", "busy", "idle"
+    )
+
+    def __init__(self, user_id, phone, client, session_name):
+        self.user_id = user_id
+        self.phone = phone
+        self.client = client
+        self.session_name = session_name
+        self.holders = {}  # "session", "redirections", "chats", "backfill", ... -> references
+        self.connected_at = datetime.now()
+        self.last_used = time.monotonic()
+        self.busy = 0  # long operations (backfills) running on the client
+        self.idle = False  # disconnected by the idle eviction
+
+    @property
+    def connected(self):
+        return self.client.is_connected()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def hold(self, holder, once=False):
+        if once:
+            self.holders[holder] = max(self.holders.get(holder, 0), 1)
+        else:
+            self.holders[holder] = self.holders.get(holder, 0) + 1
+
+    def has_live_rules(self):
+        from bot.routing import routers
+        router = routers.get(self.client)
+        return bool(router and router.rules)
+
+class ClientRegistry:
+    """Exactly one client per (user_id, phone)
+
+    Opening the same .session file from two TelegramClient objects doubles
+    sockets and update streams and locks the session's SQLite file, so
+    every subsystem goes through acquire()/release() here. Holders are
+    counted per name, so two backfills on one account each keep the client;
+    a client is disconnected when its last reference is released.
+
+    Clients serving no redirection are only needed for the occasional
+    /chats or backfill: after CLIENT_IDLE_TIMEOUT without use they are
+    disconnected but kept, and acquire() reconnects the same client object.
+    """
+
+    def __init__(self, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.entries = {}  # (user_id, phone) -> ClientEntry
+        self.idle_timeout = idle_timeout
+        self.evictions = 0
+        self.reconnects = 0
+        self._locks = {}
+        self._eviction_task = None
+
+    def _lock(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def entry(self, user_id, phone=None):
+        """Entry of an account; without a phone, the user's latest one"""
+        if phone is not None:
+            return self.entries.get((user_id, normalize_phone(phone)))
+        entries = self.user_entries(user_id)
+        return entries[-1] if entries else None
+
+    def user_entries(self, user_id):
+        return [entry for (owner, _), entry in self.entries.items() if owner == user_id]
+
+    def get(self, user_id, phone=None):
+        """Connected client of an account, or None (never connects)"""
+        entry = self.entry(user_id, phone)
+        if entry is None or not entry.connected:
+            return None
+        entry.touch()
+        return entry.client
+
+    @contextmanager
+    def busy(self, user_id, phone):
+        """Keep an account's client from being evicted while in the block"""
+        entry = self.entry(user_id, phone)
+        if entry is not None:
+            entry.busy += 1
+        try:
+            yield
+        finally:
+            if entry is not None:
+                entry.busy -= 1
+                entry.touch()
+
+    async def acquire(self, user_id, phone, holder, session_file=None, connect=None, once=False):
+        """Client of an account for `holder`, connecting its session if needed
+
+        `connect(client, user_id)` must connect and return whether the
+        session is authorized (defaults to a plain connect with a timeout).
+        Each call takes one reference to release, except with `once`: standing
+        holds re-acquired on every sync ("session", "redirections", "chats")
+        keep a single reference. Returns None when the account has no usable
+        session.
+        """
+        key = (user_id, normalize_phone(phone))
+        async with self._lock(key):
+            entry = self.entries.get(key)
+            if entry is not None and entry.connected:
+                entry.hold(holder, once)
+                entry.touch()
+                return entry.client
+
+            if entry is not None:
+                # Known account that was evicted or whose connection dropped:
+                # reuse the same client so its routers stay attached
+                client = entry.client
+                if entry.idle:
+                    self.reconnects += 1
+            else:
+                session_file = session_file or find_session_file(user_id, key[1])
+                if session_file is None:
+                    logger.warning(f"No session file for {user_id}:{key[1]}")
+                    return None
+                client = TelegramClient(
+                    session_file.replace('.session', ''),  # Telethon expects name without .session
+                    int(os.getenv("API_ID")),
+                    os.getenv("API_HASH")
+                )
+
+            try:
+                authorized = await (connect or _connect)(client, user_id)
+            except Exception as e:
+                logger.error(f"Error connecting {user_id}:{key[1]}: {e}")
+                authorized = False
+            else:
+                if not authorized:
+                    logger.warning(f"Session of {user_id}:{key[1]} is not authorized")
+            if not authorized:
+                if entry is not None:
+                    # Revoked or expired session: forget it so /connect can
+                    # sign the account in again
+                    await self._forget(key, entry)
+                else:
+                    await client.disconnect()
+                return None
+
+            if entry is None:
+                entry = self.entries[key] = ClientEntry(user_id, key[1], client, session_file)
+            entry.connected_at = datetime.now()
+            entry.idle = False
+            entry.touch()
+            entry.hold(holder, once)
+            logger.info(f"Client of {user_id}:{key[1]} connected for {holder}")
+            return client
+
+    async def register(self, user_id, phone, client, holder, session_name=None):
+        """Adopt a client that just signed in (/connect), replacing any other"""
+        key = (user_id, normalize_phone(phone))
+        async with self._lock(key):
+            entry = self.entries.get(key)
+            if entry is not None and entry.client is not client:
+                # Same account signed in again: the new client takes over
+                # (the caller syncs the redirections onto it)
+                old_client = entry.client
+                entry.client = client
+                entry.session_name = session_name or entry.session_name
+                entry.connected_at = datetime.now()
+                from bot.routing import routers
+                router = routers.get(old_client)
+                if router is not None:
+                    router.detach()
+                await old_client.disconnect()
+            elif entry is None:
+                entry = self.entries[key] = ClientEntry(user_id, key[1], client, session_name)
+            entry.idle = False
+            entry.touch()
+            entry.hold(holder, once=True)
+            return entry
+
+    async def _forget(self, key, entry):
+        """Drop an entry, disconnect its client and detach its redirections"""
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+        from bot.routing import routers
+        router = routers.get(entry.client)
+        if router is not None:
+            router.detach()
+        from bot.entity_cache import entity_caches
+        entity_caches.pop(entry.client, None)
+        await entry.client.disconnect()
+
+    async def release(self, user_id, phone, holder):
+        """Drop one reference of a holder; the client is disconnected when none is left"""
+        key = (user_id, normalize_phone(phone))
+        async with self._lock(key):
+            entry = self.entries.get(key)
+            if entry is None or holder not in entry.holders:
+                return
+            entry.holders[holder] -= 1
+            if entry.holders[holder] <= 0:
+                del entry.holders[holder]
+            if not entry.holders:
+                await self._forget(key, entry)
+                logger.info(f"Client of {user_id}:{key[1]} released")
+
+    async def close(self, user_id, phone, holder="session"):
+        """Drop every reference of `holder` and close the client if nobody else holds it
+
+        Returns False while other holders remain: their own release closes
+        the client later.
+        """
+        key = (user_id, normalize_phone(phone))
+        async with self._lock(key):
+            entry = self.entries.get(key)
+            if entry is None:
+                return True
+            entry.holders.pop(holder, None)
+            if entry.holders:
+                logger.info(f"Client of {user_id}:{key[1]} kept for {', '.join(sorted(entry.holders))}")
+                return False
+            await self._forget(key, entry)
+            logger.info(f"Client of {user_id}:{key[1]} closed")
+            return True
+
+    async def evict_idle(self):
+        """Disconnect the clients idle for longer than the timeout; returns how many"""
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for key, entry in list(self.entries.items()):
+            if not entry.connected or entry.last_used > deadline or entry.busy or entry.has_live_rules():
+                continue
+            async with self._lock(key):
+                # Re-check: the client may have been acquired meanwhile
+                if self.entries.get(key) is not entry or not entry.connected or entry.last_used > deadline \
+                        or entry.busy or entry.has_live_rules():
+                    continue
+                await entry.client.disconnect()
+                entry.idle = True
+                # The entity cache is rebuilt from the dialogs on reconnect
+                from bot.entity_cache import entity_caches
+                entity_caches.pop(entry.client, None)
+                evicted += 1
+                logger.info(f"Idle client of {key[0]}:{key[1]} disconnected")
+        self.evictions += evicted
+        return evicted
+
+    async def _evict_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error evicting idle clients: {e}")
+
+    def start_eviction(self, interval=CLIENT_IDLE_CHECK):
+        """Start the periodic idle eviction (no-op when disabled or running)"""
+        if self.idle_timeout <= 0 or self._eviction_task is not None:
+            return self._eviction_task
+        self._eviction_task = asyncio.get_running_loop().create_task(self._evict_loop(interval))
+        return self._eviction_task
+
+    def stats(self):
+        entries = list(self.entries.values())
+        return {
+            "clients": len(entries),
+            "connected": sum(1 for entry in entries if entry.connected),
+            "idle": sum(1 for entry in entries if entry.idle and not entry.connected),
+            "users": len({entry.user_id for entry in entries}),
+            "evictions": self.evictions,
+            "reconnects": self.reconnects
+        }
+
+# Global registry shared by every subsystem
+client_registry = ClientRegistry()
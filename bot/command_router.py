@@ -0,0 +1,95 @@
+"""
+Routage des commandes du bot
+Un seul gestionnaire de messages : le premier mot est découpé une fois et
+désigne directement la commande (dictionnaire), ses sous-commandes éventuelles
+("/payer une semaine", "/railway test") étant cherchées dans une table
+propre à la commande. Chaque message exécute au plus un gestionnaire.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class CommandRoute:
+    """Handler of a command and of its subcommands"""
+
+    __slots__ = ("handler", "subcommands", "depth")
+
+    def __init__(self):
+        self.handler = None
+        self.subcommands = {}  # tuple of words after the command -> handler
+        self.depth = 0  # longest subcommand, in words
+
+class CommandRouter:
+    """Dispatch "/command args" messages to exactly one handler
+
+    Latency counters are kept per routed command: count, total and
+    slowest run, in seconds.
+    """
+
+    def __init__(self):
+        self.routes = {}  # "/command" -> CommandRoute
+        self.latency = {}  # route name -> [count, total, max]
+        self.unknown = 0
+
+    def command(self, name, subcommand=None):
+        """Decorator registering a handler for "/name [subcommand]" """
+        def register(handler):
+            route = self.routes.setdefault(name, CommandRoute())
+            if subcommand is None:
+                route.handler = handler
+            else:
+                words = tuple(subcommand.split())
+                route.subcommands[words] = handler
+                route.depth = max(route.depth, len(words))
+            return handler
+        return register
+
+    def resolve(self, text):
+        """Route name and handler of a command message, (None, None) if unknown"""
+        words = text.split()
+        if not words:
+            return None, None
+        # "/start@TeleFeedBot" is sent by the command menu in groups
+        command = words[0].split("@", 1)[0]
+        route = self.routes.get(command)
+        if route is None:
+            return None, None
+        # Longest subcommand first, so "/payer une semaine" wins over "/payer"
+        for depth in range(min(route.depth, len(words) - 1), 0, -1):
+            handler = route.subcommands.get(tuple(words[1:depth + 1]))
+            if handler is not None:
+                return " ".join([command] + words[1:depth + 1]), handler
+        return (command, route.handler) if route.handler else (None, None)
+
+    async def dispatch(self, event):
+        """Run the handler of a command message; False if the command is unknown"""
+        name, handler = self.resolve(event.text)
+        if handler is None:
+            self.unknown += 1
+            return False
+
+        started = time.monotonic()
+        try:
+            await handler(event)
+        finally:
+            elapsed = time.monotonic() - started
+            counters = self.latency.setdefault(name, [0, 0.0, 0.0])
+            counters[0] += 1
+            counters[1] += elapsed
+            counters[2] = max(counters[2], elapsed)
+        return True
+
+    def stats(self):
+        """Per-command count, average and max latency, busiest first"""
+        return sorted(
+            (
+                {'command': name, 'count': count, 'average': total / count, 'max': slowest}
+                for name, (count, total, slowest) in self.latency.items()
+            ),
+            key=lambda stat: stat['count'], reverse=True
+        )
+
+# Instance globale
+command_router = CommandRouter()
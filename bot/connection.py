@@ -3,12 +3,11 @@ import re
 import os
 from telethon import TelegramClient
 from telethon.errors import PhoneNumberInvalidError, FloodWaitError
+from bot.client_registry import client_registry
+from bot.conversation import conversation_states, AWAITING_CODE
 
 logger = logging.getLogger(__name__)
 
-# Store active connection sessions
-active_connections = {}
-
 async def handle_connect(event, client):
     """
     Handle /connect command
@@ -53,6 +52,13 @@ async def handle_connect(event, client):
         # Format phone number for Telegram API
         formatted_phone = f"+{phone_number}"
         
+        # A live, authorized session needs no new login; any other entry
+        # (idle, dropped or revoked) is replaced by register() after sign-in
+        entry = client_registry.entry(user_id, phone_number)
+        if entry is not None and entry.connected and await entry.client.is_user_authorized():
+            await event.respond(f"✅ **Déjà connecté**\n\nLe numéro {formatted_phone} est déjà connecté à TeleFeed.")
+            return
+        
         await event.respond("🔄 **Initiation de la connexion...**\n\nTentative de connexion en cours...")
         
         # Create a new client session for this phone number
@@ -71,13 +77,15 @@ async def handle_connect(event, client):
             # Send code request
             result = await new_client.send_code_request(formatted_phone)
             
-            # Store the connection session
-            active_connections[user_id] = {
+            # Keep the login until the code arrives (or the state expires,
+            # which disconnects the login client); signed-in clients live
+            # in the client registry
+            conversation_states.set(user_id, AWAITING_CODE, {
                 'client': new_client,
                 'phone': formatted_phone,
                 'phone_code_hash': result.phone_code_hash,
                 'session_name': session_name
-            }
+            })
             
             success_message = f"""
 ✅ **Code de vérification envoyé !**
@@ -122,7 +130,8 @@ async def handle_verification_code(event, client):
         message_text = event.text.strip()
         
         # Check if user has an active connection attempt
-        if user_id not in active_connections:
+        state = conversation_states.get(user_id, AWAITING_CODE)
+        if state is None:
             return False  # Not a verification code
         
         # Check if message starts with 'aa' (verification code format)
@@ -136,7 +145,7 @@ async def handle_verification_code(event, client):
             await event.respond("❌ **Code invalide**\n\nLe code doit contenir uniquement des chiffres après 'aa'.")
             return True
         
-        connection_data = active_connections[user_id]
+        connection_data = state.data
         new_client = connection_data['client']
         phone = connection_data['phone']
         phone_code_hash = connection_data['phone_code_hash']
@@ -167,24 +176,19 @@ async def handle_verification_code(event, client):
             # Store the successful connection
             await store_successful_connection(user_id, phone)
             
-            # Keep the client active for chat operations and redirections
-            active_connections[user_id] = {
-                'client': new_client,
-                'phone': phone,
-                'connected': True,
-                'session_name': connection_data['session_name']
-            }
-            
-            # Store in connection function for restoration
-            await store_connection_client(user_id, phone, new_client)
+            # Keep the client active for chat operations and redirections,
+            # replacing any client already open on this phone
+            conversation_states.pop(user_id, AWAITING_CODE)
+            await client_registry.register(user_id, phone, new_client, "connect", connection_data['session_name'])
             
             # Store session in persistent database
             from bot.session_manager import session_manager
             await session_manager.store_session(user_id, phone, connection_data['session_name'])
             
-            # Setup message redirection handlers for existing redirections
+            # Attach this user's stored redirections to the new client
+            # (replaces any rules left on a previous client)
             from bot.message_handler import message_redirector
-            await message_redirector.setup_redirection_handlers()
+            await message_redirector.sync_user_redirections(user_id)
             
             logger.info(f"Successful connection for user {user_id} with phone {phone}")
             return True
@@ -221,21 +225,3 @@ async def is_phone_connected(user_id, phone_number):
     """
     # In real implementation, check database
     return False
-
-async def store_connection_client(user_id, phone_number, client):
-    """
-    Store connection with client for restoration
-    """
-    try:
-        from datetime import datetime
-        active_connections[user_id] = {
-            'phone': phone_number,
-            'connected_at': datetime.now(),
-            'client': client,
-            'connected': True
-        }
-        logger.info(f"Active connection with client stored for user {user_id}")
-        
-    except Exception as e:
-        logger.error(f"Error storing active connection with client: {e}")
-        raise
\ No newline at end of file
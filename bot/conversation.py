@@ -0,0 +1,130 @@
+"""
+États de conversation des utilisateurs
+Ce que le bot attend du prochain message d'un utilisateur (code de
+vérification, IDs de redirection, code de licence), en mémoire et avec une
+durée de vie : un message ordinaire ne coûte qu'une recherche dans un
+dictionnaire, sans accès disque
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+AWAITING_CODE = "awaiting_code"
+AWAITING_REDIRECTION_IDS = "awaiting_redirection_ids"
+AWAITING_LICENSE = "awaiting_license"
+
+# Seconds each state stays valid after the prompt, and how often expired
+# states are purged
+STATE_TTLS = {
+    AWAITING_CODE: float(os.getenv("CONVERSATION_CODE_TTL", "600")),
+    AWAITING_REDIRECTION_IDS: float(os.getenv("CONVERSATION_REDIRECTION_TTL", "1800")),
+    AWAITING_LICENSE: float(os.getenv("CONVERSATION_LICENSE_TTL", "900"))
+}
+CONVERSATION_PURGE_INTERVAL = float(os.getenv("CONVERSATION_PURGE_INTERVAL", "60"))
+
+class ConversationState:
+    """What one user's next message is expected to be"""
+
+    __slots__ = ("name", "data", "expires_at")
+
+    def __init__(self, name, data, expires_at):
+        self.name = name
+        self.data = data
+        self.expires_at = expires_at
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+class ConversationStates:
+    """One pending state per user, replaced by the latest prompt
+
+    A state whose data holds a login client ('client') that is dropped
+    unused (expired or replaced) disconnects that client.
+    """
+
+    def __init__(self):
+        self.states = {}  # user_id -> ConversationState
+        self.expired = 0
+        self._purge_task = None
+
+    def set(self, user_id, name, data=None):
+        """Wait for `name` from the user's next messages, for its TTL"""
+        previous = self.states.get(user_id)
+        self.states[user_id] = ConversationState(name, data or {}, time.monotonic() + STATE_TTLS[name])
+        if previous is not None:
+            self._discard(previous)
+
+    def get(self, user_id, name=None):
+        """Live state of a user (of the given kind when `name` is set), or None"""
+        state = self.states.get(user_id)
+        if state is None:
+            return None
+        if state.expired:
+            self._expire(user_id, state)
+            return None
+        return state if name is None or state.name == name else None
+
+    def pop(self, user_id, name=None):
+        """Remove and return a user's state once it has been answered
+
+        An answer read before the TTL ran out still counts, so the state is
+        returned even if it expired meanwhile (e.g. during sign-in).
+        """
+        state = self.states.get(user_id)
+        if state is None or (name is not None and state.name != name):
+            return None
+        return self.states.pop(user_id)
+
+    def users(self, name):
+        """Live states of a kind, by user"""
+        return {
+            user_id: state for user_id, state in self.states.items()
+            if state.name == name and not state.expired
+        }
+
+    def _expire(self, user_id, state):
+        del self.states[user_id]
+        self.expired += 1
+        self._discard(state)
+        logger.info(f"Conversation state {state.name} expired for user {user_id}")
+
+    def _discard(self, state):
+        client = state.data.get('client')
+        if client is not None:
+            asyncio.get_running_loop().create_task(client.disconnect())
+
+    def purge(self):
+        """Drop every expired state"""
+        for user_id, state in list(self.states.items()):
+            if state.expired:
+                self._expire(user_id, state)
+
+    async def _purge_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.purge()
+            except Exception as e:
+                logger.error(f"Error purging conversation states: {e}")
+
+    def start_purge(self, interval=CONVERSATION_PURGE_INTERVAL):
+        """Start the periodic purge of expired states (no-op when running)"""
+        if self._purge_task is None:
+            self._purge_task = asyncio.get_running_loop().create_task(self._purge_loop(interval))
+        return self._purge_task
+
+    def stats(self):
+        counts = {name: 0 for name in STATE_TTLS}
+        for state in self.states.values():
+            if not state.expired:
+                counts[state.name] += 1
+        counts['expired'] = self.expired
+        return counts
+
+# Instance globale
+conversation_states = ConversationStates()
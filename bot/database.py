@@ -1,180 +1,679 @@
 import logging
 import json
 import os
+import asyncio
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 # Simple file-based storage for demo purposes
 DATA_FILE = "user_data.json"
+JOURNAL_FILE = "user_data.journal"
 
-def load_data():
-    """Load user data from file"""
-    if os.path.exists(DATA_FILE):
+# "json" rewrites the whole file on each flush, "journal" appends changes
+# to JOURNAL_FILE and only rewrites DATA_FILE when compacting, "sqlite"
+# stores everything in indexed tables (see bot/database_sqlite.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+
+# Seconds to wait after a change before writing, so that a burst of
+# commands produces a single write
+FLUSH_DELAY = float(os.getenv("DATA_FLUSH_DELAY", "1.0"))
+
+# Journal size (bytes) above which it is folded into a new snapshot
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
+
+SECTIONS = (
+    "licenses",
+    "connections",
+    "redirections",
+    "transformations",
+    "whitelists",
+    "blacklists",
+    "chats",
+    "deliveries",
+    "checkpoints",
+    "backfills",
+    "dialogs"
+)
+
+# One dedicated thread performs every storage write (and every SQLite
+# read), so disk I/O never runs on the Telethon event loop and operations
+# apply in the order they were issued
+storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+def _empty_data():
+    return {section: {} for section in SECTIONS}
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+class DataStore:
+    """Process-wide in-memory copy of user_data.json
+
+    Reads are plain dict lookups. Mutations mark their section dirty and
+    schedule a debounced flush which writes a temp file and renames it over
+    DATA_FILE, so the file is never left half-written. Each section keeps
+    its last serialized form, so a flush only re-encodes dirty sections.
+    """
+
+    # Operations are memory-only and safe to call on the event loop
+    blocking = False
+
+    def __init__(self, path=DATA_FILE, flush_delay=FLUSH_DELAY):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.data = None
+        self.dirty = set()
+        self._encoded = {}
+        self._flush_handle = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """Return the cached document, reading the file on first use"""
+        if self.data is None:
+            with self._load_lock:
+                if self.data is None:
+                    self.data = self._read()
+        return self.data
+
+    def _read(self):
+        data = _empty_data()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data.update(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading data: {e}")
+        return data
+
+    def get(self, section, key, default=None):
+        return self.load()[section].get(str(key), default)
+
+    def items(self, section):
+        return self.load()[section].items()
+
+    def put(self, section, key, value):
+        self.load()[section][str(key)] = value
+        self.mark_dirty(section)
+
+    def update(self, section, key, function, default=None):
+        """Store function(current value) as the new value and return it
+
+        The read and the write happen in one call, so concurrent merges into
+        the same entry cannot overwrite each other. `function` must return a
+        new value rather than mutate the current one, or the current value
+        itself to leave the entry untouched.
+        """
+        current = self.get(section, key, default)
+        value = function(current)
+        if value is not current:
+            self.put(section, key, value)
+        return value
+
+    def pop(self, section, key):
+        value = self.load()[section].pop(str(key), None)
+        if value is not None:
+            self.mark_dirty(section)
+        return value
+
+    def replace(self, data):
+        """Swap the whole document (legacy save_data callers)"""
+        for section in SECTIONS:
+            data.setdefault(section, {})
+        self.data = data
+        self.dirty.update(data.keys())
+        self._schedule_flush()
+
+    def redirections_for_phone(self, user_id, phone_number):
+        """Return {name: redirection} for one user and phone"""
+        return {
+            name: redir for name, redir in self.get("redirections", user_id, {}).items()
+            if redir.get("phone") == phone_number
+        }
+
+    def redirections_for_source(self, source_id):
+        """Return [(user_id, redirection)] reading from source_id"""
+        return [
+            (user_id, redir)
+            for user_id, user_redirections in self.items("redirections")
+            for redir in user_redirections.values()
+            if str(redir.get("source_id")) == str(source_id)
+        ]
+
+    def user_overview(self):
+        """Return ({user_id: license_active}, {user_id: phone_count})"""
+        licenses = {
+            user_id: bool(license_data.get("active", False))
+            for user_id, license_data in self.items("licenses")
+        }
+        connections = {
+            user_id: len(user_connections)
+            for user_id, user_connections in self.items("connections")
+        }
+        return licenses, connections
+
+    def stats(self):
+        """Return counters for the admin /stats command"""
+        data = self.load()
+        return {
+            "licenses": len(data["licenses"]),
+            "active_licenses": sum(1 for license_data in data["licenses"].values() if license_data.get("active", False)),
+            "connections": len(data["connections"]),
+            "redirections": sum(len(redirections) for redirections in data["redirections"].values()),
+            "transformations": len(data["transformations"]),
+            "whitelists": len(data["whitelists"]),
+            "blacklists": len(data["blacklists"])
+        }
+
+    def mark_dirty(self, section):
+        self.dirty.add(section)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, shutdown): write immediately
+            self.flush()
+            return
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self._flush_in_background)
+
+    def _flush_in_background(self):
+        self._flush_handle = None
+        job = self._prepare()
+        if job:
+            storage_executor.submit(self._persist, *job)
+
+    def _take_dirty(self):
+        """Clear and return the dirty sections, dropping their cached encoding"""
+        dirty = self.dirty
+        self.dirty = set()
+        for section in dirty:
+            self._encoded.pop(section, None)
+        return dirty
+
+    def _encode_document(self):
+        parts = []
+        for section, entries in self.data.items():
+            encoded = self._encoded.get(section)
+            if encoded is None:
+                encoded = self._encoded[section] = _dumps(entries)
+            parts.append(f"{_dumps(section)}:{encoded}")
+        return "{" + ",".join(parts) + "}"
+
+    def _prepare(self):
+        """Serialize pending changes; must run on the owning thread"""
+        if not self.dirty or self.data is None:
+            return None
+        dirty = self._take_dirty()
+        logger.debug(f"Flushing sections: {', '.join(sorted(dirty))}")
+        return (self._encode_document(),)
+
+    def _persist(self, payload):
+        self._write_snapshot(payload)
+
+    def _write_snapshot(self, payload):
+        """Write the document over DATA_FILE; returns False if it was not replaced"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving data: {e}")
+            return False
+        return True
+
+    def flush(self):
+        """Write pending changes now"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        job = self._prepare()
+        if not job:
+            return
+        try:
+            # Queue behind earlier flushes so they cannot land after this one
+            storage_executor.submit(self._persist, *job).result()
+        except RuntimeError:
+            # Executor already shut down (interpreter exit)
+            self._persist(*job)
+
+class JournalDataStore(DataStore):
+    """DataStore that appends each change to a JSONL journal
+
+    Every put/pop becomes one compact record, and each debounced flush
+    appends its batch and fsyncs once, so write cost follows the size of the
+    change. When the journal passes JOURNAL_COMPACT_BYTES the next flush
+    writes a fresh snapshot to DATA_FILE and truncates the journal. On load
+    the snapshot is read and the journal replayed on top of it.
+    """
+
+    def __init__(self, path=DATA_FILE, journal_path=JOURNAL_FILE,
+                 compact_bytes=JOURNAL_COMPACT_BYTES, flush_delay=FLUSH_DELAY):
+        super().__init__(path, flush_delay)
+        self.journal_path = journal_path
+        self.compact_bytes = compact_bytes
+        self.pending = []
+        self.journal_size = 0
+        self._needs_snapshot = False
+
+    def _read(self):
+        data = super()._read()
+        if not os.path.exists(self.journal_path):
+            return data
+        replayed = 0
+        valid_size = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write at the tail from a crash: drop it
+                        logger.warning(f"Ignoring truncated journal record at byte {valid_size}")
+                        break
+                    self._apply(data, record)
+                    valid_size += len(line)
+                    replayed += 1
+            if valid_size != os.path.getsize(self.journal_path):
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(valid_size)
+        except Exception as e:
+            logger.error(f"Error replaying journal: {e}")
+        self.journal_size = valid_size
+        if replayed:
+            logger.info(f"Replayed {replayed} journal records")
+        return data
+
+    @staticmethod
+    def _apply(data, record):
+        section = data.setdefault(record["s"], {})
+        if record["op"] == "put":
+            section[record["k"]] = record["v"]
+        else:
+            section.pop(record["k"], None)
+
+    def put(self, section, key, value):
+        self.pending.append({"op": "put", "s": section, "k": str(key), "v": value})
+        super().put(section, key, value)
+
+    def pop(self, section, key):
+        if str(key) in self.load()[section]:
+            self.pending.append({"op": "del", "s": section, "k": str(key)})
+        return super().pop(section, key)
+
+    def replace(self, data):
+        self._needs_snapshot = True
+        super().replace(data)
+
+    def _prepare(self):
+        if not self.dirty or self.data is None:
+            return None
+        self._take_dirty()
+        records = "".join(_dumps(record) + "\n" for record in self.pending).encode()
+        self.pending = []
+        if self._needs_snapshot or self.journal_size + len(records) > self.compact_bytes:
+            # The snapshot already contains these records; they are only
+            # appended if it cannot be written
+            self._needs_snapshot = False
+            self.journal_size = 0
+            return records, self._encode_document()
+        self.journal_size += len(records)
+        return records, None
+
+    def _persist(self, records, snapshot):
+        if snapshot is not None:
+            # The journal is only emptied once the new snapshot has replaced
+            # DATA_FILE: a failed write (ENOSPC, EIO) keeps the old snapshot
+            # and its journal, and the next flush tries to compact again
+            if not self._write_snapshot(snapshot):
+                self._needs_snapshot = True
+            else:
+                try:
+                    with open(self.journal_path, 'wb') as f:
+                        f.flush()
+                        os.fsync(f.fileno())
+                    logger.info("Journal compacted into snapshot")
+                    return
+                except Exception as e:
+                    # Replaying the old records over the new snapshot ends
+                    # in the same state, as long as this batch follows them
+                    logger.error(f"Error truncating journal: {e}")
         try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                # Ensure all required keys exist
-                if "pending_redirections" not in data:
-                    data["pending_redirections"] = {}
-                    save_data(data)  # Save updated structure
-                return data
+            with open(self.journal_path, 'ab') as f:
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
         except Exception as e:
-            logger.error(f"Error loading data: {e}")
-    return {
-        "licenses": {},
-        "connections": {},
-        "redirections": {},
-        "transformations": {},
-        "whitelists": {},
-        "blacklists": {},
-        "chats": {},
-        "pending_redirections": {}
-    }
+            logger.error(f"Error appending to journal: {e}")
+
+# Global data store instance
+if STORAGE_BACKEND == "sqlite":
+    from bot.database_sqlite import SqliteDataStore
+    data_store = SqliteDataStore(json_path=DATA_FILE)
+elif STORAGE_BACKEND == "journal":
+    data_store = JournalDataStore()
+else:
+    data_store = DataStore()
+atexit.register(data_store.flush)
+
+async def _call(method, *args):
+    """Run a data store method without blocking the event loop
+
+    In-memory stores answer directly; stores that touch the disk run on the
+    storage thread, queued behind any pending write.
+    """
+    if not data_store.blocking:
+        return method(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage_executor, method, *args)
+
+async def init_storage():
+    """Load the data store on the storage thread before handlers use it"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(storage_executor, data_store.load)
+    logger.info(f"Storage ready ({STORAGE_BACKEND})")
+
+def load_data():
+    """Return the cached user data document"""
+    return data_store.load()
+
+async def get_all_data():
+    """Get the whole user data document"""
+    return await _call(data_store.load)
 
 def save_data(data):
-    """Save user data to file"""
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving data: {e}")
+    """Mark the whole document as changed"""
+    data_store.replace(data)
 
 async def store_license(user_id, license_code):
     """Store validated license"""
-    data = load_data()
-    data["licenses"][str(user_id)] = {
+    await _call(data_store.put, "licenses", user_id, {
         "license": license_code,
         "validated_at": datetime.now().isoformat(),
         "active": True
-    }
-    save_data(data)
+    })
     logger.info(f"License stored for user {user_id}")
 
 async def is_user_licensed(user_id):
     """Check if user has valid license"""
     # Check if user is admin (owner always has access)
-    import os
     admin_id = os.getenv("ADMIN_ID")
     if admin_id and str(user_id) == admin_id:
         return True
     
     # Check regular license
-    data = load_data()
-    user_license = data["licenses"].get(str(user_id))
+    user_license = await _call(data_store.get, "licenses", user_id)
     return user_license and user_license.get("active", False)
 
 async def store_connection(user_id, phone_number):
     """Store successful phone connection - automatically replaces existing connection for same phone"""
-    data = load_data()
-    if str(user_id) not in data["connections"]:
-        data["connections"][str(user_id)] = []
-    
-    # Check if phone already exists and remove it (automatic replacement)
-    data["connections"][str(user_id)] = [
-        conn for conn in data["connections"][str(user_id)] 
-        if conn["phone"] != phone_number
-    ]
-    
-    # Add new connection with current timestamp
-    data["connections"][str(user_id)].append({
-        "phone": phone_number,
-        "connected_at": datetime.now().isoformat(),
-        "active": True,
-        "replaced_at": datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    })
-    save_data(data)
+    def merge(user_connections):
+        # Check if phone already exists and remove it (automatic replacement)
+        return [conn for conn in user_connections if conn["phone"] != phone_number] + [{
+            "phone": phone_number,
+            "connected_at": datetime.now().isoformat(),
+            "active": True,
+            "replaced_at": datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        }]
+
+    await _call(data_store.update, "connections", user_id, merge, [])
     logger.info(f"Connection stored/replaced for user {user_id}: {phone_number}")
 
 async def get_user_connections(user_id):
     """Get user's phone connections"""
-    data = load_data()
-    return data["connections"].get(str(user_id), [])
+    return list(await _call(data_store.get, "connections", user_id, []))
+
+def _as_destination_list(destination_id):
+    if isinstance(destination_id, (list, tuple)):
+        return [str(d) for d in destination_id]
+    return [str(destination_id)] if destination_id else []
+
+def redirection_destinations(redir):
+    """Destination ids of a redirection (older entries have a single one)"""
+    destination_ids = redir.get("destination_ids")
+    if destination_ids:
+        return list(destination_ids)
+    return [redir["destination_id"]] if redir.get("destination_id") else []
 
 async def store_redirection(user_id, name, phone_number, action, channel_name=None, source_id=None, destination_id=None):
     """Store redirection rule"""
-    data = load_data()
-    if str(user_id) not in data["redirections"]:
-        data["redirections"][str(user_id)] = {}
-    
-    if action == "add":
-        # Check if a redirection with same phone already exists and replace it
-        existing_redirection = None
-        for redir_name, redir_data in data["redirections"][str(user_id)].items():
-            if redir_data.get("phone") == phone_number:
-                existing_redirection = redir_name
-                break
-        
-        # If exists, mark as replaced
-        replaced_info = ""
-        if existing_redirection:
-            replaced_info = f" (remplacé: {existing_redirection})"
-            del data["redirections"][str(user_id)][existing_redirection]
-        
-        data["redirections"][str(user_id)][name] = {
-            "phone": phone_number,
-            "name": name,
-            "channel_name": channel_name or name,
-            "source_id": source_id,
-            "destination_id": destination_id,
-            "created_at": datetime.now().isoformat(),
-            "replaced_at": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            "active": True,
-            "replacement_info": replaced_info
-        }
-    elif action == "remove":
-        if name in data["redirections"][str(user_id)]:
-            del data["redirections"][str(user_id)][name]
-    elif action == "change":
-        if name in data["redirections"][str(user_id)]:
-            data["redirections"][str(user_id)][name]["phone"] = phone_number
-            data["redirections"][str(user_id)][name]["channel_name"] = channel_name or name
-            data["redirections"][str(user_id)][name]["source_id"] = source_id
-            data["redirections"][str(user_id)][name]["destination_id"] = destination_id
-            data["redirections"][str(user_id)][name]["updated_at"] = datetime.now().isoformat()
-    
-    save_data(data)
+    destination_ids = _as_destination_list(destination_id)
+
+    def merge(user_redirections):
+        user_redirections = dict(user_redirections)
+        if action == "add":
+            # Several redirections may share a phone (one account feeding many
+            # destinations); only a redirection with the same name is replaced
+            redirection = {
+                "phone": phone_number,
+                "name": name,
+                "channel_name": channel_name or name,
+                "source_id": source_id,
+                "destination_id": destination_ids[0] if destination_ids else None,
+                "destination_ids": destination_ids,
+                "created_at": datetime.now().isoformat(),
+                "active": True
+            }
+            if name in user_redirections:
+                redirection["replaced_at"] = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+                redirection["replacement_info"] = f" (remplacé: {name})"
+            user_redirections[name] = redirection
+        elif action == "remove":
+            user_redirections.pop(name, None)
+        elif action == "change":
+            if name in user_redirections:
+                user_redirections[name] = dict(
+                    user_redirections[name],
+                    phone=phone_number,
+                    channel_name=channel_name or name,
+                    source_id=source_id,
+                    destination_id=destination_ids[0] if destination_ids else None,
+                    destination_ids=destination_ids,
+                    updated_at=datetime.now().isoformat()
+                )
+        return user_redirections
+
+    await _call(data_store.update, "redirections", user_id, merge, {})
+    if action == "remove":
+        def drop_deliveries(user_deliveries):
+            if name not in user_deliveries:
+                return user_deliveries
+            return {k: v for k, v in user_deliveries.items() if k != name}
+
+        await _call(data_store.update, "deliveries", user_id, drop_deliveries, {})
     logger.info(f"Redirection {action} for user {user_id}: {name} -> {channel_name or name}")
 
 async def get_user_redirections(user_id, phone_number):
     """Get user redirections for a phone number"""
-    data = load_data()
-    user_redirections = data["redirections"].get(str(user_id), {})
+    user_redirections = await _call(data_store.redirections_for_phone, user_id, phone_number)
     phone_redirections = []
     
     for name, redir in user_redirections.items():
-        if redir["phone"] == phone_number and redir.get("active", True):
+        if redir.get("active", True):
             phone_redirections.append({
                 "name": name,
                 "channel_name": redir.get("channel_name", name),
+                "source_id": redir.get("source_id"),
+                "destination_ids": redirection_destinations(redir),
                 "status": "Actif"
             })
     
     return phone_redirections
 
-async def store_pending_redirection(user_id, name, phone_number):
-    """Store pending redirection waiting for channel IDs"""
-    data = load_data()
-    data["pending_redirections"][str(user_id)] = {
-        "name": name,
-        "phone_number": phone_number,
-        "created_at": datetime.now().isoformat()
-    }
-    save_data(data)
-    logger.info(f"Pending redirection stored for user {user_id}: {name} on {phone_number}")
-
-async def get_pending_redirection(user_id):
-    """Get pending redirection for user"""
-    data = load_data()
-    return data["pending_redirections"].get(str(user_id))
-
-async def clear_pending_redirection(user_id):
-    """Clear pending redirection for user"""
-    data = load_data()
-    if str(user_id) in data["pending_redirections"]:
-        del data["pending_redirections"][str(user_id)]
-        save_data(data)
-        logger.info(f"Pending redirection cleared for user {user_id}")
+async def get_redirections_for_user(user_id):
+    """Get all redirections of a user as {name: redirection}"""
+    return dict(await _call(data_store.get, "redirections", user_id, {}))
+
+async def get_redirections_by_source(source_id):
+    """Get (user_id, redirection) pairs reading from a source chat"""
+    return await _call(data_store.redirections_for_source, source_id)
+
+async def get_user_overview():
+    """Get license status and phone count per user (admin /users)"""
+    return await _call(data_store.user_overview)
+
+async def get_storage_stats():
+    """Get counters for the admin /stats command"""
+    return await _call(data_store.stats)
+
+async def record_delivery_results(user_id, name, results):
+    """Merge per-destination delivery counters of a redirection
+
+    `results` maps destination id -> (delivered, failed, error or None).
+    """
+    now = datetime.now().isoformat()
+
+    def merge(user_deliveries):
+        redirection_deliveries = dict(user_deliveries.get(name, {}))
+        for destination_id, (delivered, failed, error) in results.items():
+            entry = dict(redirection_deliveries.get(str(destination_id), {"delivered": 0, "failed": 0}))
+            entry["delivered"] += delivered
+            entry["failed"] += failed
+            if delivered:
+                entry["last_delivered_at"] = now
+            if error:
+                entry["last_error"] = error
+                entry["last_error_at"] = now
+            redirection_deliveries[str(destination_id)] = entry
+        return {**user_deliveries, name: redirection_deliveries}
+
+    await _call(data_store.update, "deliveries", user_id, merge, {})
+
+async def get_delivery_results(user_id):
+    """Get {name: {destination_id: counters}} for a user"""
+    return dict(await _call(data_store.get, "deliveries", user_id, {}))
+
+async def get_checkpoints(source_key):
+    """Get {destination_key: last forwarded message id} for a source"""
+    return dict(await _call(data_store.get, "checkpoints", source_key, {}))
+
+async def store_checkpoints(source_key, positions):
+    """Replace the checkpoints of a source"""
+    await _call(data_store.put, "checkpoints", source_key, dict(positions))
+
+async def get_filters(kind, user_id):
+    """Get {redirection name: filter} of a user; kind is "whitelists" or "blacklists" """
+    return dict(await _call(data_store.get, kind, user_id, {}))
+
+async def store_filter(kind, user_id, name, phone_number, keywords, regexes, replace=False):
+    """Add terms to a redirection's filter, or replace them"""
+    def merge(user_filters):
+        entry = user_filters.get(name) if not replace else None
+        if entry is None:
+            entry = {"phone": phone_number, "keywords": [], "regexes": []}
+        entry = dict(
+            entry,
+            phone=phone_number,
+            keywords=list(dict.fromkeys(entry["keywords"] + keywords)),
+            regexes=list(dict.fromkeys(entry["regexes"] + regexes)),
+            updated_at=datetime.now().isoformat()
+        )
+        return {**user_filters, name: entry}
+
+    user_filters = await _call(data_store.update, kind, user_id, merge, {})
+    return user_filters[name]
+
+async def remove_filter(kind, user_id, name):
+    """Remove a redirection's filter; returns True if it existed"""
+    removed = []
+
+    def merge(user_filters):
+        if name not in user_filters:
+            return user_filters
+        removed.append(name)
+        return {key: entry for key, entry in user_filters.items() if key != name}
+
+    await _call(data_store.update, kind, user_id, merge, {})
+    return bool(removed)
+
+async def clear_filters(kind, user_id, phone_number):
+    """Remove every filter of a user on a phone; returns how many were removed"""
+    removed = []
+
+    def merge(user_filters):
+        removed.extend(name for name, entry in user_filters.items() if entry.get("phone") == phone_number)
+        if not removed:
+            return user_filters
+        return {name: entry for name, entry in user_filters.items() if entry.get("phone") != phone_number}
+
+    await _call(data_store.update, kind, user_id, merge, {})
+    return len(removed)
+
+async def get_transformations(user_id):
+    """Get {redirection name: {"phone", "steps"}} of a user"""
+    return dict(await _call(data_store.get, "transformations", user_id, {}))
+
+async def add_transformation_step(user_id, name, phone_number, transform_type, spec):
+    """Append a transformation to a redirection's chain; returns the chain length"""
+    def merge(user_transformations):
+        entry = user_transformations.get(name) or {"phone": phone_number, "steps": []}
+        steps = entry["steps"] + [{
+            "type": transform_type,
+            "spec": spec,
+            "added_at": datetime.now().isoformat()
+        }]
+        return {**user_transformations, name: dict(entry, phone=phone_number, steps=steps)}
+
+    user_transformations = await _call(data_store.update, "transformations", user_id, merge, {})
+    return len(user_transformations[name]["steps"])
+
+async def remove_transformation_steps(user_id, name, transform_type):
+    """Remove the transformations of a type from a redirection; returns how many were removed"""
+    removed = []
+
+    def merge(user_transformations):
+        entry = user_transformations.get(name)
+        if not entry:
+            return user_transformations
+        steps = [step for step in entry["steps"] if step["type"] != transform_type]
+        removed.extend(step for step in entry["steps"] if step["type"] == transform_type)
+        if not removed:
+            return user_transformations
+        user_transformations = {key: value for key, value in user_transformations.items() if key != name}
+        if steps:
+            user_transformations[name] = dict(entry, steps=steps)
+        return user_transformations
+
+    await _call(data_store.update, "transformations", user_id, merge, {})
+    return len(removed)
+
+async def clear_transformation_steps(user_id, phone_number):
+    """Remove every transformation of a user on a phone; returns how many redirections were cleared"""
+    removed = []
+
+    def merge(user_transformations):
+        removed.extend(name for name, entry in user_transformations.items() if entry.get("phone") == phone_number)
+        if not removed:
+            return user_transformations
+        return {name: entry for name, entry in user_transformations.items() if entry.get("phone") != phone_number}
+
+    await _call(data_store.update, "transformations", user_id, merge, {})
+    return len(removed)
+
+async def get_backfill(user_id, name):
+    """Get the backfill job of a redirection, if any"""
+    return (await _call(data_store.get, "backfills", user_id, {})).get(name)
+
+async def store_backfill(user_id, name, job):
+    """Store the progress of a backfill job"""
+    await _call(data_store.update, "backfills", user_id,
+                lambda user_jobs: {**user_jobs, name: dict(job)}, {})
+
+async def get_dialog_snapshot(key):
+    """Get the saved dialog snapshot of an account ("USERID_PHONE")"""
+    return await _call(data_store.get, "dialogs", key)
+
+async def store_dialog_snapshot(key, snapshot):
+    """Store the dialog snapshot of an account"""
+    await _call(data_store.put, "dialogs", key, snapshot)
 
 async def get_user_chats_data(user_id, phone_number, chat_type=None):
     """Get user chats data (comprehensive list of 100+ chats)"""
@@ -0,0 +1,287 @@
+"""
+Backend SQLite pour bot/database.py
+Tables indexées (licences, connexions, redirections) en mode WAL,
+avec migration unique depuis user_data.json
+"""
+
+import json
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+SQLITE_FILE = "user_data.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS licenses (
+    user_id TEXT PRIMARY KEY,
+    active INTEGER NOT NULL DEFAULT 1,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS connections (
+    user_id TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, phone)
+);
+
+CREATE TABLE IF NOT EXISTS redirections (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    phone TEXT,
+    source_id TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_redirections_user_phone ON redirections (user_id, phone);
+CREATE INDEX IF NOT EXISTS idx_redirections_source ON redirections (source_id);
+
+-- Pending redirections are kept in memory now (bot/conversation.py)
+DROP TABLE IF EXISTS pending_redirections;
+
+-- Sections without a dedicated table (transformations, whitelists, ...)
+CREATE TABLE IF NOT EXISTS documents (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (section, key)
+);
+"""
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+class SqliteDataStore:
+    """Same interface as DataStore, backed by indexed SQLite tables
+
+    Every call touches the disk, so bot.database runs them on its storage
+    thread; the connection is only ever used from that thread once the loop
+    is running.
+    """
+
+    blocking = True
+
+    def __init__(self, path=SQLITE_FILE, json_path=None):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if json_path:
+            self.migrate_from_json(json_path)
+
+    def migrate_from_json(self, json_path):
+        """Import user_data.json once, on the first start with SQLite"""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone():
+            return False
+        if not os.path.exists(json_path):
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', '')")
+            return False
+
+        from bot.database import JournalDataStore, JOURNAL_FILE
+        # Reading through the journal store also picks up an unfolded journal
+        data = JournalDataStore(json_path, JOURNAL_FILE)._read()
+        # Pending redirections are kept in memory now
+        data.pop("pending_redirections", None)
+        with self._transaction():
+            for section, entries in data.items():
+                for key, value in entries.items():
+                    self._put(section, key, value)
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (json_path,))
+        logger.info(f"✅ Migration {json_path} → {self.path} terminée")
+        return True
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    # Reads
+
+    def load(self):
+        """Materialize the full document (admin views, legacy callers)"""
+        from bot.database import SECTIONS
+        data = {section: {} for section in SECTIONS}
+        for section in list(data) + self._document_sections():
+            data[section] = dict(self.items(section))
+        return data
+
+    def _document_sections(self):
+        rows = self.conn.execute("SELECT DISTINCT section FROM documents").fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, section, key, default=None):
+        key = str(key)
+        if section == "connections":
+            rows = self.conn.execute(
+                "SELECT data FROM connections WHERE user_id = ? ORDER BY position", (key,)
+            ).fetchall()
+            return [json.loads(row[0]) for row in rows] if rows else default
+        if section == "redirections":
+            rows = self.conn.execute(
+                "SELECT name, data FROM redirections WHERE user_id = ?", (key,)
+            ).fetchall()
+            return {name: json.loads(data) for name, data in rows} if rows else default
+        if section == "licenses":
+            row = self.conn.execute("SELECT data FROM licenses WHERE user_id = ?", (key,)).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT data FROM documents WHERE section = ? AND key = ?", (section, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def items(self, section):
+        if section == "connections":
+            result = {}
+            for user_id, data in self.conn.execute(
+                "SELECT user_id, data FROM connections ORDER BY user_id, position"
+            ):
+                result.setdefault(user_id, []).append(json.loads(data))
+            return result.items()
+        if section == "redirections":
+            result = {}
+            for user_id, name, data in self.conn.execute("SELECT user_id, name, data FROM redirections"):
+                result.setdefault(user_id, {})[name] = json.loads(data)
+            return result.items()
+        if section == "licenses":
+            rows = self.conn.execute("SELECT user_id, data FROM licenses")
+        else:
+            rows = self.conn.execute("SELECT key, data FROM documents WHERE section = ?", (section,))
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def redirections_for_phone(self, user_id, phone_number):
+        rows = self.conn.execute(
+            "SELECT name, data FROM redirections WHERE user_id = ? AND phone = ?",
+            (str(user_id), phone_number)
+        ).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def redirections_for_source(self, source_id):
+        rows = self.conn.execute(
+            "SELECT user_id, data FROM redirections WHERE source_id = ?", (str(source_id),)
+        ).fetchall()
+        return [(user_id, json.loads(data)) for user_id, data in rows]
+
+    def user_overview(self):
+        licenses = {
+            user_id: bool(active)
+            for user_id, active in self.conn.execute("SELECT user_id, active FROM licenses")
+        }
+        connections = dict(self.conn.execute(
+            "SELECT user_id, COUNT(*) FROM connections GROUP BY user_id"
+        ).fetchall())
+        return licenses, connections
+
+    def stats(self):
+        def scalar(query, *args):
+            return self.conn.execute(query, args).fetchone()[0]
+
+        def documents(section):
+            return scalar("SELECT COUNT(*) FROM documents WHERE section = ?", section)
+
+        return {
+            "licenses": scalar("SELECT COUNT(*) FROM licenses"),
+            "active_licenses": scalar("SELECT COUNT(*) FROM licenses WHERE active = 1"),
+            "connections": scalar("SELECT COUNT(DISTINCT user_id) FROM connections"),
+            "redirections": scalar("SELECT COUNT(*) FROM redirections"),
+            "transformations": documents("transformations"),
+            "whitelists": documents("whitelists"),
+            "blacklists": documents("blacklists")
+        }
+
+    # Writes
+
+    def put(self, section, key, value):
+        with self._transaction():
+            self._put(section, str(key), value)
+
+    def _put(self, section, key, value):
+        if section == "licenses":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO licenses (user_id, active, data) VALUES (?, ?, ?)",
+                (key, int(bool(value.get("active", False))), _dumps(value))
+            )
+        elif section == "connections":
+            self.conn.execute("DELETE FROM connections WHERE user_id = ?", (key,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO connections (user_id, phone, position, data) VALUES (?, ?, ?, ?)",
+                [(key, conn.get("phone", ""), position, _dumps(conn)) for position, conn in enumerate(value)]
+            )
+        elif section == "redirections":
+            self.conn.execute("DELETE FROM redirections WHERE user_id = ?", (key,))
+            self.conn.executemany(
+                "INSERT INTO redirections (user_id, name, phone, source_id, active, data) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (key, name, redir.get("phone"), _str_or_none(redir.get("source_id")),
+                     int(bool(redir.get("active", True))), _dumps(redir))
+                    for name, redir in value.items()
+                ]
+            )
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (section, key, data) VALUES (?, ?, ?)",
+                (section, key, _dumps(value))
+            )
+
+    def update(self, section, key, function, default=None):
+        """Read, merge and write an entry in one transaction"""
+        with self._transaction():
+            current = self.get(section, key, default)
+            value = function(current)
+            if value is not current:
+                self._put(section, str(key), value)
+        return value
+
+    def pop(self, section, key):
+        value = self.get(section, key)
+        if value is None:
+            return None
+        key = str(key)
+        with self._transaction():
+            if section in ("licenses", "connections", "redirections"):
+                self.conn.execute(f"DELETE FROM {section} WHERE user_id = ?", (key,))
+            else:
+                self.conn.execute("DELETE FROM documents WHERE section = ? AND key = ?", (section, key))
+        return value
+
+    def replace(self, data):
+        """Rewrite every table from a full document (legacy save_data)"""
+        with self._transaction():
+            for table in ("licenses", "connections", "redirections", "documents"):
+                self.conn.execute(f"DELETE FROM {table}")
+            for section, entries in data.items():
+                for key, value in entries.items():
+                    self._put(section, str(key), value)
+
+    def mark_dirty(self, section):
+        """Writes are committed immediately; nothing to schedule"""
+
+    def flush(self):
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except Exception as e:
+            logger.error(f"Error checkpointing SQLite: {e}")
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+class _Transaction:
+    """BEGIN/COMMIT around a block, ROLLBACK on error"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,133 @@
+"""
+Déduplication des messages transférés
+Filtre de Bloom tournant, à mémoire bornée, qui écarte un message déjà
+envoyé vers une destination (gestionnaires en double, sessions restaurées
+deux fois) et, en option, un contenu identique publié sur plusieurs sources
+"""
+
+import hashlib
+import logging
+import math
+import os
+import time
+
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+# A delivery is remembered for between half and all of this window (seconds)
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", str(6 * 3600)))
+
+# Keys per generation before it is rotated early, and target false positive rate
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "200000"))
+DEDUP_ERROR_RATE = float(os.getenv("DEDUP_ERROR_RATE", "0.0001"))
+
+# Also drop identical content cross-posted from different sources
+DEDUP_CONTENT = os.getenv("DEDUP_CONTENT", "false").lower() == "true"
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings"""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+class RotatingBloomFilter:
+    """Two Bloom filter generations; the older one is dropped on rotation
+
+    A key stays visible for at least half the window, and memory never
+    exceeds two filters whatever the volume.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW, capacity=DEDUP_CAPACITY, error_rate=DEDUP_ERROR_RATE):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.rotated_at = time.monotonic()
+
+    def _rotate_if_due(self):
+        if (self.current.count >= self.capacity
+                or time.monotonic() - self.rotated_at >= self.window / 2):
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.rotated_at = time.monotonic()
+
+    def __contains__(self, key):
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+    def add(self, key):
+        """Add a key; returns False if it was (probably) already present"""
+        self._rotate_if_due()
+        if key in self:
+            return False
+        self.current.add(key)
+        return True
+
+def content_fingerprint(message):
+    """Text plus media id of a message, or None when it has neither"""
+    media = getattr(message, 'photo', None) or getattr(message, 'document', None)
+    media_id = getattr(media, 'id', None)
+    text = getattr(message, 'message', None) or getattr(message, 'text', None) or ""
+    if not text and media_id is None:
+        return None
+    return f"{media_id}:{text}".encode("utf-8", "surrogatepass")
+
+class Deduplicator:
+    """Claims (account, chat, message, destination) deliveries once"""
+
+    def __init__(self, check_content=DEDUP_CONTENT):
+        self.deliveries = RotatingBloomFilter()
+        self.contents = RotatingBloomFilter() if check_content else None
+        self.dropped = 0
+
+    def claim(self, user_id, source, message, destination):
+        """True the first time a message is about to go to a destination
+
+        Claiming happens before the send so that two handlers racing on the
+        same update cannot both deliver it.
+        """
+        destination_key = bare_peer_id(destination)
+        source_key = bare_peer_id(source)
+        key = f"{user_id}:{source_key}:{message.id}:{destination_key}".encode()
+        if not self.deliveries.add(key):
+            self.dropped += 1
+            return False
+        if self.contents is not None:
+            fingerprint = content_fingerprint(message)
+            if fingerprint is not None:
+                # Two keys per content: "sent to this destination" and "sent
+                # there from this source". Only a copy from another source is
+                # dropped; a source repeating its own text or media is not
+                content_key = f"{user_id}:{destination_key}:".encode() + hashlib.blake2b(fingerprint, digest_size=16).digest()
+                from_source_key = content_key + f":{source_key}".encode()
+                if content_key in self.contents and from_source_key not in self.contents:
+                    self.dropped += 1
+                    logger.info(f"Identical content already sent to {destination} from another source, message {message.id} skipped")
+                    return False
+                self.contents.add(content_key)
+                self.contents.add(from_source_key)
+        return True
+
+# Global deduplicator shared by every forwarding path
+deduplicator = Deduplicator()
@@ -0,0 +1,368 @@
+"""
+Instantané des dialogues de chaque compte pour /chats
+Indexé par ID de pair et déjà réparti par type (user, bot, group, channel),
+persisté dans le stockage et rafraîchi par incréments : mises à jour reçues
+par le client et pages iter_dialogs(offset_date=...) depuis le dernier
+dialogue connu. /chats répond depuis la mémoire
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+from datetime import datetime, timezone
+
+from telethon import events
+
+from bot.chat_index import ChatNameIndex
+from bot.entity_cache import describe, get_entity_cache
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+CHAT_TYPES = ("user", "bot", "group", "channel")
+
+# Dialogs walked between two saves of an unfinished full load (it resumes
+# from the last saved page after a restart or a flood wait)
+DIALOG_PAGE_SIZE = 200
+
+# Seconds between incremental refreshes triggered by /chats, and between
+# full rebuilds (the only way to notice dialogs that were left or deleted)
+DIALOG_REFRESH_INTERVAL = float(os.getenv("DIALOG_REFRESH_INTERVAL", "300"))
+DIALOG_FULL_REFRESH = float(os.getenv("DIALOG_FULL_REFRESH", str(24 * 3600)))
+
+# Delay grouping the saves caused by incoming updates
+DIALOG_SAVE_DELAY = float(os.getenv("DIALOG_SAVE_DELAY", "30"))
+
+def _timestamp(date):
+    return int(date.timestamp()) if date is not None else 0
+
+class DialogSnapshot:
+    """Dialogs of one account: {peer id: description}, partitioned by type
+
+    Descriptions are the /chats shape (id, name, type, username) plus the
+    date of the dialog's last message, which orders the listings and tells
+    an incremental refresh where to stop.
+    """
+
+    def __init__(self, user_id, phone):
+        self.user_id = user_id
+        self.phone = phone
+        self.dialogs = {}  # bare peer id -> description
+        self.by_type = {chat_type: {} for chat_type in CHAT_TYPES}
+        self.top_date = 0  # newest last-message date seen
+        self.cursor = None  # offset_date of an unfinished full load
+        self.complete = False
+        self.loaded_at = 0.0  # wall clock of the last full load
+        self.refreshed_at = 0.0  # monotonic, last incremental refresh
+        self.missed = None  # oldest update that could not be recorded
+        self.me_id = None
+        self._index = None  # built on the first search, then kept in sync
+        self._index_task = None
+        self._index_changes = None  # (peer id, info or None) made while building
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._save_handle = None
+
+    @property
+    def key(self):
+        return f"{self.user_id}_{self.phone}"
+
+    # Content
+
+    def add(self, entity, date=0):
+        """Record a dialog's entity; returns its description"""
+        info = describe(entity)
+        info['id'] = key = bare_peer_id(info['id'])
+        info['date'] = date
+        previous = self.dialogs.get(key)
+        if previous is not None:
+            info['date'] = max(date, previous['date'])
+            if previous['type'] != info['type']:
+                self.by_type[previous['type']].pop(key, None)
+        self.dialogs[key] = self.by_type[info['type']][key] = info
+        self.top_date = max(self.top_date, date)
+        if previous is None or previous['name'] != info['name'] or previous['username'] != info['username']:
+            self._reindex(key, info)
+        return info
+
+    def remove(self, peer_id):
+        info = self.dialogs.pop(bare_peer_id(peer_id), None)
+        if info is not None:
+            self.by_type[info['type']].pop(info['id'], None)
+            self._reindex(info['id'], None)
+        return info
+
+    def rename(self, peer_id, name):
+        info = self.dialogs.get(bare_peer_id(peer_id))
+        if info is not None:
+            info['name'] = name
+            self._reindex(info['id'], info)
+        return info
+
+    def _reindex(self, peer_id, info):
+        if self._index is not None:
+            if info is None:
+                self._index.remove(peer_id)
+            else:
+                self._index.add(info)
+        elif self._index_changes is not None:
+            self._index_changes.append((peer_id, info))
+
+    async def _get_index(self):
+        """Name index, built on first use in a worker thread
+
+        Building it for tens of thousands of dialogs takes long enough to
+        stall the event loop; changes made meanwhile are replayed after.
+        """
+        if self._index is not None:
+            return self._index
+        if self._index_task is None:
+            async def build():
+                changes = self._index_changes = []
+                index = ChatNameIndex()
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, index.build, list(self.dialogs.values()))
+                self._index_task = None
+                if self._index_changes is not changes:
+                    # The snapshot was rebuilt meanwhile: index the new dialogs
+                    return await self._get_index()
+                for peer_id, info in changes:
+                    if info is None:
+                        index.remove(peer_id)
+                    else:
+                        index.add(info)
+                self._index, self._index_changes = index, None
+                return index
+
+            self._index_task = asyncio.get_running_loop().create_task(build())
+        return await asyncio.shield(self._index_task)
+
+    async def search(self, query, chat_type=None):
+        """Descriptions whose name matches every term of the query, best first"""
+        index = await self._get_index()
+        matches = (self.dialogs.get(peer_id) for peer_id in index.search(query))
+        return [info for info in matches if info is not None and (chat_type is None or info['type'] == chat_type)]
+
+    def chats(self, chat_type=None):
+        """Descriptions of one type (or all), most recent first"""
+        dialogs = self.dialogs if chat_type is None else self.by_type[chat_type]
+        return sorted(dialogs.values(), key=lambda info: info['date'], reverse=True)
+
+    def counts(self):
+        return {chat_type: len(dialogs) for chat_type, dialogs in self.by_type.items()}
+
+    # Persistence
+
+    def dump(self):
+        return {
+            "top_date": self.top_date,
+            "cursor": self.cursor,
+            "complete": self.complete,
+            "loaded_at": self.loaded_at,
+            # Rows rather than dicts: thousands of dialogs per account
+            "dialogs": [
+                [info['id'], info['type'], info['name'], info['username'], info['date']]
+                for info in self.dialogs.values()
+            ]
+        }
+
+    def restore(self, document):
+        for peer_id, chat_type, name, username, date in document.get("dialogs", []):
+            info = {'id': peer_id, 'name': name, 'type': chat_type, 'username': username, 'date': date}
+            self.dialogs[peer_id] = self.by_type[chat_type][peer_id] = info
+        self.top_date = document.get("top_date", 0)
+        self.cursor = document.get("cursor")
+        self.complete = document.get("complete", False)
+        self.loaded_at = document.get("loaded_at", 0.0)
+
+    async def save(self):
+        self._save_handle = None
+        from bot.database import store_dialog_snapshot
+        await store_dialog_snapshot(self.key, self.dump())
+
+    def schedule_save(self, delay=DIALOG_SAVE_DELAY):
+        """Save once after `delay`, however many changes come in meanwhile"""
+        if self._save_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._save_handle = loop.call_later(delay, lambda: loop.create_task(self.save()))
+
+    # Refresh
+
+    @property
+    def refresh_due(self):
+        return (
+            not self.complete
+            or time.monotonic() - self.refreshed_at > DIALOG_REFRESH_INTERVAL
+            or time.time() - self.loaded_at > DIALOG_FULL_REFRESH
+        )
+
+    async def refresh(self, client):
+        """Bring the snapshot up to date with as few dialog pages as possible"""
+        async with self._lock:
+            self.attach(client)
+            if self.me_id is None:
+                self.me_id = (await client.get_me(input_peer=True)).user_id
+            entity_cache = get_entity_cache(client)
+            if self.complete and time.time() - self.loaded_at > DIALOG_FULL_REFRESH:
+                await self._rebuild(client, entity_cache)
+            else:
+                if self.top_date:
+                    await self._load_recent(client, entity_cache)
+                if not self.complete:
+                    await self._load_all(client, entity_cache)
+            entity_cache.warmed = True
+            self.refreshed_at = time.monotonic()
+        await self.save()
+
+    def _add_dialog(self, dialog, entity_cache):
+        entity_cache.remember(dialog.entity)
+        return self.add(dialog.entity, _timestamp(dialog.date))
+
+    async def _load_recent(self, client, entity_cache):
+        """Dialogs active since the newest one known (pinned ones come first)"""
+        known = self.top_date if self.missed is None else min(self.top_date, self.missed - 1)
+        count = 0
+        async for dialog in client.iter_dialogs():
+            if _timestamp(dialog.date) <= known and not dialog.pinned:
+                break
+            self._add_dialog(dialog, entity_cache)
+            count += 1
+        self.missed = None
+        logger.info(f"Dialog snapshot {self.key}: {count} recent dialog(s) refreshed")
+
+    async def _load_all(self, client, entity_cache):
+        """Full walk, older and older pages from the saved cursor"""
+        offset = datetime.fromtimestamp(self.cursor, timezone.utc) if self.cursor else None
+        count = 0
+        async for dialog in client.iter_dialogs(offset_date=offset):
+            self._add_dialog(dialog, entity_cache)
+            count += 1
+            if count % DIALOG_PAGE_SIZE == 0 and dialog.date is not None:
+                # One second later: dialogs sharing this date are walked again, not skipped
+                self.cursor = _timestamp(dialog.date) + 1
+                await self.save()
+        self.cursor = None
+        self.complete = True
+        self.loaded_at = time.time()
+        logger.info(f"Dialog snapshot {self.key}: full load of {count} dialog(s)")
+
+    async def _rebuild(self, client, entity_cache):
+        """Walk every dialog again and swap the snapshot, dropping left chats"""
+        fresh = DialogSnapshot(self.user_id, self.phone)
+        async for dialog in client.iter_dialogs():
+            entity_cache.remember(dialog.entity)
+            fresh.add(dialog.entity, _timestamp(dialog.date))
+        self.dialogs, self.by_type, self.top_date = fresh.dialogs, fresh.by_type, fresh.top_date
+        self._index = None
+        self._index_changes = None
+        self.cursor = None
+        self.complete = True
+        self.loaded_at = time.time()
+        logger.info(f"Dialog snapshot {self.key}: rebuilt with {len(self.dialogs)} dialog(s)")
+
+    def refresh_in_background(self, client_getter):
+        """Start one refresh task; `client_getter` is awaited for the client"""
+        if self._task is not None and not self._task.done():
+            return self._task
+
+        async def run():
+            try:
+                client = await client_getter()
+                if client is not None:
+                    await self.refresh(client)
+            except Exception as e:
+                logger.warning(f"Dialog snapshot {self.key} refresh failed: {e}")
+
+        self._task = asyncio.get_running_loop().create_task(run())
+        return self._task
+
+    # Updates
+
+    def attach(self, client):
+        """Follow the client's updates (once per client object)"""
+        if self._client is not None and self._client() is client:
+            return
+        self._client = weakref.ref(client)
+        client.add_event_handler(self._on_message, events.NewMessage())
+        client.add_event_handler(self._on_action, events.ChatAction())
+
+    async def _on_message(self, event):
+        if event.chat_id is None:
+            return
+        date = _timestamp(event.message.date)
+        info = self.dialogs.get(bare_peer_id(event.chat_id))
+        if info is not None:
+            info['date'] = max(info['date'], date)
+            self.top_date = max(self.top_date, date)
+        elif event.chat is not None:
+            # New dialog whose entity came with the update
+            self.add(event.chat, date)
+        else:
+            # Unknown chat without its entity: the next refresh goes back to it
+            self.missed = date if self.missed is None else min(self.missed, date)
+            self.refreshed_at = 0.0
+            return
+        self.schedule_save()
+
+    async def _on_action(self, event):
+        if event.chat_id is None:
+            return
+        key = bare_peer_id(event.chat_id)
+        if event.new_title and key in self.dialogs:
+            self.rename(key, event.new_title)
+        elif (event.user_left or event.user_kicked) and self.me_id is not None and event.user_id == self.me_id:
+            self.remove(key)
+        elif event.chat is not None and key not in self.dialogs:
+            self.add(event.chat, _timestamp(event.action_message.date) if event.action_message else 0)
+        else:
+            return
+        self.schedule_save()
+
+class DialogSnapshots:
+    """Snapshot per (user_id, phone), loaded from storage on first use"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    async def get(self, user_id, phone):
+        from bot.client_registry import normalize_phone
+        from bot.database import get_dialog_snapshot
+        phone = normalize_phone(phone)
+        snapshot = self.snapshots.get((user_id, phone))
+        if snapshot is None:
+            document = await get_dialog_snapshot(f"{user_id}_{phone}")
+            snapshot = self.snapshots.get((user_id, phone))
+            if snapshot is None:
+                snapshot = self.snapshots[(user_id, phone)] = DialogSnapshot(user_id, phone)
+                if document:
+                    snapshot.restore(document)
+        return snapshot
+
+    async def load(self, user_id, phone):
+        """Snapshot ready to answer /chats
+
+        An empty snapshot is loaded before returning; otherwise the cached
+        dialogs are returned at once and a due refresh runs in the background.
+        """
+        snapshot = await self.get(user_id, phone)
+
+        async def client_getter():
+            from bot.client_registry import client_registry
+            client = await client_registry.acquire(user_id, snapshot.phone, "chats", once=True)
+            if client is not None:
+                from bot.session_manager import session_manager
+                await session_manager.update_session_activity(user_id, f"+{snapshot.phone}")
+            return client
+
+        if not snapshot.dialogs:
+            await snapshot.refresh_in_background(client_getter)
+        elif snapshot.refresh_due:
+            snapshot.refresh_in_background(client_getter)
+        return snapshot
+
+# Global snapshots shared by /chats
+dialog_snapshots = DialogSnapshots()
@@ -0,0 +1,161 @@
+"""
+Cache des entités et noms d'affichage par compte
+Alimenté par iter_dialogs et par les entités déjà présentes dans les mises à
+jour, pour que le chemin de transfert ne fasse aucun appel get_entity
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+from collections import OrderedDict
+
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+# Peers remembered per account, and how long a name is trusted
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "5000"))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", str(6 * 3600)))
+
+def entity_type(entity):
+    """Chat type as shown by /chats: user, bot, group or channel"""
+    kind = type(entity).__name__
+    if kind == 'User':
+        return 'bot' if getattr(entity, 'bot', False) else 'user'
+    if kind == 'Chat':
+        return 'group'
+    if kind == 'Channel':
+        if getattr(entity, 'megagroup', False) or getattr(entity, 'gigagroup', False):
+            return 'group'
+        return 'channel'
+    return 'user'
+
+def entity_name(entity):
+    """Human readable name of a user, group or channel"""
+    if getattr(entity, 'title', None):
+        return entity.title
+    if getattr(entity, 'first_name', None):
+        name = entity.first_name
+        if getattr(entity, 'last_name', None):
+            name += f" {entity.last_name}"
+        return name
+    if getattr(entity, 'username', None):
+        return f"@{entity.username}"
+    return f"Chat {entity.id}"
+
+def describe(entity):
+    """Plain description of an entity, the shape used by /chats"""
+    return {
+        'id': entity.id,
+        'name': entity_name(entity),
+        'type': entity_type(entity),
+        'username': getattr(entity, 'username', None)
+    }
+
+class EntityCache:
+    """Bounded peer id -> description cache of one account"""
+
+    def __init__(self, client, size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL):
+        # Weak so a cache never keeps a disconnected client alive
+        self._client = weakref.ref(client)
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # bare peer id -> (description, cached_at)
+        self.warmed = False
+        self._warm_task = None
+        self._refreshing = set()
+
+    def remember(self, entity):
+        """Record an entity already at hand; returns its description"""
+        info = describe(entity)
+        key = bare_peer_id(info['id'])
+        self.entries[key] = (info, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return info
+
+    def lookup(self, peer_id):
+        """Cached description or None; never calls Telegram
+
+        A stale entry is still returned while a single background refresh
+        replaces it.
+        """
+        key = bare_peer_id(peer_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            self._refresh(peer_id, key)
+            return None
+        info, cached_at = entry
+        self.entries.move_to_end(key)
+        if time.monotonic() - cached_at > self.ttl:
+            self._refresh(peer_id, key)
+        return info
+
+    def display_name(self, peer_id, entity=None):
+        """Name for log lines; `entity` is used when the update carried it"""
+        if entity is not None:
+            return self.remember(entity)['name']
+        info = self.lookup(peer_id)
+        return info['name'] if info else f"Chat {peer_id}"
+
+    def _refresh(self, peer_id, key):
+        client = self._client()
+        if client is None or key in self._refreshing:
+            return
+        if not self.warmed:
+            # The warm-up will bring most peers in; only resolve leftovers
+            self.warm()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refreshing.add(key)
+        loop.create_task(self._resolve(client, peer_id, key))
+
+    async def _resolve(self, client, peer_id, key):
+        try:
+            self.remember(await client.get_entity(int(peer_id)))
+        except Exception as e:
+            logger.debug(f"Could not resolve entity {peer_id}: {e}")
+            # Keep the placeholder from retrying on every message
+            self.entries[key] = ({'id': key, 'name': f"Chat {peer_id}", 'type': 'user', 'username': None}, time.monotonic())
+        finally:
+            self._refreshing.discard(key)
+
+    def warm(self):
+        """Start loading the account's dialogs once, in the background"""
+        if self._warm_task is not None or self._client() is None:
+            return self._warm_task
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        self._warm_task = loop.create_task(self._warm())
+        return self._warm_task
+
+    async def _warm(self):
+        client = self._client()
+        count = 0
+        try:
+            async for dialog in client.iter_dialogs(limit=self.size):
+                self.remember(dialog.entity)
+                count += 1
+            logger.info(f"Entity cache warmed with {count} dialogs")
+        except Exception as e:
+            logger.warning(f"Entity cache warm-up stopped after {count} dialogs: {e}")
+        finally:
+            self.warmed = True
+
+# One cache per client, dropped with the client
+entity_caches = weakref.WeakKeyDictionary()
+
+def get_entity_cache(client):
+    """Get (or create) the entity cache of a client"""
+    cache = entity_caches.get(client)
+    if cache is None:
+        cache = entity_caches[client] = EntityCache(client)
+    return cache
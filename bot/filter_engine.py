@@ -0,0 +1,202 @@
+"""
+Moteur de filtres whitelist/blacklist
+Les mots-clés et phrases d'une redirection sont compilés en un automate
+Aho-Corasick et ses regex en une seule expression combinée, reconstruits
+uniquement quand le filtre change
+"""
+
+import logging
+import re
+from collections import deque
+
+from bot.rule_offload import OffloadableRegex
+
+logger = logging.getLogger(__name__)
+
+def combine_regexes(regexes):
+    """One alternation matching wherever any of the regexes matches"""
+    return "|".join(f"(?:{pattern})" for pattern in regexes)
+
+def parse_filter_terms(lines):
+    """Split user lines into (keywords, regexes)
+
+    One term per line: `/pattern/` is a regex, `"some words"` a phrase
+    (quotes keep surrounding spaces), anything else a keyword. Matching
+    is case-insensitive. Raises re.error for a regex that is invalid
+    alone or once combined with the others (e.g. a global flag like
+    `(?i)` not at the start, or a group name used twice).
+    """
+    keywords, regexes = [], []
+    for line in lines:
+        term = line.strip()
+        if not term:
+            continue
+        if len(term) > 2 and term.startswith("/") and term.endswith("/"):
+            pattern = term[1:-1]
+            re.compile(combine_regexes([pattern]), re.IGNORECASE)
+            regexes.append(pattern)
+        elif len(term) > 2 and term.startswith('"') and term.endswith('"'):
+            keywords.append(term[1:-1])
+        else:
+            keywords.append(term)
+    if len(regexes) > 1:
+        re.compile(combine_regexes(regexes), re.IGNORECASE)
+    return keywords, regexes
+
+class AhoCorasick:
+    """Multi-keyword matcher: one pass over the text whatever the keyword count"""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.terminal = [False]
+        for keyword in keywords:
+            self._insert(keyword.casefold())
+        self._link()
+
+    def _insert(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.terminal.append(False)
+            state = next_state
+        self.terminal[state] = True
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # A state ending a shorter keyword through its suffix is a match too
+                self.terminal[next_state] = self.terminal[next_state] or self.terminal[self.fail[next_state]]
+
+    def search(self, text):
+        """True if any keyword occurs in `text`"""
+        goto, fail, terminal = self.goto, self.fail, self.terminal
+        state = 0
+        for char in text.casefold():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if terminal[state]:
+                return True
+        return False
+
+class CompiledFilter:
+    """Keywords and regexes of one filter, ready to match
+
+    The regexes run as one combined expression. Terms stored over several
+    commands may not combine (a group name used twice): they then run one
+    by one, and a term that does not compile even alone is skipped.
+    """
+
+    __slots__ = ("automaton", "regexes")
+
+    def __init__(self, keywords, regexes):
+        self.automaton = AhoCorasick(keywords) if keywords else None
+        self.regexes = []
+        if not regexes:
+            return
+        try:
+            self.regexes.append(OffloadableRegex(combine_regexes(regexes), re.IGNORECASE))
+        except re.error:
+            for pattern in regexes:
+                try:
+                    self.regexes.append(OffloadableRegex(combine_regexes([pattern]), re.IGNORECASE))
+                except re.error as e:
+                    logger.error(f"Skipping invalid filter regex {pattern[:60]!r}: {e}")
+
+    async def matches(self, text, failed=False):
+        """Whether a keyword or regex occurs in `text`
+
+        `failed` is the answer when a regex could not be evaluated (timed
+        out or disabled).
+        """
+        if not text:
+            return False
+        if self.automaton is not None and self.automaton.search(text):
+            return True
+        for regex in self.regexes:
+            if await regex.search(text, failed):
+                return True
+        return False
+
+class FilterRegistry:
+    """Compiled whitelist/blacklist per (user, redirection)
+
+    A user's filters are read from storage and compiled on first use, then
+    kept until one of them changes.
+    """
+
+    def __init__(self):
+        self.compiled = {}  # user_id -> {name: (whitelist, blacklist)}
+
+    def invalidate(self, user_id):
+        self.compiled.pop(int(user_id), None)
+
+    async def _load(self, user_id):
+        from bot.database import get_filters
+        whitelists = await get_filters("whitelists", user_id)
+        blacklists = await get_filters("blacklists", user_id)
+        compiled = {}
+        for name in set(whitelists) | set(blacklists):
+            try:
+                compiled[name] = tuple(
+                    CompiledFilter(entry.get("keywords", []), entry.get("regexes", [])) if entry else None
+                    for entry in (whitelists.get(name), blacklists.get(name))
+                )
+            except (ValueError, KeyError, TypeError, AttributeError, re.error) as e:
+                logger.error(f"Skipping invalid filters of {name}: {e}")
+        self.compiled[int(user_id)] = compiled
+        return compiled
+
+    async def get(self, user_id, name):
+        """(whitelist, blacklist) of a redirection; either may be None"""
+        compiled = self.compiled.get(int(user_id))
+        if compiled is None:
+            compiled = await self._load(user_id)
+        return compiled.get(name, (None, None))
+
+    async def allows(self, rule, message):
+        """Whether a message passes the filters of a redirection"""
+        return (await self.select(rule, [message])) != []
+
+    async def select(self, rule, messages):
+        """Messages of a batch that pass the filters of a redirection
+
+        An album is kept or dropped as a whole, on the text of all its
+        parts, since only one of them usually carries the caption.
+        """
+        whitelist, blacklist = await self.get(rule.user_id, rule.name)
+        if whitelist is None and blacklist is None:
+            return list(messages)
+        groups = {}
+        for message in messages:
+            groups.setdefault(getattr(message, 'grouped_id', None) or ("message", message.id), []).append(message)
+        selected = []
+        for group in groups.values():
+            # Raw text: the message body or the media caption, without markdown
+            text = "\n".join(getattr(message, 'message', None) or "" for message in group)
+            # A regex that cannot be evaluated fails closed: the whitelist
+            # does not match and the blacklist does, so the message is dropped
+            if whitelist is not None and not await whitelist.matches(text):
+                continue
+            if blacklist is not None and await blacklist.matches(text, failed=True):
+                continue
+            selected.extend(group)
+        return sorted(selected, key=lambda m: m.id)
+
+# Global registry used by the forwarder
+filters = FilterRegistry()
@@ -0,0 +1,377 @@
+"""
+Chaîne de transfert commune aux redirections
+Les nouveaux messages d'une source sont regroupés sur une courte fenêtre et
+transférés en un seul appel forward_messages par destination, ce qui garde
+les albums entiers et réduit une rafale de N messages à un seul RPC
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from telethon.errors import ChatForwardsRestrictedError
+
+from bot.checkpoints import checkpoints
+from bot.database import record_delivery_results
+from bot.dedup import deduplicator
+from bot.entity_cache import get_entity_cache
+from bot.filter_engine import filters
+from bot.message_mapping import mapping_key, message_mappings
+from bot.send_scheduler import get_scheduler
+from bot.startup import startup
+from bot.transform_engine import transformations
+
+logger = logging.getLogger(__name__)
+
+# Quiet time after the last message before a burst is sent, and the
+# longest a message may wait while a burst keeps growing
+FORWARD_BATCH_WINDOW = float(os.getenv("FORWARD_BATCH_WINDOW", "0.5"))
+FORWARD_BATCH_MAX_DELAY = float(os.getenv("FORWARD_BATCH_MAX_DELAY", "2.0"))
+
+# How far back the catch-up after a restart may go
+CATCHUP_MAX_MESSAGES = int(os.getenv("CATCHUP_MAX_MESSAGES", "500"))
+CATCHUP_MAX_AGE_HOURS = float(os.getenv("CATCHUP_MAX_AGE_HOURS", "24"))
+
+# Telegram accepts at most 100 message ids per forward
+FORWARD_BATCH_SIZE = 100
+
+class PendingBatch:
+    """Messages of one source waiting to be forwarded to one destination"""
+
+    __slots__ = ("client", "rule", "source", "messages", "started_at", "handle")
+
+    def __init__(self, client, rule, source):
+        self.client = client
+        self.rule = rule
+        self.source = source
+        self.messages = []
+        self.started_at = time.monotonic()
+        self.handle = None
+
+class Forwarder:
+    """Forwards routed messages, batching new ones and mirroring edits"""
+
+    def __init__(self, window=FORWARD_BATCH_WINDOW, max_delay=FORWARD_BATCH_MAX_DELAY):
+        self.window = window
+        self.max_delay = max_delay
+        self.batches = {}  # (client, user_id, name) -> PendingBatch
+        self.catching_up = set()  # batch keys held until their catch-up ends
+        self._tasks = set()
+
+    async def route(self, event, rule, is_edit):
+        """Entry point called by the source router"""
+        if is_edit:
+            await self._forward_edit(event, rule)
+        else:
+            self._buffer(event, rule)
+
+    # New messages
+
+    def _buffer(self, event, rule):
+        key = (event.client, rule.user_id, rule.name)
+        batch = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = PendingBatch(event.client, rule, event.chat_id)
+            # Remember the source entity carried by the update for the logs
+            get_entity_cache(event.client).display_name(event.chat_id, event.chat)
+        batch.messages.append(event.message)
+        if key in self.catching_up:
+            # Live messages wait behind the messages missed while offline
+            return
+        if batch.handle is not None:
+            batch.handle.cancel()
+        if (len(batch.messages) >= FORWARD_BATCH_SIZE
+                or time.monotonic() - batch.started_at >= self.max_delay):
+            self._start_flush(key)
+        else:
+            batch.handle = asyncio.get_running_loop().call_later(self.window, self._start_flush, key)
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _start_flush(self, key):
+        batch = self.batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.handle is not None:
+            batch.handle.cancel()
+        self._spawn(self._flush(batch))
+
+    async def _flush(self, batch):
+        await self._deliver(batch.client, batch.rule, batch.source, batch.messages)
+
+    async def _deliver(self, client, rule, source, messages, destination_ids=None):
+        """Deliver messages to every destination of a redirection
+
+        The messages are collected once; each destination gets its own
+        forward calls, all running concurrently under the account's budget.
+        Messages at or below a destination's checkpoint were already sent
+        there and are skipped, as are those rejected by the redirection's
+        whitelist/blacklist.
+        """
+        destination_ids = destination_ids or rule.destination_ids
+        messages = await filters.select(rule, messages)
+        if not messages:
+            return
+        outcomes = await asyncio.gather(*[
+            self._deliver_to(client, rule, source, messages, destination_id)
+            for destination_id in destination_ids
+        ])
+        await self._record(rule, dict(zip(destination_ids, outcomes)))
+
+    async def _deliver_to(self, client, rule, source, messages, destination_id):
+        position = await checkpoints.get(source, destination_id)
+        if position is not None:
+            messages = [message for message in messages if message.id > position]
+        # Drop deliveries already made by another handler or session
+        messages = [
+            message for message in messages
+            if deduplicator.claim(rule.user_id, source, message, destination_id)
+        ]
+        delivered, failed, last_error = 0, 0, None
+        for start in range(0, len(messages), FORWARD_BATCH_SIZE):
+            chunk = messages[start:start + FORWARD_BATCH_SIZE]
+            sent, error = await self._send(client, rule, source, chunk, destination_id)
+            delivered += sent
+            failed += len(chunk) - sent
+            last_error = error or last_error
+        return delivered, failed, last_error
+
+    async def _record(self, rule, results):
+        try:
+            await record_delivery_results(rule.user_id, rule.name, {
+                destination_id: tuple(counters) for destination_id, counters in results.items()
+            })
+        except Exception as e:
+            logger.error(f"Error recording deliveries of {rule.name}: {e}")
+
+    async def _send(self, client, rule, source, messages, destination_id):
+        """Forward messages in one call (or send transformed copies) and record their destination ids
+
+        Returns (messages delivered, error message or None).
+        """
+        scheduler = get_scheduler(client)
+        chain = await transformations.get(rule.user_id, rule.name)
+        try:
+            if chain is not None:
+                # A forward can't carry modified text: send transformed copies
+                sent = await self._send_copies(client, scheduler, chain, messages, destination_id)
+            else:
+                sent = await self._forward(client, scheduler, source, messages, destination_id)
+            if not isinstance(sent, list):
+                sent = [sent]
+            delivered, last_id = 0, None
+            for message, sent_message in zip(messages, sent):
+                if sent_message is not None and hasattr(sent_message, 'id'):
+                    message_mappings.put(mapping_key(source, message.id, destination_id), sent_message.id)
+                    delivered += 1
+                    last_id = message.id if last_id is None else max(last_id, message.id)
+            if last_id is not None:
+                await checkpoints.advance(source, destination_id, last_id)
+                startup.first_forward(rule.user_id)
+
+            names = get_entity_cache(client)
+            logger.info(
+                f"{delivered} message(s) redirected from {source} ({names.display_name(source)}) "
+                f"to {destination_id} ({names.display_name(destination_id)}) via {rule.name}"
+            )
+            return delivered, None
+        except Exception as e:
+            logger.error(f"Error forwarding {len(messages)} message(s) to {destination_id} via {rule.name}: {e}")
+            return 0, str(e)
+
+    async def _forward(self, client, scheduler, source, messages, destination_id):
+        try:
+            # Forwarded without the "Forwarded from" header, like a copy;
+            # albums stay grouped because all their ids go in one call
+            return await scheduler.call(
+                destination_id, client.forward_messages, int(destination_id),
+                [message.id for message in messages], source, drop_author=True
+            )
+        except ChatForwardsRestrictedError:
+            # Protected source: only the text can be copied
+            sent = []
+            for message in messages:
+                sent.append(
+                    await scheduler.call(destination_id, client.send_message, int(destination_id), message.text)
+                    if message.text else None
+                )
+            return sent
+
+    async def _send_copies(self, client, scheduler, chain, messages, destination_id):
+        """Send transformed copies of the messages, one call per message or album"""
+        groups = []
+        for message in messages:
+            grouped_id = getattr(message, 'grouped_id', None)
+            if grouped_id and groups and groups[-1][0] == grouped_id:
+                groups[-1][1].append(message)
+            else:
+                groups.append((grouped_id, [message]))
+
+        sent = []
+        for grouped_id, group in groups:
+            copies = [await chain.apply(message.message, message.entities) for message in group]
+            if len(group) > 1:
+                # Telethon takes no per-item entities for albums: captions go as plain text
+                result = await scheduler.call(
+                    destination_id, client.send_file, int(destination_id),
+                    [message.media for message in group], caption=[text for text, _ in copies], parse_mode=None
+                )
+                sent.extend(result if isinstance(result, list) else [result])
+                continue
+            message, (text, entities) = group[0], copies[0]
+            media = None if message.web_preview else message.media
+            if not text.strip() and media is None:
+                # Everything was removed: nothing left to send
+                sent.append(None)
+                continue
+            sent.append(await scheduler.call(
+                destination_id, client.send_message, int(destination_id), text,
+                formatting_entities=entities, file=media
+            ))
+        return sent
+
+    # Edits
+
+    async def _forward_edit(self, event, rule):
+        """Mirror an edit onto the messages previously sent"""
+        outcomes = await asyncio.gather(*[
+            self._forward_edit_to(event, rule, destination_id)
+            for destination_id in rule.destination_ids
+        ])
+        results = {
+            destination_id: outcome
+            for destination_id, outcome in zip(rule.destination_ids, outcomes)
+            if outcome is not None
+        }
+        if results:
+            await self._record(rule, results)
+
+    async def _forward_edit_to(self, event, rule, destination_id):
+        """Mirror an edit to one destination
+
+        Returns delivery counters when a message was sent again, else None.
+        """
+        client = event.client
+        scheduler = get_scheduler(client)
+        message = event.message
+        key = mapping_key(event.chat_id, message.id, destination_id)
+
+        redirected_msg_id = await message_mappings.get(key)
+        if redirected_msg_id is None:
+            # Don't send anything for edits of unmapped messages
+            logger.info(f"Edit event for unmapped message {message.id} in {event.chat_id}")
+            return None
+
+        if message.text:
+            try:
+                chain = await transformations.get(rule.user_id, rule.name)
+                if chain is not None:
+                    text, entities = await chain.apply(message.message, message.entities)
+                    await scheduler.call(
+                        destination_id, client.edit_message, int(destination_id), redirected_msg_id, text,
+                        formatting_entities=entities
+                    )
+                else:
+                    await scheduler.call(destination_id, client.edit_message, int(destination_id), redirected_msg_id, message.text)
+                logger.info(f"Message edited from {event.chat_id} to {destination_id} via {rule.name}")
+                return None
+            except Exception as e:
+                if "Content of the message was not modified" in str(e):
+                    logger.info(f"Message content unchanged for edit in {event.chat_id} to {destination_id} via {rule.name}")
+                    return None
+                logger.warning(f"Failed to edit message {redirected_msg_id}: {e}. Sending new message instead.")
+        elif message.media:
+            # Media can't be swapped in place: delete and forward again
+            try:
+                await scheduler.call(destination_id, client.delete_messages, int(destination_id), redirected_msg_id)
+            except Exception:
+                pass  # Continue even if delete fails
+        else:
+            # No content left: delete the redirected message too
+            try:
+                await scheduler.call(destination_id, client.delete_messages, int(destination_id), redirected_msg_id)
+                message_mappings.delete(key)
+                logger.info(f"Message deleted from {event.chat_id} to {destination_id} via {rule.name}")
+            except Exception as e:
+                logger.warning(f"Failed to delete message {redirected_msg_id}: {e}")
+            return None
+
+        delivered, error = await self._send(client, rule, event.chat_id, [message], destination_id)
+        return delivered, 1 - delivered, error
+
+    async def forward_history(self, client, rule, source, messages):
+        """Forward up to 100 older messages to every destination, ignoring checkpoints
+
+        Used by backfills; returns {destination_id: (delivered, failed, error)}.
+        """
+        messages = await filters.select(rule, messages)
+        if not messages:
+            return {}
+        outcomes = await asyncio.gather(*[
+            self._send(client, rule, source, messages, destination_id)
+            for destination_id in rule.destination_ids
+        ])
+        results = {
+            destination_id: (delivered, len(messages) - delivered, error)
+            for destination_id, (delivered, error) in zip(rule.destination_ids, outcomes)
+        }
+        await self._record(rule, results)
+        return results
+
+    # Catch-up after a restart
+
+    def start_catch_up(self, client, rule):
+        """Forward what the source posted while we were offline, then go live
+
+        Must be called before the rule is added to the router: live messages
+        of the rule are held until the missed ones have been delivered.
+        """
+        key = (client, rule.user_id, rule.name)
+        if key in self.catching_up:
+            return None
+        self.catching_up.add(key)
+        return self._spawn(self._catch_up(client, rule, key))
+
+    async def _catch_up(self, client, rule, key):
+        try:
+            positions = {d: await checkpoints.get(rule.source_id, d) for d in rule.destination_ids}
+            known = {d: position for d, position in positions.items() if position is not None}
+            if not known:
+                # Never forwarded anything yet: nothing to catch up on
+                return
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=CATCHUP_MAX_AGE_HOURS)
+            missed = []
+            # Newest first so the cap keeps the most recent messages
+            async for message in client.iter_messages(int(rule.source_id), min_id=min(known.values()), limit=CATCHUP_MAX_MESSAGES):
+                if message.date and message.date < cutoff:
+                    break
+                if getattr(message, 'action', None) is None:
+                    missed.append(message)
+            if missed:
+                logger.info(f"Catching up {len(missed)} message(s) for redirection {rule.name}")
+                # Fetched newest first: deliver in posting order
+                missed.sort(key=lambda message: message.id)
+                # Destinations without a checkpoint start from live messages
+                await self._deliver(client, rule, int(rule.source_id), missed, list(known))
+        except Exception as e:
+            logger.error(f"Error catching up redirection {rule.name}: {e}")
+        finally:
+            self.catching_up.discard(key)
+            if key in self.batches:
+                self._start_flush(key)
+
+    async def flush(self):
+        """Send every pending batch now (used at shutdown)"""
+        for key in list(self.batches):
+            self._start_flush(key)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+# Global forwarder shared by every redirection
+forwarder = Forwarder()
@@ -4,7 +4,7 @@ import asyncio
 from telethon import TelegramClient, events
 from config.settings import API_ID, API_HASH, BOT_TOKEN, ADMIN_ID
 from keep_alive import KeepAliveSystem
-from bot.license import check_license, validate_license_code
+from bot.license import check_license, looks_like_license, validate_license_code
 from bot.payment import process_payment
 from bot.deploy_new import handle_deploy
 from bot.connection import handle_connect, handle_verification_code
@@ -12,8 +12,10 @@ from bot.redirection import handle_redirection_command
 from bot.transformation import handle_transformation_command
 from bot.whitelist import handle_whitelist_command
 from bot.blacklist import handle_blacklist_command
-from bot.chats import handle_chats_command
+from bot.chats import handle_chats_command, handle_chats_page
 from bot.admin import handle_admin_commands
+from bot.command_router import command_router
+from bot.conversation import conversation_states, AWAITING_CODE, AWAITING_REDIRECTION_IDS, AWAITING_LICENSE
 
 # Configure logging
 logging.basicConfig(
@@ -30,7 +32,7 @@ logger = logging.getLogger(__name__)
 # Initialize Telegram client without starting it yet
 client = TelegramClient('bot', API_ID, API_HASH)
 
-@client.on(events.NewMessage(pattern="/start"))
+@command_router.command("/start")
 async def start(event):
     """Handle /start command"""
     try:
@@ -58,7 +60,7 @@ Pour accéder aux fonctionnalités premium, veuillez valider votre licence avec
         logger.error(f"Error in start command: {e}")
         await event.respond("❌ Une erreur est survenue. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/valide"))
+@command_router.command("/valide")
 async def valide(event):
     """Handle /valide command for license validation"""
     try:
@@ -68,7 +70,7 @@ async def valide(event):
         logger.error(f"Error in license validation: {e}")
         await event.respond("❌ Erreur lors de la validation de licence. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/payer une semaine"))
+@command_router.command("/payer", "une semaine")
 async def payer_semaine(event):
     """Handle /payer une semaine command"""
     try:
@@ -78,7 +80,7 @@ async def payer_semaine(event):
         logger.error(f"Error in weekly payment processing: {e}")
         await event.respond("❌ Erreur lors du traitement du paiement. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/payer un mois"))
+@command_router.command("/payer", "un mois")
 async def payer_mois(event):
     """Handle /payer un mois command"""
     try:
@@ -88,14 +90,10 @@ async def payer_mois(event):
         logger.error(f"Error in monthly payment processing: {e}")
         await event.respond("❌ Erreur lors du traitement du paiement. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/payer"))
+@command_router.command("/payer")
 async def payer(event):
     """Handle /payer command for payment processing"""
     try:
-        # Check if it's a specific payment command
-        if "une semaine" in event.text or "un mois" in event.text:
-            return  # Let the specific handlers handle it first
-
         # Show payment options
         payment_options = """
 💳 **Options de paiement TeleFeed**
@@ -116,7 +114,7 @@ Choisissez votre formule d'abonnement :
         logger.error(f"Error in payment processing: {e}")
         await event.respond("❌ Erreur lors du traitement du paiement. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/deposer"))
+@command_router.command("/deposer")
 async def deposer(event):
     """Handle /deposer command for file deployment"""
     try:
@@ -126,7 +124,7 @@ async def deposer(event):
         logger.error(f"Error in deploy handling: {e}")
         await event.respond("❌ Erreur lors du traitement du dépôt. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/connect"))
+@command_router.command("/connect")
 async def connect(event):
     """Handle /connect command"""
     try:
@@ -136,7 +134,7 @@ async def connect(event):
         logger.error(f"Error in connect command: {e}")
         await event.respond("❌ Erreur lors de la connexion. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/redirection"))
+@command_router.command("/redirection")
 async def redirection(event):
     """Handle /redirection command"""
     try:
@@ -146,7 +144,7 @@ async def redirection(event):
         logger.error(f"Error in redirection command: {e}")
         await event.respond("❌ Erreur lors de la redirection. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/transformation"))
+@command_router.command("/transformation")
 async def transformation(event):
     """Handle /transformation command"""
     try:
@@ -156,7 +154,7 @@ async def transformation(event):
         logger.error(f"Error in transformation command: {e}")
         await event.respond("❌ Erreur lors de la transformation. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/whitelist"))
+@command_router.command("/whitelist")
 async def whitelist(event):
     """Handle /whitelist command"""
     try:
@@ -166,7 +164,7 @@ async def whitelist(event):
         logger.error(f"Error in whitelist command: {e}")
         await event.respond("❌ Erreur lors de la whitelist. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/blacklist"))
+@command_router.command("/blacklist")
 async def blacklist(event):
     """Handle /blacklist command"""
     try:
@@ -176,7 +174,7 @@ async def blacklist(event):
         logger.error(f"Error in blacklist command: {e}")
         await event.respond("❌ Erreur lors de la blacklist. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/chats"))
+@command_router.command("/chats")
 async def chats(event):
     """Handle /chats command"""
     try:
@@ -186,7 +184,11 @@ async def chats(event):
         logger.error(f"Error in chats command: {e}")
         await event.respond("❌ Erreur lors de l'affichage des chats. Veuillez réessayer.")
 
-@client.on(events.NewMessage(pattern="/help"))
+async def chats_page(event):
+    """Handle /chats next/previous buttons"""
+    await handle_chats_page(event, client)
+
+@command_router.command("/help")
 async def help_command(event):
     """Handle /help command"""
     try:
@@ -217,27 +219,27 @@ Pour toute question ou problème, contactez l'administrateur.
         await event.respond("❌ Une erreur est survenue. Veuillez réessayer.")
 
 # Admin commands
-@client.on(events.NewMessage(pattern="/admin"))
+@command_router.command("/admin")
 async def admin_command(event):
     """Handle /admin command"""
     await handle_admin_commands(event, client)
 
-@client.on(events.NewMessage(pattern="/confirm"))
+@command_router.command("/confirm")
 async def confirm_command(event):
     """Handle /confirm command"""
     await handle_admin_commands(event, client)
 
-@client.on(events.NewMessage(pattern="/generate"))
+@command_router.command("/generate")
 async def generate_command(event):
     """Handle /generate command"""
     await handle_admin_commands(event, client)
 
-@client.on(events.NewMessage(pattern="/users"))
+@command_router.command("/users")
 async def users_command(event):
     """Handle /users command"""
     await handle_admin_commands(event, client)
 
-@client.on(events.NewMessage(pattern="/stats"))
+@command_router.command("/stats")
 async def stats_command(event):
     """Handle /stats command"""
     await handle_admin_commands(event, client)
@@ -268,10 +270,11 @@ async def handle_sessions(event, client):
         python_version = platform.python_version()
         system_info = f"{platform.system()} {platform.release()}"
 
-        # Get active connections
-        from bot.connection import active_connections
+        # Get the user's clients (one per connected phone)
+        from bot.client_registry import client_registry
+        entries = client_registry.user_entries(user_id)
 
-        if user_id not in active_connections:
+        if not entries:
             # Afficher quand même les infos serveur
             server_info = f"""
 🌐 **Serveur Replit Hébergement**
@@ -293,31 +296,6 @@ async def handle_sessions(event, client):
             await event.respond(server_info)
             return
 
-        connection_info = active_connections[user_id]
-
-        # Check if connection is still valid
-        if 'client' not in connection_info:
-            server_info = f"""
-🌐 **Serveur Replit Hébergement**
-
-📛 **Nom du serveur :** {hostname}
-🏷️ **Nom du Repl :** {repl_name}
-👤 **Propriétaire :** {repl_owner}
-🔗 **URL publique :** {repl_url}
-🌍 **Adresse IP :** {server_ip}
-🔌 **Port :** {server_port}
-🐍 **Python :** {python_version}
-💻 **Système :** {system_info}
-⏰ **Statut :** ✅ Serveur actif
-
-❌ **Sessions utilisateur :** Session expirée. Veuillez vous reconnecter avec /connect.
-"""
-            await event.respond(server_info)
-            return
-
-        phone = connection_info.get('phone', 'N/A')
-        connected_at = connection_info.get('connected_at', 'N/A')
-
         # Get session from database
         from bot.session_manager import session_manager
         sessions = await session_manager.get_user_sessions(user_id)
@@ -338,10 +316,14 @@ async def handle_sessions(event, client):
 📱 **Sessions Utilisateur**
 
 👤 **Utilisateur :** {user_id}
-📞 **Numéro :** {phone}
-⏰ **Connecté le :** {connected_at}
-🔗 **Statut :** {'✅ Connecté' if connection_info.get('connected', False) else '❌ Déconnecté'}
-
+"""
+        for entry in entries:
+            sessions_text += f"""
+📞 **Numéro :** +{entry.phone}
+⏰ **Connecté le :** {entry.connected_at.strftime('%Y-%m-%d %H:%M:%S')}
+🔗 **Statut :** {'✅ Connecté' if entry.connected else '💤 En veille' if entry.idle else '❌ Déconnecté'}
+"""
+        sessions_text += """
 📊 **Détails des sessions :**
 """
 
@@ -370,12 +352,12 @@ async def handle_sessions(event, client):
     except Exception as e:
         logger.error(f"Erreur dans handle_sessions: {e}")
         await event.respond("❌ Erreur lors de la récupération des sessions.")
-@client.on(events.NewMessage(pattern="/sessions"))
+@command_router.command("/sessions")
 async def sessions_command(event):
     """Handle /sessions command"""
     await handle_admin_commands(event, client)
 
-@client.on(events.NewMessage(pattern="/stop"))
+@command_router.command("/stop")
 async def stop_continuous_command(event):
     """Handle /stop command - Stop continuous mode"""
     try:
@@ -399,7 +381,7 @@ async def stop_continuous_command(event):
         logger.error(f"Error in stop command: {e}")
         await event.respond("❌ Erreur lors de l'arrêt du mode continu.")
 
-@client.on(events.NewMessage(pattern="/start_continuous"))
+@command_router.command("/start_continuous")
 async def start_continuous_command(event):
     """Handle /start_continuous command - Start continuous mode"""
     try:
@@ -423,7 +405,7 @@ async def start_continuous_command(event):
         logger.error(f"Error in start_continuous command: {e}")
         await event.respond("❌ Erreur lors du démarrage du mode continu.")
 
-@client.on(events.NewMessage(pattern="/keepalive"))
+@command_router.command("/keepalive")
 async def keepalive_command(event):
     """Handle /keepalive command - Check keep-alive system status"""
     try:
@@ -486,7 +468,7 @@ async def keepalive_command(event):
         logger.error(f"Error in keepalive command: {e}")
         await event.respond("❌ Erreur lors de la vérification du statut.")
 
-@client.on(events.NewMessage(pattern="/railway"))
+@command_router.command("/railway")
 async def railway_command(event):
     """Handle /railway command - Railway deployment and communication"""
     try:
@@ -528,7 +510,7 @@ async def railway_command(event):
         logger.error(f"Error in railway command: {e}")
         await event.respond("❌ Erreur lors de l'affichage du statut Railway.")
 
-@client.on(events.NewMessage(pattern="/railway deploy"))
+@command_router.command("/railway", "deploy")
 async def railway_deploy_command(event):
     """Handle /railway deploy command"""
     try:
@@ -576,7 +558,7 @@ git push origin main
         logger.error(f"Error in railway deploy command: {e}")
         await event.respond("❌ Erreur lors de l'affichage des instructions de déploiement.")
 
-@client.on(events.NewMessage(pattern="/railway test"))
+@command_router.command("/railway", "test")
 async def railway_test_command(event):
     """Handle /railway test command - Test Railway communication"""
     try:
@@ -618,36 +600,61 @@ async def railway_test_command(event):
         logger.error(f"Error in railway test command: {e}")
         await event.respond("❌ Erreur lors du test de communication Railway.")
 
-@client.on(events.NewMessage)
-async def handle_unknown_command(event):
-    """Handle unknown commands and verification codes"""
+# Message de surveillance automatique envoyé par Render
+SURVEILLANCE_MESSAGE = "Kouamé Appolinaire tu es là"
+
+async def handle_message(event):
+    """Route commands through the command router; handle codes and replies otherwise"""
     # Mettre à jour l'activité du bot à chaque message
     if hasattr(client, 'keep_alive_system'):
         client.keep_alive_system.update_bot_activity()
 
-    # First check if it's a verification code
-    if await handle_verification_code(event, client):
-        return  # Message was handled as verification code
+    text = event.text
+    if not text:
+        return
 
-    # Check if it's a redirection format (ID - ID)
-    if event.text and " - " in event.text:
-        parts = event.text.split(" - ")
-        if len(parts) == 2 and len(parts[0].strip()) > 5 and len(parts[1].strip()) > 5:
-            from bot.redirection import handle_redirection_format
-            await handle_redirection_format(event, client, parts[0].strip(), parts[1].strip())
+    # Commands run exactly one handler, unknown ones get a single reply
+    if text.startswith('/'):
+        if not await command_router.dispatch(event):
+            await event.respond("❓ Commande non reconnue. Tapez /help pour voir les commandes disponibles.")
+        return
+
+    await handle_unknown_command(event)
+
+async def handle_unknown_command(event):
+    """Handle non-command messages: verification codes, redirection IDs, license codes"""
+    # What the user was last asked for: one dict lookup, no disk access
+    state = conversation_states.get(event.sender_id)
+
+    if state is not None:
+        # Check if it's a verification code
+        if state.name == AWAITING_CODE and await handle_verification_code(event, client):
+            return  # Message was handled as verification code
+
+        # Check if it's a redirection format (ID - ID)
+        if state.name == AWAITING_REDIRECTION_IDS and " - " in event.text:
+            parts = event.text.split(" - ")
+            if len(parts) == 2 and len(parts[0].strip()) > 5 and len(parts[1].strip()) > 5:
+                from bot.redirection import handle_redirection_format
+                await handle_redirection_format(event, client, parts[0].strip(), parts[1].strip())
+                return
+
+        # After /valide the first message shaped like a license is the
+        # answer: it is checked once, valid or not
+        if state.name == AWAITING_LICENSE and looks_like_license(event.text.strip()):
+            conversation_states.pop(event.sender_id, AWAITING_LICENSE)
+            await validate_license_code(event, client, event.text.strip())
             return
 
-    # Check if it's a license code (starts with user ID)
-    if event.text and event.text.strip() and event.text.strip().startswith(str(event.sender_id)):
+    # License code sent without /valide (starts with user ID)
+    if event.text.strip().startswith(str(event.sender_id)):
         if await validate_license_code(event, client, event.text.strip()):
             return  # License was validated successfully
 
-    # Then check for unknown commands
-    if event.text and event.text.startswith('/') and not any(event.text.startswith(cmd) for cmd in ['/start', '/connect', '/valide', '/payer', '/deposer', '/redirection', '/transformation', '/whitelist', '/blacklist', '/chats', '/help', '/admin', '/confirm', '/generate', '/users', '/stats', '/sessions', '/keepalive', '/stop', '/start_continuous', '/railway']):
-        await event.respond("❓ Commande non reconnue. Tapez /help pour voir les commandes disponibles.")
+    # Surveillance automatique pour Render
+    if event.text.startswith(SURVEILLANCE_MESSAGE):
+        await surveillance_response(event)
 
-# Surveillance automatique pour Render
-@client.on(events.NewMessage(pattern="Kouamé Appolinaire tu es là ?"))
 async def surveillance_response(event):
     """Handle automatic surveillance from Render"""
     try:
@@ -656,24 +663,56 @@ async def surveillance_response(event):
     except Exception as e:
         logger.error(f"Error in surveillance response: {e}")
 
+def register_handlers(bot_client):
+    """Attach the bot's event handlers; shared by every entrypoint"""
+    # Un seul gestionnaire de messages : le routeur de commandes choisit la commande
+    bot_client.add_event_handler(handle_message, events.NewMessage)
+    bot_client.add_event_handler(chats_page, events.CallbackQuery(pattern=rb"chats\|"))
+
+def start_services():
+    """Start the background upkeep shared by every entrypoint (needs the running loop)"""
+    # Disconnect accounts left without live redirections once idle;
+    # /chats and new redirections reconnect them on demand
+    from bot.client_registry import client_registry
+    client_registry.start_eviction()
+
+    # Expire pending codes, redirection IDs and license prompts (an expired
+    # code prompt disconnects its login client)
+    conversation_states.start_purge()
+
+    # Start the regex workers now, so the first offloaded rule does not
+    # wait for processes to spawn
+    from bot.rule_offload import RULE_OFFLOAD, rule_pool
+    if RULE_OFFLOAD:
+        rule_pool.start()
+
 async def start_bot():
     """Start the bot and handle all initialization"""
     try:
         # Start client with bot token
+        register_handlers(client)
         await client.start(bot_token=BOT_TOKEN)
         logger.info("🚀 Bot TeleFeed démarré avec succès!")
         print("Bot lancé !")
 
-        # Initialize session manager and restore sessions
-        from bot.session_manager import session_manager
-        await session_manager.restore_all_sessions()
+        # Load user data on the storage thread before any handler needs it
+        from bot.database import init_storage
+        await init_storage()
+
+        # Restore sessions and their redirections in the background, accounts
+        # in parallel: each one goes live as soon as it is authorized
+        from bot.startup import restore_accounts, startup
+        startup.task = asyncio.create_task(restore_accounts())
 
-        # Wait a moment for sessions to be fully restored
-        await asyncio.sleep(2)
+        start_services()
 
-        # Restore all active redirections automatically (système simple)
-        from bot.simple_restorer import simple_restorer
-        await simple_restorer.restore_all_redirections()
+        # Serveur HTTP (ping, wake-up, send-message...) dans la même boucle :
+        # les messages sortants passent par ce client déjà connecté
+        try:
+            from http_server import start_http_server
+            await start_http_server(client)
+        except Exception as e:
+            logger.error(f"Error starting HTTP server: {e}")
 
         # Configuration des redirections automatiques via simple_restorer uniquement
         # from bot.message_handler import message_redirector
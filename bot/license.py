@@ -2,6 +2,7 @@ from telethon import events
 import logging
 import os
 from bot.database import store_license, is_user_licensed
+from bot.conversation import conversation_states, AWAITING_LICENSE
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +27,8 @@ async def check_license(event, client):
         # For now, inform user to send license in next message
         await event.respond("📝 **Instructions :**\n\nEnvoyez votre code de licence dans le prochain message.")
         
-        # Note: License validation will be handled by the message handler
-        # This is a simplified approach - in production, you'd use conversation state
-            
-        # This function now only handles the /valide command
-        # License validation will be handled by a separate function
+        # The message handler validates the next message as a license code
+        conversation_states.set(event.sender_id, AWAITING_LICENSE)
                 
     except Exception as e:
         logger.error(f"Error in license validation: {e}")
@@ -70,6 +68,13 @@ def validate_license_format(license_code, user_id):
     
     return True
 
+def looks_like_license(text):
+    """Whether a message could be a license code: one alphanumeric word of
+    over 20 characters opening with a user ID (digits), so ordinary
+    messages sent after /valide are not taken as attempts
+    """
+    return len(text) > 20 and text.isalnum() and text[:5].isdigit()
+
 async def validate_license_code(event, client, license_code):
     """
     Validate a license code sent by user
@@ -91,6 +96,7 @@ async def validate_license_code(event, client, license_code):
             
             # Store license validation
             await store_license(user_id, license_code)
+            conversation_states.pop(event.sender_id, AWAITING_LICENSE)
             return True
             
         else:
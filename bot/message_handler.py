@@ -1,8 +1,9 @@
 import logging
-import asyncio
-from telethon import events
-from bot.database import load_data
-from bot.connection import active_connections
+from bot.database import get_all_data, redirection_destinations
+from bot.client_registry import client_registry, normalize_phone
+from bot.routing import RedirectionRule, get_router, sync_user_rules, unregister
+from bot.entity_cache import get_entity_cache
+from bot.forwarding import forwarder
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -12,71 +13,35 @@ class MessageRedirector:
     
     def __init__(self):
         self.redirection_clients = {}
-        self.message_mapping = {}  # Maps original message ID to redirected message ID
         
     async def setup_redirection_handlers(self):
-        """Setup message handlers for all active connections"""
+        """Setup message handlers for all users with redirections"""
         try:
-            data = load_data()
+            data = await get_all_data()
             redirections = data.get("redirections", {})
             total_redirections = 0
             
-            # First, restore all sessions for users with active redirections
-            await self._restore_sessions_for_redirections(redirections)
-            
-            # Wait a moment for sessions to be fully established
-            await asyncio.sleep(3)
-            
             for user_id, user_redirections in redirections.items():
-                if int(user_id) in active_connections:
-                    connection_data = active_connections[int(user_id)]
-                    client = connection_data.get('client')
-                    if client and client.is_connected():
-                        count = await self._setup_client_handlers(client, int(user_id), user_redirections)
+                # One client per phone: a user's redirections may span several accounts
+                by_phone = {}
+                for name, redir_data in user_redirections.items():
+                    if redir_data.get('active', True) and redir_data.get('phone'):
+                        by_phone.setdefault(normalize_phone(redir_data['phone']), {})[name] = redir_data
+                
+                for phone_number, phone_redirections in by_phone.items():
+                    client = await client_registry.acquire(int(user_id), phone_number, "redirections", once=True)
+                    if client:
+                        count = await self._setup_client_handlers(client, int(user_id), phone_redirections)
                         total_redirections += count
-                        logger.info(f"Restored {count} redirections for user {user_id}")
+                        logger.info(f"Restored {count} redirections for user {user_id} on {phone_number}")
                     else:
-                        logger.warning(f"User {user_id} has redirections but no active client")
-                else:
-                    logger.warning(f"User {user_id} has redirections but no active connection")
+                        logger.warning(f"User {user_id} has redirections on {phone_number} but no usable session")
             
             logger.info(f"🔄 Redirections automatiques configurées: {total_redirections} redirections actives")
                         
         except Exception as e:
             logger.error(f"Error setting up redirection handlers: {e}")
     
-    async def _restore_sessions_for_redirections(self, redirections):
-        """Restore sessions for users with active redirections"""
-        try:
-            from bot.session_manager import session_manager
-            
-            for user_id, user_redirections in redirections.items():
-                # Check if user has active redirections
-                active_redirections = [r for r in user_redirections.values() if r.get('active', True)]
-                
-                if active_redirections:
-                    logger.info(f"Restoring session for user {user_id} with {len(active_redirections)} redirections")
-                    
-                    # Get phone number from redirections
-                    phone_number = None
-                    for redir_data in active_redirections:
-                        if redir_data.get('phone'):
-                            phone_number = redir_data['phone']
-                            break
-                    
-                    if phone_number:
-                        # Try to restore the session
-                        try:
-                            await session_manager._restore_session(int(user_id), phone_number, f"session_{user_id}_{phone_number}.session")
-                            logger.info(f"Session restored for user {user_id} with phone {phone_number}")
-                        except Exception as e:
-                            logger.error(f"Failed to restore session for user {user_id}: {e}")
-                    else:
-                        logger.warning(f"No phone number found for user {user_id} redirections")
-                        
-        except Exception as e:
-            logger.error(f"Error restoring sessions for redirections: {e}")
-    
     async def _setup_client_handlers(self, client, user_id, user_redirections):
         """Setup message handlers for a specific client"""
         setup_count = 0
@@ -84,158 +49,43 @@ class MessageRedirector:
             for name, redir_data in user_redirections.items():
                 if redir_data.get('active', True):
                     source_id = redir_data.get('source_id')
-                    destination_id = redir_data.get('destination_id')
+                    destination_ids = redirection_destinations(redir_data)
                     
-                    if source_id and destination_id:
-                        # Create handler for new messages
-                        @client.on(events.NewMessage(chats=int(source_id)))
-                        async def message_handler(event, dest_id=destination_id, redirect_name=name):
-                            await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=False)
-                        
-                        # Create handler for edited messages
-                        @client.on(events.MessageEdited(chats=int(source_id)))
-                        async def edit_handler(event, dest_id=destination_id, redirect_name=name):
-                            await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=True)
+                    if source_id and destination_ids:
+                        # Catch up on what was missed while offline, then route
+                        # new and edited messages of the source to this redirection
+                        rule = RedirectionRule(user_id, name, source_id, destination_ids, forwarder.route)
+                        forwarder.start_catch_up(client, rule)
+                        get_router(client).add_rule(rule)
                         
                         setup_count += 1
-                        logger.info(f"✅ Redirection '{name}' configurée: {source_id} -> {destination_id}")
+                        logger.info(f"✅ Redirection '{name}' configurée: {source_id} -> {', '.join(destination_ids)}")
             
+            if setup_count:
+                get_entity_cache(client).warm()
             return setup_count
                         
         except Exception as e:
             logger.error(f"Error setting up client handlers: {e}")
             return setup_count
     
-    async def _handle_message_redirection(self, event, destination_id, redirect_name, user_id, is_edit=False):
-        """Handle individual message redirection"""
-        try:
-            # Get the client for forwarding
-            client = active_connections[user_id].get('client')
-            if not client or not client.is_connected():
-                logger.warning(f"Client not available for redirection {redirect_name}")
-                return
-            
-            # Get message content
-            message = event.message
-            original_msg_id = message.id
-            mapping_key = f"{event.chat_id}_{original_msg_id}_{destination_id}"
-            
-            # Get source and destination channel names for logging only
-            source_name = await self._get_channel_name(client, event.chat_id)
-            dest_name = await self._get_channel_name(client, int(destination_id))
-            
-            if is_edit:
-                # Check if we have a mapping for this message
-                if mapping_key in self.message_mapping:
-                    redirected_msg_id = self.message_mapping[mapping_key]
-                    try:
-                        # Edit the existing message
-                        if message.text:
-                            await client.edit_message(int(destination_id), redirected_msg_id, message.text)
-                            action = "edited and updated"
-                            logger.info(f"Message {action} from {event.chat_id} ({source_name}) to {destination_id} ({dest_name}) via {redirect_name}")
-                            return
-                        elif message.media:
-                            # For media edits, we need to delete and resend since Telegram doesn't allow editing media in the same way
-                            try:
-                                await client.delete_messages(int(destination_id), redirected_msg_id)
-                            except:
-                                pass  # Continue even if delete fails
-                            # Fall through to send new message
-                        else:
-                            # Message was deleted or has no content, delete the redirected message too
-                            try:
-                                await client.delete_messages(int(destination_id), redirected_msg_id)
-                                del self.message_mapping[mapping_key]
-                                logger.info(f"Message deleted from {event.chat_id} to {destination_id} via {redirect_name}")
-                                return
-                            except Exception as delete_error:
-                                logger.warning(f"Failed to delete message {redirected_msg_id}: {delete_error}")
-                                return
-                    except Exception as edit_error:
-                        # Check if it's just a "content not modified" error
-                        if "Content of the message was not modified" in str(edit_error):
-                            logger.info(f"Message content unchanged for edit in {event.chat_id} to {destination_id} via {redirect_name}")
-                            return  # Don't send duplicate message
-                        else:
-                            logger.warning(f"Failed to edit message {redirected_msg_id}: {edit_error}. Sending new message instead.")
-                            # If edit fails for other reasons, continue to send new message
-                else:
-                    # This is an edit but we don't have the original message mapped
-                    logger.info(f"Edit event for unmapped message {original_msg_id} in {event.chat_id}")
-                    # Don't send anything for edits of unmapped messages
-                    return
-            
-            # Send new message (either first time or edit/media replacement)
-            sent_message = None
-            if message.text:
-                sent_message = await client.send_message(int(destination_id), message.text)
-            elif message.media:
-                # Forward media directly
-                sent_message = await client.forward_messages(int(destination_id), message)
-            
-            # Store the mapping for future edits (only for new messages or successful replacements)
-            if sent_message and not is_edit:
-                if hasattr(sent_message, 'id'):
-                    self.message_mapping[mapping_key] = sent_message.id
-                elif isinstance(sent_message, list) and len(sent_message) > 0:
-                    self.message_mapping[mapping_key] = sent_message[0].id
-            elif sent_message and is_edit:
-                # Update mapping for media replacements
-                if hasattr(sent_message, 'id'):
-                    self.message_mapping[mapping_key] = sent_message.id
-                elif isinstance(sent_message, list) and len(sent_message) > 0:
-                    self.message_mapping[mapping_key] = sent_message[0].id
-            
-            action = "edited and redirected" if is_edit else "redirected"
-            logger.info(f"Message {action} from {event.chat_id} ({source_name}) to {destination_id} ({dest_name}) via {redirect_name}")
-            
-        except Exception as e:
-            logger.error(f"Error handling message redirection: {e}")
-    
-    async def _get_channel_name(self, client, chat_id):
-        """Get the actual channel/chat name"""
-        try:
-            entity = await client.get_entity(chat_id)
-            
-            # Get the proper name
-            if hasattr(entity, 'title') and entity.title:
-                return entity.title
-            elif hasattr(entity, 'first_name') and entity.first_name:
-                name = entity.first_name
-                if hasattr(entity, 'last_name') and entity.last_name:
-                    name += f" {entity.last_name}"
-                return name
-            elif hasattr(entity, 'username') and entity.username:
-                return f"@{entity.username}"
-            else:
-                return f"Chat {chat_id}"
-                
-        except Exception as e:
-            logger.error(f"Error getting channel name for {chat_id}: {e}")
-            return f"Chat {chat_id}"
-    
-    async def add_redirection_handler(self, user_id, name, source_id, destination_id):
-        """Add a new redirection handler for a user"""
+    async def add_redirection_handler(self, user_id, name, phone_number, source_id, destination_id):
+        """Add a new redirection handler for a user
+        
+        `destination_id` may be a single id or a list of ids.
+        """
         try:
-            if user_id not in active_connections:
+            client = await client_registry.acquire(user_id, phone_number, "redirections", once=True)
+            if not client:
                 return False
-                
-            client = active_connections[user_id].get('client')
-            if not client or not client.is_connected():
-                return False
-            
-            # Create handler for new messages
-            @client.on(events.NewMessage(chats=int(source_id)))
-            async def message_handler(event, dest_id=destination_id, redirect_name=name):
-                await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=False)
             
-            # Create handler for edited messages
-            @client.on(events.MessageEdited(chats=int(source_id)))
-            async def edit_handler(event, dest_id=destination_id, redirect_name=name):
-                await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=True)
+            # Route new and edited messages of the source to this redirection
+            get_router(client).add_rule(
+                RedirectionRule(user_id, name, source_id, destination_id, forwarder.route)
+            )
+            get_entity_cache(client).warm()
             
-            logger.info(f"Added message and edit handlers for redirection {name}: {source_id} -> {destination_id}")
+            logger.info(f"Added routing rule for redirection {name}: {source_id} -> {destination_id}")
             return True
             
         except Exception as e:
@@ -245,15 +95,58 @@ class MessageRedirector:
     async def remove_redirection_handler(self, user_id, name):
         """Remove a redirection handler for a user"""
         try:
-            # Note: Telethon doesn't provide direct handler removal
-            # In a production system, you would need to track handlers
-            # and remove them manually or restart the client
-            logger.info(f"Redirection handler removal requested for {name}")
+            removed = unregister(user_id, name)
+            logger.info(f"Redirection handler for {name} {'removed' if removed else 'was not active'}")
             return True
             
         except Exception as e:
             logger.error(f"Error removing redirection handler: {e}")
             return False
+    
+    async def sync_user_redirections(self, user_id):
+        """Replace a user's live rules with their stored redirections
+        
+        Each redirection runs on the client of its own phone. Returns the
+        names of the redirections now live (those whose phone has a usable
+        session), or None on error.
+        """
+        try:
+            from bot.database import get_redirections_for_user
+            
+            redirections = await get_redirections_for_user(user_id)
+            by_phone = {}
+            for name, redir in redirections.items():
+                if redir.get('active', True) and redir.get('source_id') and redirection_destinations(redir) and redir.get('phone'):
+                    try:
+                        rule = RedirectionRule(user_id, name, redir['source_id'], redirection_destinations(redir), forwarder.route)
+                    except (ValueError, TypeError) as e:
+                        # A malformed entry (e.g. "@chan" as an id) must not keep the others offline
+                        logger.error(f"Skipping redirection {name} of {user_id} with invalid chat ids: {e}")
+                        continue
+                    by_phone.setdefault(normalize_phone(redir['phone']), []).append(rule)
+            
+            rules_by_client = {}
+            for phone_number, rules in by_phone.items():
+                client = await client_registry.acquire(user_id, phone_number, "redirections", once=True)
+                if client:
+                    rules_by_client[client] = rules
+                else:
+                    logger.warning(f"No client for {user_id}:{phone_number}, {len(rules)} redirection(s) not live")
+            
+            sync_user_rules(user_id, rules_by_client)
+            # Phones left without redirections no longer need a client for them
+            for entry in client_registry.user_entries(user_id):
+                if entry.phone not in by_phone and "redirections" in entry.holders:
+                    await client_registry.release(user_id, entry.phone, "redirections")
+            for client in rules_by_client:
+                get_entity_cache(client).warm()
+            live = {rule.name for rules in rules_by_client.values() for rule in rules}
+            logger.info(f"Redirections synchronisées pour {user_id}: {len(live)} active(s)")
+            return live
+            
+        except Exception as e:
+            logger.error(f"Error syncing redirections for user {user_id}: {e}")
+            return None
 
 # Global message redirector instance
 message_redirector = MessageRedirector()
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Correspondance entre messages source et messages redirigés
+Cache mémoire borné (LRU + TTL) au-dessus d'une table SQLite compacte, pour
+que la synchronisation des éditions survive aux redémarrages
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from bot.database import storage_executor
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+MAPPING_FILE = "message_map.db"
+
+# Entries kept in memory; older ones are still found on disk
+MAPPING_CACHE_SIZE = int(os.getenv("MAPPING_CACHE_SIZE", "50000"))
+MAPPING_CACHE_TTL = int(os.getenv("MAPPING_CACHE_TTL", str(6 * 3600)))
+
+# Rows older than this are pruned from disk (edits of very old posts are dropped)
+MAPPING_RETENTION_DAYS = int(os.getenv("MAPPING_RETENTION_DAYS", "30"))
+
+# Pending writes are flushed after this delay or once this many accumulate
+MAPPING_FLUSH_DELAY = 2.0
+MAPPING_FLUSH_BATCH = 500
+
+def mapping_key(source_chat, source_msg, destination):
+    """Integer key for a forwarded message"""
+    return (bare_peer_id(source_chat), int(source_msg), bare_peer_id(destination))
+
+class MessageMappingStore:
+    """(source_chat, source_msg, destination) -> destination message id"""
+
+    def __init__(self, path=MAPPING_FILE, cache_size=MAPPING_CACHE_SIZE, cache_ttl=MAPPING_CACHE_TTL):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()  # key -> (dest_msg_id, cached_at)
+        self.pending = {}           # key -> dest_msg_id, or None for a deletion
+        self._conn = None
+        self._flush_handle = None
+        self._last_prune = 0.0
+
+    # Memory tier
+
+    def _remember(self, key, dest_msg_id):
+        self.cache[key] = (dest_msg_id, time.monotonic())
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _recall(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        dest_msg_id, cached_at = entry
+        if time.monotonic() - cached_at > self.cache_ttl:
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return dest_msg_id
+
+    # Public API
+
+    async def get(self, key):
+        """Return the destination message id, or None"""
+        dest_msg_id = self._recall(key)
+        if dest_msg_id is not None:
+            return dest_msg_id
+        if key in self.pending:
+            return self.pending[key]
+        loop = asyncio.get_running_loop()
+        dest_msg_id = await loop.run_in_executor(storage_executor, self._select, key)
+        if dest_msg_id is not None:
+            self._remember(key, dest_msg_id)
+        return dest_msg_id
+
+    def put(self, key, dest_msg_id):
+        self._remember(key, dest_msg_id)
+        self.pending[key] = dest_msg_id
+        self._schedule_flush()
+
+    def delete(self, key):
+        self.cache.pop(key, None)
+        self.pending[key] = None
+        self._schedule_flush()
+
+    # Disk tier (storage thread only)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_map (
+                    source_chat INTEGER NOT NULL,
+                    source_msg INTEGER NOT NULL,
+                    destination INTEGER NOT NULL,
+                    dest_msg INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    PRIMARY KEY (source_chat, source_msg, destination)
+                ) WITHOUT ROWID
+            """)
+        return self._conn
+
+    def _select(self, key):
+        row = self._connection().execute(
+            "SELECT dest_msg FROM message_map WHERE source_chat = ? AND source_msg = ? AND destination = ?",
+            key
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, batch):
+        conn = self._connection()
+        now = int(time.time())
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO message_map VALUES (?, ?, ?, ?, ?)",
+                [key + (dest_msg_id, now) for key, dest_msg_id in batch.items() if dest_msg_id is not None]
+            )
+            conn.executemany(
+                "DELETE FROM message_map WHERE source_chat = ? AND source_msg = ? AND destination = ?",
+                [key for key, dest_msg_id in batch.items() if dest_msg_id is None]
+            )
+            if now - self._last_prune > 3600:
+                conn.execute(
+                    "DELETE FROM message_map WHERE created_at < ?",
+                    (now - MAPPING_RETENTION_DAYS * 86400,)
+                )
+                self._last_prune = now
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            logger.error(f"Error writing message mappings: {e}")
+
+    # Flushing
+
+    def _schedule_flush(self):
+        if len(self.pending) >= MAPPING_FLUSH_BATCH:
+            self.flush()
+            return
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(MAPPING_FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        """Hand pending writes to the storage thread"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.pending:
+            return None
+        batch, self.pending = self.pending, {}
+        try:
+            return storage_executor.submit(self._write, batch)
+        except RuntimeError:
+            # Interpreter shutting down
+            self._write(batch)
+            return None
+
+    def close(self):
+        future = self.flush()
+        if future is not None:
+            future.result()
+
+# Global message mapping store, shared by every forwarding path
+message_mappings = MessageMappingStore()
+atexit.register(message_mappings.close)
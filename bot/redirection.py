@@ -1,9 +1,14 @@
 import logging
+import re
 from telethon import events
 from telethon.errors import ChannelInvalidError, UsernameNotOccupiedError
+from bot.conversation import conversation_states, AWAITING_REDIRECTION_IDS
 
 logger = logging.getLogger(__name__)
 
+# A chat id as listed by /chats: digits, optionally prefixed with "-"
+CHAT_ID = re.compile(r"-?\d+")
+
 async def handle_redirection_command(event, client):
     """
     Handle /redirection command
@@ -30,6 +35,11 @@ Commande utilisée pour configurer les redirections. Vous devez utiliser la comm
 
 **Afficher les redirections actives :**
 `/redirection 2759205517`
+
+**Transférer l'historique de la source (100 derniers messages, N derniers, ou depuis une date) :**
+`/redirection backfill groupe1 on 2759205517`
+`/redirection backfill groupe1 on 2759205517 500`
+`/redirection backfill groupe1 on 2759205517 since 2025-01-31`
             """
             await event.respond(usage_message)
             return
@@ -47,6 +57,8 @@ Commande utilisée pour configurer les redirections. Vous devez utiliser la comm
             await remove_redirection(event, client, parts[2], parts[4])
         elif parts[1] == "change" and len(parts) == 5 and parts[3] == "on":
             await change_redirection(event, client, parts[2], parts[4])
+        elif parts[1] == "backfill" and len(parts) >= 5 and parts[3] == "on":
+            await backfill_redirection(event, client, parts[2], parts[4], parts[5:])
         elif len(parts) == 2 and parts[1].isdigit():
             await show_redirections(event, client, parts[1])
         else:
@@ -82,6 +94,9 @@ async def add_redirection(event, client, name, phone_number):
 **Exemple :**
 `1002370795564 - 1002682552255`
 
+**Plusieurs destinations (séparées par des virgules) :**
+`1002370795564 - 1002682552255, 1002646551216`
+
 ➡️ **Envoyez votre format maintenant :**
         """
         
@@ -102,8 +117,10 @@ async def remove_redirection(event, client, name, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
             return
         
-        # Remove redirection
+        # Remove redirection and stop forwarding immediately
         await store_redirection(user_id, name, phone_number, "remove")
+        from bot.message_handler import message_redirector
+        await message_redirector.remove_redirection_handler(user_id, name)
         
         success_message = f"""
 ✅ **Redirection supprimée**
@@ -153,13 +170,14 @@ async def change_redirection(event, client, name, phone_number):
 
 📞 **Numéro connecté :** {phone_number}
 🔄 **Nom de la redirection :** {name}
-📺 **Configuration actuelle :** {existing_redirect.get('source_id', 'N/A')} → {existing_redirect.get('destination_id', 'N/A')}
+📺 **Configuration actuelle :** {existing_redirect.get('source_id') or 'N/A'} → {', '.join(existing_redirect.get('destination_ids') or ['N/A'])}
 
 **Maintenant, envoyez le nouveau format de redirection :**
 `ID_CANAL_SOURCE - ID_CANAL_DESTINATION`
 
 **Exemple :**
 `1002370795564 - 1002682552255`
+`1002370795564 - 1002682552255, 1002646551216`
 
 ➡️ **Envoyez votre nouveau format maintenant :**
         """
@@ -171,6 +189,69 @@ async def change_redirection(event, client, name, phone_number):
         logger.error(f"Error changing redirection: {e}")
         await event.respond("❌ Erreur lors de la modification de la redirection.")
 
+async def backfill_redirection(event, client, name, phone_number, range_args):
+    """Forward the source history of a redirection"""
+    try:
+        user_id = event.sender_id
+        
+        # Check if user has premium access
+        if not await is_premium_user(user_id):
+            await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
+            return
+        
+        from bot.database import get_redirections_for_user, get_backfill
+        from bot.backfill import backfill_running, new_job, parse_backfill_range, start_backfill
+        from bot.client_registry import client_registry
+        
+        try:
+            count, since = parse_backfill_range(range_args)
+        except ValueError:
+            await event.respond("❌ Format incorrect. Exemple : `/redirection backfill NOM on NUMERO 500` ou `... since 2025-01-31`")
+            return
+        
+        redirection = (await get_redirections_for_user(user_id)).get(name)
+        if not redirection or redirection.get('phone') != phone_number:
+            await event.respond(f"❌ **Redirection introuvable**\n\nAucune redirection nommée '{name}' trouvée pour le numéro {phone_number}.")
+            return
+        
+        # The running backfill holds the client and releases it when done
+        if backfill_running(user_id, name):
+            await event.respond(f"⏳ **Backfill {name}** déjà en cours.")
+            return
+        
+        # History is read and forwarded with the user's own account
+        account_client = await client_registry.acquire(user_id, phone_number, "backfill")
+        if not account_client:
+            await event.respond(f"❌ **Compte non connecté**\n\nConnectez {phone_number} avec `/connect` avant de lancer un backfill.")
+            return
+        
+        task = None
+        try:
+            # Without a range, an interrupted backfill is resumed where it stopped
+            job = await get_backfill(user_id, name)
+            resuming = not range_args and job and job.get('status') != 'done'
+            if resuming:
+                job['status'] = 'running'
+            else:
+                job = new_job(phone_number, count, since)
+            
+            status_message = await event.respond(
+                f"⏳ **Backfill {name}** : {'reprise' if resuming else 'démarrage'}..."
+            )
+            task = start_backfill(status_message, account_client, user_id, name, redirection, job)
+            if task is None:
+                # Started meanwhile by another command, which holds the client
+                await status_message.edit(f"⏳ **Backfill {name}** déjà en cours.")
+                return
+        finally:
+            if task is None and not backfill_running(user_id, name):
+                await client_registry.release(user_id, phone_number, "backfill")
+        logger.info(f"Backfill {'resumed' if resuming else 'started'} by user {user_id}: {name} on {phone_number}")
+        
+    except Exception as e:
+        logger.error(f"Error starting backfill: {e}")
+        await event.respond("❌ Erreur lors du lancement du backfill.")
+
 async def show_redirections(event, client, phone_number):
     """Show active redirections for a phone number"""
     try:
@@ -181,8 +262,10 @@ async def show_redirections(event, client, phone_number):
             await event.respond("❌ **Accès premium requis**\n\nCette fonctionnalité est réservée aux utilisateurs premium.")
             return
         
-        # Get redirections
+        # Get redirections and their per-destination delivery counters
         redirections = await get_user_redirections(user_id, phone_number)
+        from bot.database import get_delivery_results
+        deliveries = await get_delivery_results(user_id)
         
         if not redirections:
             message = f"""
@@ -198,6 +281,12 @@ Aucune redirection active pour ce numéro.
                 channel_name = r.get('channel_name', r['name'])
                 status = r.get('status', 'Actif')
                 redirection_list.append(f"• **{r['name']}** → 📺 {channel_name} - {status}")
+                for destination_id in r.get('destination_ids', []):
+                    counters = deliveries.get(r['name'], {}).get(str(destination_id), {})
+                    line = f"   ↳ `{destination_id}` : {counters.get('delivered', 0)} transféré(s)"
+                    if counters.get('failed'):
+                        line += f", {counters['failed']} échec(s)"
+                    redirection_list.append(line)
             
             message = f"""
 📋 **Redirections actives pour {phone_number}**
@@ -256,9 +345,9 @@ async def get_channel_name(client, phone_number, fallback_name):
         return f"📺 {fallback_name}"
 
 async def store_pending_redirection(user_id, name, phone_number):
-    """Store pending redirection waiting for channel IDs"""
-    from bot.database import store_pending_redirection as db_store_pending
-    await db_store_pending(user_id, name, phone_number)
+    """Wait for the channel IDs of a redirection in the user's next messages"""
+    conversation_states.set(user_id, AWAITING_REDIRECTION_IDS, {'name': name, 'phone_number': phone_number})
+    logger.info(f"Pending redirection stored for user {user_id}: {name} on {phone_number}")
 
 async def handle_redirection_format(event, client, source_id, destination_id):
     """Handle redirection format input (ID - ID)"""
@@ -280,18 +369,30 @@ async def handle_redirection_format(event, client, source_id, destination_id):
         name = pending['name']
         phone_number = pending['phone_number']
         
+        # One source may feed several destinations: "SOURCE - DEST1, DEST2"
+        destination_ids = list(dict.fromkeys(d for d in re.split(r"[,;\s]+", destination_id) if d))
+        if not destination_ids:
+            await event.respond("❌ Format incorrect. Exemple : `1002370795564 - 1002682552255`")
+            return
+        invalid_ids = [chat_id for chat_id in [source_id] + destination_ids if not CHAT_ID.fullmatch(chat_id)]
+        if invalid_ids:
+            await event.respond(f"❌ **ID invalide :** {', '.join(invalid_ids)}\n\nLes IDs doivent être numériques. Utilisez `/chats` pour les obtenir.")
+            return
+        
         # Get channel name for display
         channel_name = await get_channel_name(client, phone_number, name)
         
         # Store complete redirection with channel IDs
-        await store_redirection(user_id, name, phone_number, "add", channel_name, source_id, destination_id)
+        await store_redirection(user_id, name, phone_number, "add", channel_name, source_id, destination_ids)
         
         # Clear pending redirection
         await clear_pending_redirection(user_id)
         
-        # Set up message redirection handler
+        # Swap the live rules for the stored ones (covers add, change and
+        # the redirection replaced on the same phone)
         from bot.message_handler import message_redirector
-        handler_added = await message_redirector.add_redirection_handler(user_id, name, source_id, destination_id)
+        live_redirections = await message_redirector.sync_user_redirections(user_id)
+        handler_added = bool(live_redirections and name in live_redirections)
         
         success_message = f"""
 ✅ **Redirection configurée avec succès**
@@ -300,7 +401,7 @@ async def handle_redirection_format(event, client, source_id, destination_id):
 📺 **Canal de destination :** {channel_name}
 📞 **Numéro source :** {phone_number}
 🔄 **Canal source :** {source_id}
-🎯 **Canal destination :** {destination_id}
+🎯 **Canal destination :** {', '.join(destination_ids)}
 
 {"🔄 **Transfert automatique :** Activé" if handler_added else "⚠️ **Transfert automatique :** Erreur d'activation"}
 
@@ -308,7 +409,7 @@ La redirection est maintenant active !
         """
         
         await event.respond(success_message)
-        logger.info(f"Redirection configured for user {user_id}: {name} ({source_id} -> {destination_id})")
+        logger.info(f"Redirection configured for user {user_id}: {name} ({source_id} -> {', '.join(destination_ids)})")
         
     except Exception as e:
         logger.error(f"Error handling redirection format: {e}")
@@ -316,10 +417,10 @@ La redirection est maintenant active !
 
 async def get_pending_redirection(user_id):
     """Get pending redirection for user"""
-    from bot.database import get_pending_redirection as db_get_pending
-    return await db_get_pending(user_id)
+    state = conversation_states.get(user_id, AWAITING_REDIRECTION_IDS)
+    return state.data if state else None
 
 async def clear_pending_redirection(user_id):
     """Clear pending redirection for user"""
-    from bot.database import clear_pending_redirection as db_clear_pending
-    await db_clear_pending(user_id)
\ No newline at end of file
+    if conversation_states.pop(user_id, AWAITING_REDIRECTION_IDS) is not None:
+        logger.info(f"Pending redirection cleared for user {user_id}")
\ No newline at end of file
@@ -5,11 +5,8 @@ Ce module assure que toutes les redirections actives sont restaurées au démarr
 
 import logging
 import asyncio
-import os
-from telethon import TelegramClient
-from bot.database import load_data
-from bot.connection import active_connections, store_connection_client
-from config.settings import API_ID, API_HASH
+from bot.database import get_all_data
+from bot.client_registry import client_registry
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +23,7 @@ class RedirectionRestorer:
             logger.info("🔄 Démarrage de la restauration automatique des redirections")
             
             # Charger les données
-            data = load_data()
+            data = await get_all_data()
             redirections = data.get("redirections", {})
             
             if not redirections:
@@ -72,7 +69,7 @@ class RedirectionRestorer:
             
             if client:
                 # Configurer les redirections
-                await self._setup_redirections(client, user_id, active_redirections)
+                await self._setup_redirections(client, user_id, phone_number, active_redirections)
                 logger.info(f"✅ {len(active_redirections)} redirections restaurées pour utilisateur {user_id}")
                 self.restored_count += len(active_redirections)
             else:
@@ -84,70 +81,35 @@ class RedirectionRestorer:
             self.failed_count += len(user_redirections)
     
     async def _restore_telegram_session(self, user_id, phone_number):
-        """Restaure une session Telegram"""
+        """Restaure une session Telegram (ou reprend le client déjà ouvert)"""
         try:
-            # Vérifier si la session existe déjà
-            if user_id in active_connections:
-                client = active_connections[user_id].get('client')
-                if client and client.is_connected():
-                    logger.info(f"Session déjà active pour utilisateur {user_id}")
-                    return client
-            
-            # Chercher le fichier de session
-            session_file = f"session_{user_id}_{phone_number}.session"
-            if not os.path.exists(session_file):
-                # Chercher d'autres formats de session
-                possible_sessions = [
-                    f"session_{user_id}_{phone_number}.session",
-                    f"{user_id}_{phone_number}.session",
-                    f"session_{phone_number}.session",
-                    f"{phone_number}.session"
-                ]
-                
-                session_file = None
-                for session_name in possible_sessions:
-                    if os.path.exists(session_name):
-                        session_file = session_name
-                        break
-                
-                if not session_file:
-                    logger.warning(f"Aucun fichier de session trouvé pour {user_id}:{phone_number}")
-                    return None
-            
-            # Créer le client Telegram
-            client = TelegramClient(session_file, API_ID, API_HASH)
-            
-            # Démarrer la session
-            await client.start(phone=phone_number)
-            
-            if client.is_connected():
-                # Stocker la connexion
-                await store_connection_client(user_id, phone_number, client)
+            client = await client_registry.acquire(user_id, phone_number, "redirections", once=True)
+            if client:
                 logger.info(f"Session restaurée avec succès pour {user_id}:{phone_number}")
-                return client
             else:
-                logger.error(f"Impossible de se connecter pour {user_id}:{phone_number}")
-                return None
+                logger.warning(f"Aucune session utilisable pour {user_id}:{phone_number}")
+            return client
                 
         except Exception as e:
             logger.error(f"Erreur lors de la restauration de session {user_id}:{phone_number}: {e}")
             return None
     
-    async def _setup_redirections(self, client, user_id, redirections):
+    async def _setup_redirections(self, client, user_id, phone_number, redirections):
         """Configure les redirections pour un client"""
         try:
             from bot.message_handler import message_redirector
+            from bot.database import redirection_destinations
             
             for name, redir_data in redirections.items():
                 source_id = int(redir_data['source_id'])
-                destination_id = int(redir_data['destination_id'])
+                destination_ids = redirection_destinations(redir_data)
                 
                 # Ajouter le gestionnaire de redirection
                 await message_redirector.add_redirection_handler(
-                    user_id, name, source_id, destination_id
+                    user_id, name, redir_data.get('phone') or phone_number, source_id, destination_ids
                 )
                 
-                logger.info(f"Redirection configurée: {name} ({source_id} -> {destination_id})")
+                logger.info(f"Redirection configurée: {name} ({source_id} -> {', '.join(destination_ids)})")
                 
         except Exception as e:
             logger.error(f"Erreur lors de la configuration des redirections: {e}")
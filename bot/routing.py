@@ -0,0 +1,169 @@
+"""
+Routage des messages entrants par ID de source
+Un seul gestionnaire NewMessage et un seul MessageEdited par client, adossés
+à un index {source_id: règles} au lieu d'un couple de gestionnaires filtrés
+par redirection
+"""
+
+import logging
+from telethon import events
+
+logger = logging.getLogger(__name__)
+
+def bare_peer_id(value):
+    """Normalize a chat id to its bare numeric form
+
+    Telethon reports channels as -100XXXX and groups as -XXXX, /chats shows
+    the bare XXXX and users often type 100XXXX; all map to XXXX.
+    """
+    text = str(value).strip()
+    if text.startswith("-100"):
+        return int(text[4:])
+    if text.startswith("-"):
+        return int(text[1:])
+    if text.startswith("100") and len(text) >= 13:
+        return int(text[3:])
+    return int(text)
+
+class RedirectionRule:
+    """A redirection compiled for dispatch"""
+
+    __slots__ = ("user_id", "name", "source_id", "destination_ids", "source_key", "forward")
+
+    def __init__(self, user_id, name, source_id, destination_ids, forward):
+        self.user_id = user_id
+        self.name = name
+        self.source_id = source_id
+        # One source may fan out to several destinations
+        if not isinstance(destination_ids, (list, tuple)):
+            destination_ids = [destination_ids]
+        self.destination_ids = tuple(destination_ids)
+        self.source_key = bare_peer_id(source_id)
+        # Coroutine function called as forward(event, rule, is_edit)
+        self.forward = forward
+
+    @property
+    def key(self):
+        return (self.user_id, self.name)
+
+class SourceRouter:
+    """Dispatches a client's messages to the rules of their source chat"""
+
+    def __init__(self, client):
+        self.client = client
+        self.routes = {}  # source_key -> tuple of rules
+        self.rules = {}   # (user_id, name) -> rule
+        self._attached = False
+
+    def add_rule(self, rule):
+        """Add a rule, replacing any rule with the same user and name"""
+        self._unlink(rule.key)
+        self.rules[rule.key] = rule
+        # Tuples are rebuilt rather than mutated so a dispatch in progress
+        # keeps iterating the snapshot it started with
+        self.routes[rule.source_key] = self.routes.get(rule.source_key, ()) + (rule,)
+        self._attach()
+
+    def remove_rule(self, user_id, name):
+        """Remove a rule; returns True if it existed
+
+        When the last rule goes, the dispatcher handlers are removed from
+        the client so an idle account costs nothing per update.
+        """
+        if self._unlink((user_id, name)) is None:
+            return False
+        if not self.rules:
+            self.detach()
+        return True
+
+    def user_rules(self, user_id):
+        return [rule for key, rule in self.rules.items() if key[0] == user_id]
+
+    def _unlink(self, key):
+        rule = self.rules.pop(key, None)
+        if rule is None:
+            return None
+        remaining = tuple(r for r in self.routes.get(rule.source_key, ()) if r is not rule)
+        if remaining:
+            self.routes[rule.source_key] = remaining
+        else:
+            self.routes.pop(rule.source_key, None)
+        return rule
+
+    def _attach(self):
+        if self._attached:
+            return
+        routers[self.client] = self
+        self.client.add_event_handler(self._on_new_message, events.NewMessage())
+        self.client.add_event_handler(self._on_message_edited, events.MessageEdited())
+        self._attached = True
+
+    def detach(self):
+        """Remove the dispatcher handlers and forget this router"""
+        if self._attached:
+            self.client.remove_event_handler(self._on_new_message, events.NewMessage)
+            self.client.remove_event_handler(self._on_message_edited, events.MessageEdited)
+            self._attached = False
+        if routers.get(self.client) is self:
+            del routers[self.client]
+
+    async def _on_new_message(self, event):
+        await self._dispatch(event, is_edit=False)
+
+    async def _on_message_edited(self, event):
+        await self._dispatch(event, is_edit=True)
+
+    async def _dispatch(self, event, is_edit):
+        if event.chat_id is None:
+            return
+        rules = self.routes.get(bare_peer_id(event.chat_id))
+        if not rules:
+            return
+        for rule in rules:
+            try:
+                await rule.forward(event, rule, is_edit)
+            except Exception as e:
+                logger.error(f"Error dispatching to redirection {rule.name}: {e}")
+
+# One router per client, shared by every subsystem that adds rules to it
+routers = {}
+
+def get_router(client):
+    """Get (or create) the router of a client"""
+    router = routers.get(client)
+    if router is None:
+        router = routers[client] = SourceRouter(client)
+    return router
+
+def unregister(user_id, name, keep=None):
+    """Remove a redirection from every router except `keep`"""
+    removed = False
+    for router in list(routers.values()):
+        if router is not keep and router.remove_rule(user_id, name):
+            removed = True
+    return removed
+
+def sync_user_rules(user_id, rules_by_client):
+    """Make the rules in `rules_by_client` the complete set of live rules for a user
+
+    `rules_by_client` maps each of the user's clients (one per connected
+    phone) to the rules it serves. Rules of the user that are not listed,
+    or that live on another client (e.g. a session replaced by a
+    reconnect), are removed. The swap has no await in it, so no message is
+    dispatched against a half-updated index.
+    """
+    wanted = {
+        rule.key: get_router(client)
+        for client, rules in rules_by_client.items()
+        for rule in rules
+    }
+    for other in list(routers.values()):
+        for rule in other.user_rules(user_id):
+            if wanted.get(rule.key) is not other:
+                other.remove_rule(*rule.key)
+    for client, rules in rules_by_client.items():
+        router = get_router(client)
+        for rule in rules:
+            router.add_rule(rule)
+        if not router.rules:
+            router.detach()
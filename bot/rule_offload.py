@@ -0,0 +1,276 @@
+"""
+Exécution déportée des règles regex coûteuses
+Les regex des transformations power, removeLines et des filtres repérées
+comme dangereuses (analyse statique) ou lentes (coût mesuré) sont évaluées
+dans un pool de processus, avec un délai maximal par appel, pour ne jamais
+bloquer la boucle Telethon partagée par tous les comptes
+"""
+
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# Evaluate expensive rules in worker processes (false: everything inline)
+RULE_OFFLOAD = os.getenv("RULE_OFFLOAD", "true").lower() == "true"
+
+# Worker processes, and the longest a rule may run on one message (seconds)
+RULE_WORKERS = int(os.getenv("RULE_WORKERS", "2"))
+RULE_TIMEOUT = float(os.getenv("RULE_TIMEOUT", "0.5"))
+
+# Inline cost (milliseconds) above which a run counts as slow; a rule
+# moves to the pool once its slow runs outnumber its fast ones by RULE_SLOW_RUNS
+RULE_OFFLOAD_MS = float(os.getenv("RULE_OFFLOAD_MS", "2.0"))
+RULE_SLOW_RUNS = 3
+
+# Beyond this many alternatives a combined regex is treated as expensive
+RULE_MAX_ALTERNATIVES = 200
+
+REPEATS = {"MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"}
+
+class RuleTimeout(Exception):
+    """A rule's own run did not finish within RULE_TIMEOUT; it gets disabled"""
+
+def _risk(items, in_repeat):
+    for op, av in items:
+        name = str(op)
+        if name in REPEATS:
+            low, high, sub = av
+            unbounded = high == sre_parse.MAXREPEAT or high > 100
+            if unbounded and in_repeat:
+                return "nested quantifiers"
+            reason = _risk(sub, in_repeat or unbounded)
+        elif name == "SUBPATTERN":
+            reason = _risk(av[-1], in_repeat)
+        elif name == "BRANCH":
+            if in_repeat:
+                return "alternation under a quantifier"
+            if len(av[1]) > RULE_MAX_ALTERNATIVES:
+                return f"{len(av[1])} alternatives"
+            reason = next(filter(None, (_risk(branch, in_repeat) for branch in av[1])), None)
+        elif name in ("ASSERT", "ASSERT_NOT"):
+            reason = _risk(av[1], in_repeat)
+        elif name in ("GROUPREF", "GROUPREF_EXISTS"):
+            return "backreference"
+        else:
+            reason = None
+        if reason:
+            return reason
+    return None
+
+def analyze_pattern(pattern, flags=0):
+    """Why a pattern may backtrack catastrophically or run long, or None"""
+    try:
+        return _risk(sre_parse.parse(pattern, flags), False)
+    except Exception:
+        return "unparsable"
+
+# Worker side: patterns are compiled once per process through re's cache
+
+def _worker_spans(pattern, flags, text, replacement):
+    regex = re.compile(pattern, flags)
+    if replacement is None:
+        return [(match.start(), match.end(), None) for match in regex.finditer(text)]
+    return [(match.start(), match.end(), match.expand(replacement)) for match in regex.finditer(text)]
+
+def _worker_search(pattern, flags, text):
+    return re.compile(pattern, flags).search(text) is not None
+
+def _worker_main(conn):
+    """Run the calls sent on `conn` one at a time"""
+    conn.send(None)  # ready: imports are done
+    while True:
+        try:
+            function, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, function(*args)))
+        except Exception as e:
+            conn.send((False, e))
+
+class _Worker:
+    """One worker process and the pipe it is fed through"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        # spawn: forking the bot would copy its threads and sessions
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    @classmethod
+    def spawn(cls, context):
+        """Start a worker and wait until it can take calls (blocking)"""
+        worker = cls(context)
+        worker.conn.recv()
+        return worker
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+class RulePool:
+    """Worker processes evaluating expensive regexes with a per-call timeout
+
+    Each worker takes one call at a time, so the timeout covers the rule's
+    own run only: neither the wait for a free worker nor the start of a
+    worker process counts. Python's regex engine cannot be interrupted, so
+    a call that times out gets its worker killed and replaced; calls on the
+    other workers carry on.
+    """
+
+    def __init__(self, workers=RULE_WORKERS, timeout=RULE_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = None
+        self.live = set()
+        self.restarts = 0
+        self._serve_tasks = []
+
+    def start(self):
+        """Start the workers ahead of the first call (no-op when running)"""
+        if self.queue is None:
+            loop = asyncio.get_running_loop()
+            self.queue = asyncio.Queue()
+            self._serve_tasks = [loop.create_task(self._serve()) for _ in range(self.workers)]
+
+    async def run(self, function, *args):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((function, args, future))
+        return await future
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        worker = None
+        while True:
+            if worker is None:
+                try:
+                    worker = await loop.run_in_executor(None, _Worker.spawn, context)
+                except Exception as e:
+                    logger.error(f"Error starting a rule worker: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                self.live.add(worker)
+
+            function, args, future = await self.queue.get()
+            if future.done():
+                continue  # caller gave up while queued
+            try:
+                worker.conn.send((function, args))
+                ok, result = await asyncio.wait_for(
+                    loop.run_in_executor(None, worker.conn.recv), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.restarts += 1
+                error = RuleTimeout(f"no result after {self.timeout}s")
+            except Exception as e:
+                # The worker died (killed, out of memory...): start another
+                error = RuntimeError(f"rule worker lost: {e!r}")
+            else:
+                if not future.done():
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(result)
+                continue
+
+            self.live.discard(worker)
+            # kill() joins the process: keep it off the event loop
+            await loop.run_in_executor(None, worker.kill)
+            worker = None
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        for task in self._serve_tasks:
+            task.cancel()
+        for worker in list(self.live):
+            worker.process.kill()
+        self.live.clear()
+
+class OffloadableRegex:
+    """A user regex that runs inline while cheap and in the pool otherwise
+
+    Flagged by static analysis at compile time, or moved once its inline
+    cost keeps exceeding RULE_OFFLOAD_MS (a single slow run, e.g. during a
+    GC pause, is not enough). A rule that times out is disabled until it is
+    recompiled, i.e. until the user changes it.
+    """
+
+    __slots__ = ("pattern", "flags", "regex", "offloaded", "disabled", "cost", "slow_runs")
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self.regex = re.compile(pattern, flags)
+        reason = analyze_pattern(pattern, flags) if RULE_OFFLOAD else None
+        self.offloaded = reason is not None
+        self.disabled = False
+        self.cost = 0.0  # moving average of the inline cost, in ms
+        self.slow_runs = 0
+        if reason:
+            logger.info(f"Regex rule {pattern[:60]!r} runs in the worker pool: {reason}")
+
+    def _measure(self, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.cost = 0.8 * self.cost + 0.2 * elapsed
+        if elapsed <= RULE_OFFLOAD_MS:
+            self.slow_runs = max(0, self.slow_runs - 1)
+            return
+        self.slow_runs += 1
+        if RULE_OFFLOAD and self.slow_runs >= RULE_SLOW_RUNS:
+            self.offloaded = True
+            logger.info(f"Regex rule {self.pattern[:60]!r} moves to the worker pool ({self.cost:.1f} ms/message)")
+
+    async def _offload(self, function, *args):
+        try:
+            return await rule_pool.run(function, self.pattern, self.flags, *args)
+        except RuleTimeout as e:
+            self.disabled = True
+            logger.error(f"Regex rule {self.pattern[:60]!r} disabled, {e}")
+        except Exception as e:
+            logger.error(f"Regex rule {self.pattern[:60]!r} failed in the worker pool: {e}")
+        return None
+
+    async def spans(self, text, replacement=None):
+        """(start, end, expanded replacement or None) of every match"""
+        if self.disabled:
+            return []
+        if self.offloaded:
+            return await self._offload(_worker_spans, text, replacement) or []
+        started = time.perf_counter()
+        if replacement is None:
+            spans = [(match.start(), match.end(), None) for match in self.regex.finditer(text)]
+        else:
+            spans = [(match.start(), match.end(), match.expand(replacement)) for match in self.regex.finditer(text)]
+        self._measure(started)
+        return spans
+
+    async def search(self, text, failed=False):
+        """Whether the regex matches; `failed` once disabled or when the pool fails"""
+        if self.disabled:
+            return failed
+        if self.offloaded:
+            found = await self._offload(_worker_search, text)
+            return failed if found is None else found
+        started = time.perf_counter()
+        found = self.regex.search(text) is not None
+        self._measure(started)
+        return found
+
+# Global pool shared by filters and transformations
+rule_pool = RulePool()
+atexit.register(rule_pool.close)
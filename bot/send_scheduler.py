@@ -0,0 +1,232 @@
+"""
+Planificateur d'envois sortants par compte
+File bornée, seaux à jetons par compte et par chat de destination, et mise
+en pause de la file entière sur FloodWait au lieu de perdre le message
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+from collections import deque
+
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+from bot.routing import bare_peer_id
+
+logger = logging.getLogger(__name__)
+
+# Sends per second (sustained) and burst size, per account and per destination
+ACCOUNT_SEND_RATE = float(os.getenv("ACCOUNT_SEND_RATE", "8"))
+ACCOUNT_SEND_BURST = int(os.getenv("ACCOUNT_SEND_BURST", "15"))
+DESTINATION_SEND_RATE = float(os.getenv("DESTINATION_SEND_RATE", "1"))
+DESTINATION_SEND_BURST = int(os.getenv("DESTINATION_SEND_BURST", "5"))
+
+# Jobs waiting per account before submitters are made to wait
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))
+
+class TokenBucket:
+    """Classic token bucket refilled at `rate` tokens per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    @property
+    def idle(self):
+        return self.tokens >= self.capacity
+
+class SendJob:
+    __slots__ = ("destination", "call", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, destination, call, args, kwargs, future):
+        self.destination = destination
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued_at = time.monotonic()
+
+class SendScheduler:
+    """Serializes one account's outbound calls under its rate budget"""
+
+    def __init__(self, queue_size=SEND_QUEUE_SIZE):
+        self.jobs = deque()
+        self.slots = asyncio.Semaphore(queue_size)
+        self.account_bucket = TokenBucket(ACCOUNT_SEND_RATE, ACCOUNT_SEND_BURST)
+        self.destination_buckets = {}
+        self.parked_until = 0.0
+        self.destination_parked = {}  # destination -> monotonic time (slow mode)
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        # Counters exposed by stats()
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.total_wait = 0.0
+        self.last_wait = 0.0
+
+    async def call(self, destination, call, *args, **kwargs):
+        """Run `call(*args, **kwargs)` when the budget allows; returns its result
+
+        Waits for a queue slot when the queue is full, so bursts slow the
+        producer down instead of dropping messages.
+        """
+        await self.slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self.jobs.append(SendJob(bare_peer_id(destination), call, args, kwargs, future))
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        try:
+            return await future
+        finally:
+            self.slots.release()
+
+    def _bucket(self, destination):
+        bucket = self.destination_buckets.get(destination)
+        if bucket is None:
+            bucket = self.destination_buckets[destination] = TokenBucket(DESTINATION_SEND_RATE, DESTINATION_SEND_BURST)
+        return bucket
+
+    def _next_job(self, now):
+        """Oldest job whose destination may send now, or the time to wait
+
+        Jobs for a busy destination do not hold up other destinations, and
+        jobs for the same destination keep their order.
+        """
+        wait = self.account_bucket.delay(now)
+        if wait:
+            return None, wait
+        wait = None
+        blocked = set()
+        for job in self.jobs:
+            if job.destination in blocked:
+                continue
+            job_wait = max(
+                self._bucket(job.destination).delay(now),
+                self.destination_parked.get(job.destination, 0.0) - now
+            )
+            if job_wait <= 0:
+                return job, 0.0
+            blocked.add(job.destination)
+            wait = job_wait if wait is None else min(wait, job_wait)
+        return None, wait
+
+    async def _run(self):
+        while self.jobs:
+            now = time.monotonic()
+            if self.parked_until > now:
+                await asyncio.sleep(self.parked_until - now)
+                continue
+            job, wait = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # A newly queued job may be for an idle destination
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.jobs.remove(job)
+            if job.future.cancelled():
+                continue
+            self.account_bucket.take(now)
+            self._bucket(job.destination).take(now)
+            await self._execute(job)
+            self._forget_idle_buckets()
+
+    async def _execute(self, job):
+        self.last_wait = time.monotonic() - job.queued_at
+        self.total_wait += self.last_wait
+        try:
+            result = await job.call(*job.args, **job.kwargs)
+        except FloodWaitError as e:
+            # The whole account is limited: park the queue and retry this
+            # job first once the wait is over
+            self.flood_waits += 1
+            self.parked_until = time.monotonic() + e.seconds + 1
+            self.jobs.appendleft(job)
+            logger.warning(f"FloodWait de {e.seconds}s: file d'envoi en pause ({len(self.jobs)} en attente)")
+            return
+        except SlowModeWaitError as e:
+            # Only this chat is limited
+            self.destination_parked[job.destination] = time.monotonic() + e.seconds + 1
+            self.jobs.appendleft(job)
+            logger.warning(f"Mode lent sur {job.destination}: envoi repris dans {e.seconds}s")
+            return
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _forget_idle_buckets(self):
+        if len(self.destination_buckets) > 256:
+            now = time.monotonic()
+            for destination, bucket in list(self.destination_buckets.items()):
+                bucket._refill(now)
+                if bucket.idle:
+                    del self.destination_buckets[destination]
+            for destination, until in list(self.destination_parked.items()):
+                if until <= now:
+                    del self.destination_parked[destination]
+
+    def stats(self):
+        """Queue depth and wait times of this account"""
+        handled = self.sent + self.failed
+        return {
+            'queued': len(self.jobs),
+            'parked_for': max(0.0, self.parked_until - time.monotonic()),
+            'sent': self.sent,
+            'failed': self.failed,
+            'flood_waits': self.flood_waits,
+            'last_wait': self.last_wait,
+            'average_wait': self.total_wait / handled if handled else 0.0
+        }
+
+# One scheduler per client, dropped with the client
+schedulers = weakref.WeakKeyDictionary()
+
+def get_scheduler(client):
+    """Get (or create) the send scheduler of a client"""
+    scheduler = schedulers.get(client)
+    if scheduler is None:
+        scheduler = schedulers[client] = SendScheduler()
+    return scheduler
+
+def scheduler_stats():
+    """Totals across every live scheduler, for /stats"""
+    stats = [scheduler.stats() for scheduler in list(schedulers.values())]
+    handled = sum(s['sent'] + s['failed'] for s in stats)
+    return {
+        'accounts': len(stats),
+        'queued': sum(s['queued'] for s in stats),
+        'parked': sum(1 for s in stats if s['parked_for'] > 0),
+        'sent': sum(s['sent'] for s in stats),
+        'flood_waits': sum(s['flood_waits'] for s in stats),
+        'average_wait': sum(s['average_wait'] * (s['sent'] + s['failed']) for s in stats) / handled if handled else 0.0
+    }
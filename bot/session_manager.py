@@ -1,7 +1,6 @@
 import logging
 import os
 import asyncio
-from telethon import TelegramClient
 from bot.database import load_data, save_data
 import psycopg2
 from datetime import datetime
@@ -120,10 +119,13 @@ class SessionManager:
             sessions = cursor.fetchall()
             cursor.close()
 
-            for user_id, phone_number, session_file in sessions:
-                await self._restore_session(user_id, phone_number, session_file)
+            # Accounts connect concurrently, bounded by the startup semaphore
+            results = await asyncio.gather(*[
+                self._restore_session(user_id, phone_number, session_file)
+                for user_id, phone_number, session_file in sessions
+            ])
 
-            logger.info(f"Restored {len(sessions)} active sessions")
+            logger.info(f"Restored {sum(1 for restored in results if restored)}/{len(sessions)} active sessions")
 
         except Exception as e:
             logger.error(f"Error restoring sessions: {e}")
@@ -137,27 +139,14 @@ class SessionManager:
                 await self.deactivate_session(user_id, phone_number)
                 return False
 
-            # Create Telegram client with existing session
-            client = TelegramClient(
-                session_file.replace('.session', ''),  # Telethon expects name without .session
-                int(os.getenv("API_ID")),
-                os.getenv("API_HASH")
+            # Reuses the client of this phone if a restorer already opened it
+            from bot.client_registry import client_registry
+            from bot.startup import startup
+            client = await client_registry.acquire(
+                user_id, phone_number, "session", session_file, connect=startup.connect, once=True
             )
 
-            # Try to connect
-            await client.connect()
-
-            if await client.is_user_authorized():
-                # Store in active sessions
-                from bot.connection import active_connections
-                active_connections[user_id] = {
-                    'client': client,
-                    'phone': phone_number,
-                    'connected': True,
-                    'session_name': session_file,
-                    'restored': True
-                }
-
+            if client:
                 # Update last used time
                 await self.update_session_activity(user_id, phone_number)
 
@@ -165,7 +154,6 @@ class SessionManager:
                 return True
             else:
                 # Session expired, deactivate
-                await client.disconnect()
                 await self.deactivate_session(user_id, phone_number)
                 logger.warning(f"Session expired for user {user_id}, phone {phone_number}")
                 return False
@@ -209,13 +197,10 @@ class SessionManager:
                 self.db_connection.commit()
                 cursor.close()
 
-            # Remove from active connections if present
-            from bot.connection import active_connections
-            if user_id in active_connections:
-                client = active_connections[user_id].get('client')
-                if client:
-                    await client.disconnect()
-                del active_connections[user_id]
+            # Drop the session's hold; the client stays up while redirections,
+            # /chats or a backfill still hold it
+            from bot.client_registry import client_registry
+            await client_registry.close(user_id, phone_number)
 
             logger.info(f"Session deactivated for user {user_id}, phone {phone_number}")
 
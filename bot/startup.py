@@ -0,0 +1,97 @@
+"""
+Restauration parallèle des comptes au démarrage
+Les sessions sont reconnectées en parallèle, sous un sémaphore et avec un
+léger décalage aléatoire pour ne pas déclencher de flood d'autorisation ;
+chaque compte passe en direct dès que son propre client est autorisé
+"""
+
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+# Accounts connecting at the same time, and the random delay (seconds)
+# spreading their first connection attempts
+RESTORE_CONCURRENCY = int(os.getenv("RESTORE_CONCURRENCY", "10"))
+RESTORE_JITTER = float(os.getenv("RESTORE_JITTER", "1.0"))
+
+# Longest a single account may take to connect
+RESTORE_CONNECT_TIMEOUT = float(os.getenv("RESTORE_CONNECT_TIMEOUT", "30"))
+
+STAGES = ("authorized", "live", "first_forward")
+
+class AccountStartup:
+    """Bounded, jittered account connection plus per-account startup timings
+
+    Timings are seconds since begin(): when the client was authorized, when
+    its redirections went live and when its first message was forwarded.
+    """
+
+    def __init__(self, concurrency=RESTORE_CONCURRENCY, jitter=RESTORE_JITTER):
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.started_at = None
+        self.timings = {}  # user_id -> {stage: seconds}
+        self.task = None
+        self._slots = None
+
+    def begin(self):
+        self.started_at = time.monotonic()
+
+    async def connect(self, client, user_id):
+        """Connect a client within the concurrency budget; True if authorized"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        await asyncio.sleep(random.uniform(0, self.jitter))
+        async with self._slots:
+            await asyncio.wait_for(client.connect(), RESTORE_CONNECT_TIMEOUT)
+            authorized = await client.is_user_authorized()
+        if authorized:
+            self.mark(user_id, "authorized")
+        return authorized
+
+    def mark(self, user_id, stage):
+        if self.started_at is None:
+            return
+        timings = self.timings.setdefault(user_id, {})
+        if stage in timings:
+            return
+        timings[stage] = time.monotonic() - self.started_at
+        if stage == "first_forward":
+            logger.info(f"Account {user_id} startup: " + ", ".join(
+                f"{name} after {timings[name]:.1f}s" for name in STAGES if name in timings
+            ))
+
+    def first_forward(self, user_id):
+        """Called on every delivery; records only the first one after startup"""
+        timings = self.timings.get(user_id)
+        if timings is not None and "first_forward" not in timings:
+            self.mark(user_id, "first_forward")
+
+    def summary(self):
+        live = sorted(timings["live"] for timings in self.timings.values() if "live" in timings)
+        if not live:
+            return "No account went live"
+        return (
+            f"{len(live)} account(s) live, first after {live[0]:.1f}s, "
+            f"median {statistics.median(live):.1f}s, last {live[-1]:.1f}s"
+        )
+
+async def restore_accounts():
+    """Restore every session and its redirections, accounts in parallel"""
+    from bot.session_manager import session_manager
+    from bot.simple_restorer import simple_restorer
+
+    startup.begin()
+    await asyncio.gather(
+        session_manager.restore_all_sessions(),
+        simple_restorer.restore_all_redirections()
+    )
+    logger.info(f"Restoration finished in {time.monotonic() - startup.started_at:.1f}s: {startup.summary()}")
+
+# Global startup tracker
+startup = AccountStartup()
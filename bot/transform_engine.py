@@ -0,0 +1,288 @@
+"""
+Moteur de transformations des messages
+Les transformations d'une redirection (format, power, removeLines) sont
+compilées une fois en une chaîne ordonnée d'étapes qui travaillent sur le
+texte brut et ses entités de mise en forme, sans repasser par le markdown
+"""
+
+import copy
+import logging
+import re
+from bisect import bisect_left, bisect_right
+
+from bot.filter_engine import parse_filter_terms
+from bot.rule_offload import OffloadableRegex
+
+logger = logging.getLogger(__name__)
+
+TRANSFORMATION_TYPES = ("format", "power", "removeLines")
+
+# Group references in a substitution: \1, \g<1>, \g<name>
+GROUP_REFERENCE = re.compile(r"\\(\d+)|\\g<(\w+)>")
+
+def parse_transformation(transform_type, lines):
+    """Validate the lines given under the command; returns the spec to store
+
+    format: a template containing {text} once, e.g. "📢 {text}\\n— via TeleFeed"
+    power: one "pattern => replacement" regex substitution per line; a line
+        ending in "=>" deletes the matches
+    removeLines: one line number (1 = first, -1 = last), word, "phrase" or /regex/ per line
+    Raises ValueError (French message shown to the user) or re.error.
+    """
+    if transform_type == "format":
+        template = "\n".join(lines).strip("\n")
+        if template.count("{text}") != 1:
+            raise ValueError("le modèle doit contenir `{text}` exactement une fois")
+        return {"template": template}
+
+    if transform_type == "power":
+        rules = []
+        for line in lines:
+            if not line.strip():
+                continue
+            pattern, separator, replacement = line.partition(" => ")
+            if not separator and line.rstrip().endswith(" =>"):
+                # Telegram trims the space after a final "=>": empty replacement
+                pattern, separator, replacement = line.rstrip()[:-3], " => ", ""
+            if not separator or not pattern:
+                raise ValueError(f"ligne sans ` => ` : {line}")
+            regex = re.compile(pattern)
+            for number, name in GROUP_REFERENCE.findall(replacement):
+                if (number and int(number) > regex.groups) or (name and not name.isdigit() and name not in regex.groupindex):
+                    raise ValueError(f"groupe inconnu dans le remplacement : {line}")
+            rules.append([pattern, replacement])
+        if not rules:
+            raise ValueError("aucune substitution fournie")
+        return {"rules": rules}
+
+    if transform_type == "removeLines":
+        indexes, terms = [], []
+        for line in lines:
+            term = line.strip()
+            if term.lstrip("-").isdigit() and int(term) != 0:
+                indexes.append(int(term))
+            elif term:
+                terms.append(term)
+        keywords, regexes = parse_filter_terms(terms)
+        if not indexes and not keywords and not regexes:
+            raise ValueError("aucune ligne à supprimer fournie")
+        return {"indexes": indexes, "keywords": keywords, "regexes": regexes}
+
+    raise ValueError(f"type inconnu : {transform_type}")
+
+# Text edits
+#
+# A stage returns sorted, non-overlapping (start, end, replacement) edits on
+# Python string indices; entity spans are moved through them instead of
+# rendering and re-parsing markdown.
+
+def _move(position, moved, is_start):
+    shift = 0
+    for start, end, new_start, new_end in moved:
+        if start < position < end:
+            # Inside a replaced span: the entity stretches over the replacement
+            return new_start if is_start else new_end
+        if end < position or (end == position and (is_start or start < end)):
+            shift = new_end - end
+        else:
+            break
+    return position + shift
+
+def splice(text, spans, edits):
+    """Apply edits to the text and move the [start, end, entity] spans along"""
+    if not edits:
+        return text, spans
+    parts, moved = [], []
+    last = shift = 0
+    for start, end, replacement in edits:
+        parts.append(text[last:start])
+        parts.append(replacement)
+        new_start = start + shift
+        shift += len(replacement) - (end - start)
+        moved.append((start, end, new_start, new_start + len(replacement)))
+        last = end
+    parts.append(text[last:])
+    new_spans = []
+    for start, end, entity in spans:
+        new_start, new_end = _move(start, moved, True), _move(end, moved, False)
+        if new_end > new_start:
+            new_spans.append([new_start, new_end, entity])
+    return "".join(parts), new_spans
+
+# Telegram counts entity offsets in UTF-16 code units; str indices only
+# differ from them after characters outside the BMP (most emoji), which
+# take two units each
+
+ASTRAL = re.compile("[\U00010000-\U0010FFFF]")
+
+def _astral_positions(text):
+    """str indices of the characters taking two UTF-16 units, or None"""
+    if text.isascii():
+        return None
+    return [match.start() for match in ASTRAL.finditer(text)] or None
+
+def entity_spans(text, entities):
+    """Entities of a message as [start, end, entity] in str indices"""
+    if not entities:
+        return []
+    astral = _astral_positions(text)
+    if astral is None:
+        return [[entity.offset, entity.offset + entity.length, entity] for entity in entities]
+    # UTF-16 offset of each astral character; those before a unit offset shift it by one
+    units = [position + count for count, position in enumerate(astral)]
+    return [
+        [
+            entity.offset - bisect_left(units, entity.offset),
+            entity.offset + entity.length - bisect_left(units, entity.offset + entity.length),
+            entity
+        ]
+        for entity in entities
+    ]
+
+def build_entities(text, spans):
+    """Entities at their new UTF-16 offset and length (copied when moved)"""
+    astral = _astral_positions(text)
+    entities = []
+    for start, end, entity in spans:
+        if astral is not None:
+            start, end = start + bisect_left(astral, start), end + bisect_left(astral, end)
+        if entity.offset != start or entity.length != end - start:
+            entity = copy.copy(entity)
+            entity.offset, entity.length = start, end - start
+        entities.append(entity)
+    return entities
+
+# Stages
+
+class RegexSubstitution:
+    """power: replace every match of a regex"""
+
+    __slots__ = ("regex", "replacement", "literal")
+    kind = "power"
+
+    def __init__(self, pattern, replacement):
+        self.regex = OffloadableRegex(pattern)
+        self.replacement = replacement
+        # Without backslashes there is no group to expand for each match
+        self.literal = "\\" not in replacement
+
+    async def __call__(self, text, spans):
+        if self.literal:
+            replacement = self.replacement
+            edits = [(start, end, replacement) for start, end, _ in await self.regex.spans(text)]
+        else:
+            edits = await self.regex.spans(text, self.replacement)
+        return splice(text, spans, edits)
+
+class LineRemoval:
+    """removeLines: drop lines by number or by content"""
+
+    __slots__ = ("indexes", "regex")
+    kind = "removeLines"
+
+    def __init__(self, indexes, keywords, regexes):
+        self.indexes = frozenset(indexes)
+        # Line sets are short: one alternation scanned over the whole text
+        # beats matching line by line
+        patterns = [re.escape(keyword) for keyword in keywords] + [f"(?:{pattern})" for pattern in regexes]
+        self.regex = OffloadableRegex("|".join(patterns), re.IGNORECASE | re.MULTILINE) if patterns else None
+
+    async def __call__(self, text, spans):
+        starts = [0]
+        position = text.find("\n")
+        while position != -1:
+            starts.append(position + 1)
+            position = text.find("\n", position + 1)
+        count = len(starts)
+        matched = set()
+        if self.regex is not None:
+            for start, _, _ in await self.regex.spans(text):
+                matched.add(bisect_right(starts, start))
+        edits = []
+        for number, start in enumerate(starts, 1):
+            end = starts[number] if number < count else len(text)
+            if number in self.indexes or number - count - 1 in self.indexes or number in matched:
+                if edits and edits[-1][1] == start:
+                    edits[-1] = (edits[-1][0], end, "")
+                else:
+                    edits.append((start, end, ""))
+        if edits and edits[-1][1] == len(text) and edits[-1][0] > 0:
+            # Last line removed: also drop the line break before it
+            edits[-1] = (edits[-1][0] - 1, len(text), "")
+        return splice(text, spans, edits)
+
+class Template:
+    """format: wrap the text in a template around {text}"""
+
+    __slots__ = ("prefix", "suffix")
+    kind = "format"
+
+    def __init__(self, template):
+        self.prefix, _, self.suffix = template.partition("{text}")
+
+    async def __call__(self, text, spans):
+        return splice(text, spans, [(0, 0, self.prefix), (len(text), len(text), self.suffix)])
+
+def compile_step(step):
+    """Stages of one stored transformation"""
+    spec = step["spec"]
+    if step["type"] == "format":
+        return [Template(spec["template"])]
+    if step["type"] == "power":
+        return [RegexSubstitution(pattern, replacement) for pattern, replacement in spec["rules"]]
+    if step["type"] == "removeLines":
+        return [LineRemoval(spec["indexes"], spec["keywords"], spec["regexes"])]
+    raise ValueError(f"Unknown transformation type: {step['type']}")
+
+class TransformationChain:
+    """Ordered stages of a redirection, applied to (text, entities)"""
+
+    __slots__ = ("stages",)
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    async def apply(self, text, entities):
+        """Transformed text and entities; the originals are left untouched"""
+        text = text or ""
+        spans = entity_spans(text, entities)
+        for stage in self.stages:
+            text, spans = await stage(text, spans)
+        return text, build_entities(text, spans)
+
+class TransformationRegistry:
+    """Compiled transformation chain per (user, redirection)
+
+    Compiled on first use and kept until the user's transformations change.
+    """
+
+    def __init__(self):
+        self.compiled = {}  # user_id -> {name: TransformationChain}
+
+    def invalidate(self, user_id):
+        self.compiled.pop(int(user_id), None)
+
+    async def _load(self, user_id):
+        from bot.database import get_transformations
+        compiled = {}
+        for name, entry in (await get_transformations(user_id)).items():
+            stages = []
+            for step in entry.get("steps", []):
+                try:
+                    stages.extend(compile_step(step))
+                except (ValueError, KeyError, re.error) as e:
+                    logger.error(f"Skipping invalid {step.get('type')} transformation of {name}: {e}")
+            if stages:
+                compiled[name] = TransformationChain(stages)
+        self.compiled[int(user_id)] = compiled
+        return compiled
+
+    async def get(self, user_id, name):
+        """Chain of a redirection, or None when it has no transformation"""
+        compiled = self.compiled.get(int(user_id))
+        if compiled is None:
+            compiled = await self._load(user_id)
+        return compiled.get(name)
+
+# Global registry used by the forwarder
+transformations = TransformationRegistry()
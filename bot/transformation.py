@@ -1,4 +1,7 @@
 import logging
+import re
+
+from bot.transform_engine import TRANSFORMATION_TYPES, parse_transformation, transformations
 
 logger = logging.getLogger(__name__)
 
@@ -16,29 +19,46 @@ async def handle_transformation_command(event, client):
 🧩 **Utilisation de /transformation :**
 
 `/transformation add format|power|removeLines NOM on NUMERO`
-`/transformation remove ...`
-`/transformation clear ...`
+`/transformation remove format|power|removeLines NOM on NUMERO`
+`/transformation clear on NUMERO`
 
-**Types de transformation :**
-• **format** - Modifier le format des messages
-• **power** - Appliquer des transformations avancées
-• **removeLines** - Supprimer certaines lignes
+NOM est le nom de la redirection ; la règle s'écrit sur les lignes sous la commande. Les transformations s'appliquent dans l'ordre d'ajout.
 
-**Exemple :**
-`/transformation add format groupe1 on 229900112233`
+**Types de transformation :**
+• **format** - Modèle autour du message, avec `{text}` à la place du texte
+• **power** - Une substitution regex par ligne : `motif => remplacement` (`motif =>` seul supprime le motif)
+• **removeLines** - Une ligne par règle : numéro (1 = première, -1 = dernière), mot, "phrase" ou /regex/
+
+**Exemples :**
+```
+/transformation add format groupe1 on 229900112233
+📢 {text}
+— Relayé par TeleFeed
+```
+```
+/transformation add power groupe1 on 229900112233
+@\\w+ => @moncanal
+https?://\\S+ =>
+```
+```
+/transformation add removeLines groupe1 on 229900112233
+-1
+/t\\.me\\//
+```
             """
             await event.respond(usage_message)
             return
         
         # Parse command
-        parts = message_text.split()
+        lines = message_text.splitlines()
+        parts = lines[0].split()
         if len(parts) < 2:
             await event.respond("❌ Format incorrect. Tapez `/transformation` pour voir l'utilisation.")
             return
         
         # Handle different transformation actions
         if parts[1] == "add" and len(parts) == 6 and parts[4] == "on":
-            await add_transformation(event, client, parts[2], parts[3], parts[5])
+            await add_transformation(event, client, parts[2], parts[3], parts[5], lines[1:])
         elif parts[1] == "remove" and len(parts) == 6 and parts[4] == "on":
             await remove_transformation(event, client, parts[2], parts[3], parts[5])
         elif parts[1] == "clear" and len(parts) == 4 and parts[2] == "on":
@@ -50,7 +70,7 @@ async def handle_transformation_command(event, client):
         logger.error(f"Error in transformation command: {e}")
         await event.respond("❌ Erreur lors de la gestion des transformations. Veuillez réessayer.")
 
-async def add_transformation(event, client, transform_type, name, phone_number):
+async def add_transformation(event, client, transform_type, name, phone_number, rule_lines):
     """Add a new transformation"""
     try:
         user_id = event.sender_id
@@ -61,13 +81,18 @@ async def add_transformation(event, client, transform_type, name, phone_number):
             return
         
         # Validate transformation type
-        valid_types = ["format", "power", "removeLines"]
-        if transform_type not in valid_types:
-            await event.respond(f"❌ Type de transformation invalide. Types supportés : {', '.join(valid_types)}")
+        if transform_type not in TRANSFORMATION_TYPES:
+            await event.respond(f"❌ Type de transformation invalide. Types supportés : {', '.join(TRANSFORMATION_TYPES)}")
+            return
+        
+        try:
+            spec = parse_transformation(transform_type, rule_lines)
+        except (ValueError, re.error) as e:
+            await event.respond(f"❌ **Transformation invalide :** {e}\n\nTapez `/transformation` pour voir l'utilisation.")
             return
         
         # Store transformation
-        await store_transformation(user_id, transform_type, name, phone_number, "add")
+        position = await store_transformation(user_id, transform_type, name, phone_number, "add", spec)
         
         success_message = f"""
 ✅ **Transformation ajoutée**
@@ -76,6 +101,7 @@ async def add_transformation(event, client, transform_type, name, phone_number):
 📝 **Nom :** {name}
 📞 **Numéro :** {phone_number}
 🔄 **Action :** Ajout
+🔢 **Position :** étape {position} de la chaîne
 
 La transformation est maintenant active !
         """
@@ -98,7 +124,10 @@ async def remove_transformation(event, client, transform_type, name, phone_numbe
             return
         
         # Remove transformation
-        await store_transformation(user_id, transform_type, name, phone_number, "remove")
+        removed = await store_transformation(user_id, transform_type, name, phone_number, "remove")
+        if not removed:
+            await event.respond(f"❌ Aucune transformation **{transform_type}** sur la redirection **{name}**.")
+            return
         
         success_message = f"""
 ✅ **Transformation supprimée**
@@ -152,14 +181,23 @@ async def is_premium_user(user_id):
     from bot.database import is_user_licensed
     return await is_user_licensed(user_id)
 
-async def store_transformation(user_id, transform_type, name, phone_number, action):
-    """Store transformation in database"""
+async def store_transformation(user_id, transform_type, name, phone_number, action, spec=None):
+    """Store transformation in database
+
+    Returns the position of an added transformation, or how many were removed.
+    """
+    from bot.database import add_transformation_step, remove_transformation_steps
+    if action == "remove":
+        result = await remove_transformation_steps(user_id, name, transform_type)
+    else:
+        result = await add_transformation_step(user_id, name, phone_number, transform_type, spec)
+    transformations.invalidate(user_id)
     logger.info(f"Transformation {action} for user {user_id}: {transform_type} {name} on {phone_number}")
-    # In real implementation, save to database
-    pass
+    return result
 
 async def clear_user_transformations(user_id, phone_number):
     """Clear all transformations for a user and phone number"""
-    logger.info(f"Transformations cleared for user {user_id} on {phone_number}")
-    # In real implementation, clear from database
-    pass
\ No newline at end of file
+    from bot.database import clear_transformation_steps
+    cleared = await clear_transformation_steps(user_id, phone_number)
+    transformations.invalidate(user_id)
+    logger.info(f"Transformations cleared for user {user_id} on {phone_number}: {cleared} redirection(s)")
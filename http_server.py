@@ -1,5 +1,7 @@
-from flask import Flask, jsonify, request
-import threading
+from aiohttp import web
+import aiohttp
+import asyncio
+import errno
 import time
 import os
 from datetime import datetime
@@ -9,9 +11,8 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-# Variables globales pour le statut
+# Le serveur tourne dans la boucle asyncio du bot : les gestionnaires
+# s'exécutent un par un sur cette boucle, le statut n'a pas besoin de verrou
 server_status = {
     "last_activity": time.time(),
     "start_time": time.time(),
@@ -19,56 +20,84 @@ server_status = {
     "wake_up_calls": 0
 }
 
-@app.route('/')
-def home():
-    """Page d'accueil"""
+routes = web.RouteTableDef()
+
+def record_activity(count=True):
+    """Mettre à jour le statut à chaque requête"""
     server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
-    return jsonify({
+    if count:
+        server_status["requests_count"] += 1
+
+async def read_json(request):
+    """Corps JSON de la requête ({} s'il est absent ou invalide)"""
+    try:
+        data = await request.json()
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+async def send_telegram_message(app, admin_id, message, bot_token):
+    """Envoyer un message : par le client du bot s'il est connecté avec ce
+    jeton, sinon par l'API HTTP de Telegram via la session partagée"""
+    bot_client = app.get("bot_client")
+    if bot_client is not None and bot_token == os.getenv("BOT_TOKEN") and bot_client.is_connected():
+        await bot_client.send_message(int(admin_id), message)
+        return True
+
+    async with app["http_session"].post(
+        f"https://api.telegram.org/bot{bot_token}/sendMessage",
+        json={"chat_id": admin_id, "text": message}
+    ) as response:
+        if response.status != 200:
+            logger.error(f"Échec envoi message Telegram: {response.status}")
+        return response.status == 200
+
+@routes.get('/')
+async def home(request):
+    """Page d'accueil"""
+    record_activity()
+
+    return web.json_response({
         "status": "TeleFeed Bot Server Active",
         "uptime": int(time.time() - server_status["start_time"]),
         "last_activity": datetime.fromtimestamp(server_status["last_activity"]).strftime("%Y-%m-%d %H:%M:%S"),
         "requests_count": server_status["requests_count"]
     })
 
-@app.route('/ping')
-def ping():
+@routes.get('/ping')
+async def ping(request):
     """Endpoint pour les pings de maintien d'activité"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
+    record_activity()
+
     logger.info(f"📡 Ping reçu - {datetime.now().strftime('%H:%M:%S')}")
-    
-    return jsonify({
+
+    return web.json_response({
         "status": "pong",
         "timestamp": datetime.now().isoformat(),
         "server_active": True
     })
 
-@app.route('/wake-up')
-def wake_up():
+@routes.get('/wake-up')
+async def wake_up(request):
     """Endpoint pour réveiller le serveur"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
+    record_activity()
     server_status["wake_up_calls"] += 1
-    
+
     logger.info("🔔 Serveur réveillé par le bot")
-    
-    return jsonify({
+
+    return web.json_response({
         "status": "D'accord Kouamé",
         "message": "Serveur Replit réveillé",
         "timestamp": datetime.now().isoformat(),
         "wake_up_calls": server_status["wake_up_calls"]
     })
 
-@app.route('/status')
-def status():
+@routes.get('/status')
+async def status(request):
     """Statut détaillé du serveur"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
-    return jsonify({
+    record_activity()
+
+    return web.json_response({
         "server_status": "active",
         "uptime_seconds": int(time.time() - server_status["start_time"]),
         "last_activity": datetime.fromtimestamp(server_status["last_activity"]).strftime("%Y-%m-%d %H:%M:%S"),
@@ -77,117 +106,90 @@ def status():
         "current_time": datetime.now().isoformat()
     })
 
-@app.route('/health')
-def health():
+@routes.get('/health')
+async def health(request):
     """Health check endpoint"""
-    server_status["last_activity"] = time.time()
-    
-    return jsonify({
+    record_activity(count=False)
+
+    return web.json_response({
         "status": "healthy",
         "service": "TeleFeed Bot",
         "timestamp": datetime.now().isoformat()
     })
 
-@app.route('/send-message', methods=['POST'])
-def send_message():
+@routes.post('/send-message')
+async def send_message(request):
     """Endpoint pour que le serveur envoie un message via le bot"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
+    record_activity()
+
     try:
-        data = request.json
+        data = await read_json(request)
         admin_id = data.get('admin_id')
         message = data.get('message')
         bot_token = data.get('bot_token')
-        
+
         if not all([admin_id, message, bot_token]):
-            return jsonify({"error": "Paramètres manquants"}), 400
-        
-        # Envoyer le message via l'API Telegram HTTP
-        import requests
-        
-        telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            "chat_id": admin_id,
-            "text": message
-        }
-        
-        response = requests.post(telegram_url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
+            return web.json_response({"error": "Paramètres manquants"}, status=400)
+
+        if await send_telegram_message(request.app, admin_id, message, bot_token):
             logger.info(f"📨 Message envoyé depuis le SERVEUR REPLIT: {message}")
-            return jsonify({
+            return web.json_response({
                 "status": "success",
                 "message": "Message envoyé par le serveur Replit",
                 "timestamp": datetime.now().isoformat()
             })
         else:
-            logger.error(f"Échec envoi message Telegram: {response.status_code}")
-            return jsonify({"error": "Échec envoi Telegram"}), 500
-            
+            return web.json_response({"error": "Échec envoi Telegram"}, status=500)
+
     except Exception as e:
         logger.error(f"Erreur envoi message: {e}")
-        return jsonify({"error": "Erreur serveur"}), 500
+        return web.json_response({"error": "Erreur serveur"}, status=500)
 
-@app.route('/trigger-message', methods=['POST'])
-def trigger_message():
+@routes.post('/trigger-message')
+async def trigger_message(request):
     """Endpoint pour déclencher un message depuis le serveur"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
+    record_activity()
+
     try:
-        data = request.json
+        data = await read_json(request)
         admin_id = data.get('admin_id')
         message = data.get('message')
         bot_token = data.get('bot_token')
-        
+
         if not all([admin_id, message, bot_token]):
-            return jsonify({"error": "Paramètres manquants"}), 400
-        
-        # Envoyer le message via l'API Telegram HTTP
-        import requests
-        
-        telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            "chat_id": admin_id,
-            "text": message
-        }
-        
-        response = requests.post(telegram_url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
+            return web.json_response({"error": "Paramètres manquants"}, status=400)
+
+        if await send_telegram_message(request.app, admin_id, message, bot_token):
             logger.info(f"🔥 Message déclenché depuis le SERVEUR REPLIT: {message}")
-            return jsonify({
+            return web.json_response({
                 "status": "success",
                 "message": "Message déclenché par le serveur Replit",
                 "timestamp": datetime.now().isoformat(),
                 "source": "Serveur Replit HTTP"
             })
         else:
-            logger.error(f"Échec déclenchement message Telegram: {response.status_code}")
-            return jsonify({"error": "Échec déclenchement Telegram"}), 500
-            
+            return web.json_response({"error": "Échec déclenchement Telegram"}, status=500)
+
     except Exception as e:
         logger.error(f"Erreur déclenchement message: {e}")
-        return jsonify({"error": "Erreur serveur"}), 500
+        return web.json_response({"error": "Erreur serveur"}, status=500)
 
-@app.route('/railway-notification', methods=['POST'])
-def railway_notification():
+@routes.post('/railway-notification')
+async def railway_notification(request):
     """Endpoint pour recevoir les notifications de Railway"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
+    record_activity()
+
     try:
-        data = request.json
+        data = await read_json(request)
         event = data.get('event', 'unknown')
         message = data.get('message', '')
         railway_url = data.get('railway_url', '')
         timestamp = data.get('timestamp', datetime.now().isoformat())
-        
+
         if event == 'railway_deployment_success':
             logger.info(f"🚂 Notification Railway reçue: {message}")
             logger.info(f"🌐 URL Railway: {railway_url}")
-            
+
             # Log du succès du déploiement
             success_log = f"""
 DÉPLOIEMENT RAILWAY CONFIRMÉ:
@@ -198,85 +200,88 @@ DÉPLOIEMENT RAILWAY CONFIRMÉ:
 - Statut Replit: Opérationnel
             """
             logger.info(success_log)
-            
-            return jsonify({
+
+            return web.json_response({
                 "status": "notification_received",
                 "message": "Déploiement Railway confirmé",
                 "replit_status": "operational",
                 "timestamp": datetime.now().isoformat()
             })
-        
-        return jsonify({
+
+        return web.json_response({
             "status": "notification_received",
             "event": event,
             "timestamp": datetime.now().isoformat()
         })
-        
+
     except Exception as e:
         logger.error(f"Erreur notification Railway: {e}")
-        return jsonify({
+        return web.json_response({
             "status": "error",
             "error": str(e)
-        }), 500
+        }, status=500)
 
-@app.route('/sync', methods=['POST'])
-def sync_endpoint():
+@routes.post('/sync')
+async def sync_endpoint(request):
     """Endpoint pour synchronisation croisée des plateformes"""
-    server_status["last_activity"] = time.time()
-    server_status["requests_count"] += 1
-    
+    record_activity()
+
     try:
-        data = request.json
+        data = await read_json(request)
         platform = data.get('platform', 'unknown')
-        timestamp = data.get('timestamp', datetime.now().isoformat())
-        
+
         logger.debug(f"🔄 Sync reçu de {platform}")
-        
-        return jsonify({
+
+        return web.json_response({
             "status": "sync_received",
             "platform": "replit",
             "timestamp": datetime.now().isoformat()
         })
-        
+
     except Exception as e:
         logger.error(f"Erreur sync: {e}")
-        return jsonify({
+        return web.json_response({
             "status": "error",
             "error": str(e)
-        }), 500
+        }, status=500)
+
+async def open_http_session(app):
+    """Session HTTP partagée (connexions réutilisées) pour l'API Telegram"""
+    app["http_session"] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+async def close_http_session(app):
+    await app["http_session"].close()
 
-def start_http_server():
-    """Démarrer le serveur HTTP"""
+def create_app(bot_client=None):
+    """Application aiohttp ; `bot_client` est le client Telethon déjà connecté du bot"""
+    app = web.Application()
+    app["bot_client"] = bot_client
+    app.add_routes(routes)
+    app.on_startup.append(open_http_session)
+    app.on_cleanup.append(close_http_session)
+    return app
+
+async def start_http_server(bot_client=None):
+    """Démarrer le serveur HTTP dans la boucle courante (retourne le runner)"""
     port = int(os.environ.get('PORT', 8080))  # Port 8080 pour Replit
     logger.info(f"🌐 Démarrage du serveur HTTP sur le port {port}")
-    
+
+    runner = web.AppRunner(create_app(bot_client), access_log=None)
+    await runner.setup()
     try:
-        app.run(
-            host='0.0.0.0',
-            port=port,
-            debug=False,
-            use_reloader=False,
-            threaded=True
-        )
+        await web.TCPSite(runner, '0.0.0.0', port).start()
     except OSError as e:
-        if "Address already in use" in str(e):
-            logger.info(f"⚠️ Port {port} occupé, tentative port {port+1}")
-            app.run(
-                host='0.0.0.0',
-                port=port+1,
-                debug=False,
-                use_reloader=False,
-                threaded=True
-            )
-        else:
+        if e.errno != errno.EADDRINUSE:
             raise
+        logger.info(f"⚠️ Port {port} occupé, tentative port {port+1}")
+        await web.TCPSite(runner, '0.0.0.0', port + 1).start()
+    return runner
 
-def start_server_in_background():
-    """Démarrer le serveur HTTP en arrière-plan"""
-    server_thread = threading.Thread(target=start_http_server, daemon=True)
-    server_thread.start()
+def start_server_in_background(bot_client=None):
+    """Démarrer le serveur HTTP en arrière-plan dans la boucle du bot"""
+    task = asyncio.get_running_loop().create_task(start_http_server(bot_client))
     logger.info("🔄 Serveur HTTP démarré en arrière-plan")
-    return server_thread
+    return task
 
 if __name__ == "__main__":
-    start_http_server()
\ No newline at end of file
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -26,50 +26,37 @@ async def main():
         print(f"✅ ADMIN_ID: {ADMIN_ID}")
 
         # Import et démarrage du bot
-        from telethon import TelegramClient, events
-        from bot.handlers import (
-            start, valide, payer, deposer, connect, redirection, 
-            transformation, whitelist, blacklist, chats, help_command,
-            admin_command, confirm_command, generate_command, 
-            users_command, stats_command, sessions_command, 
-            handle_unknown_command
-        )
+        from bot.handlers import client, register_handlers, start_services
         
-        # Créer le client
-        client = TelegramClient('bot', API_ID, API_HASH)
+        # Charger les données utilisateur hors de la boucle
+        from bot.database import init_storage
+        await init_storage()
+        
+        # Client partagé avec bot/handlers.py : les commandes répondent et
+        # envoient par ce client, qui est celui qu'on démarre ici
+        register_handlers(client)
         
         # Démarrer le bot
         await client.start(bot_token=BOT_TOKEN)
         print("🚀 Bot TeleFeed démarré avec succès!")
         
-        # Enregistrer les handlers
-        client.add_event_handler(start, events.NewMessage(pattern='/start'))
-        client.add_event_handler(valide, events.NewMessage(pattern='/valide'))
-        client.add_event_handler(payer, events.NewMessage(pattern='/payer'))
-        client.add_event_handler(deposer, events.NewMessage(pattern='/deposer'))
-        client.add_event_handler(connect, events.NewMessage(pattern='/connect'))
-        client.add_event_handler(redirection, events.NewMessage(pattern='/redirection'))
-        client.add_event_handler(transformation, events.NewMessage(pattern='/transformation'))
-        client.add_event_handler(whitelist, events.NewMessage(pattern='/whitelist'))
-        client.add_event_handler(blacklist, events.NewMessage(pattern='/blacklist'))
-        client.add_event_handler(chats, events.NewMessage(pattern='/chats'))
-        client.add_event_handler(help_command, events.NewMessage(pattern='/help'))
-        client.add_event_handler(admin_command, events.NewMessage(pattern='/admin'))
-        client.add_event_handler(confirm_command, events.NewMessage(pattern='/confirm'))
-        client.add_event_handler(generate_command, events.NewMessage(pattern='/generate'))
-        client.add_event_handler(users_command, events.NewMessage(pattern='/users'))
-        client.add_event_handler(stats_command, events.NewMessage(pattern='/stats'))
-        client.add_event_handler(sessions_command, events.NewMessage(pattern='/sessions'))
-        client.add_event_handler(handle_unknown_command, events.NewMessage)
+        # Restaurer les sessions et leurs redirections en arrière-plan, comme
+        # start_bot : chaque compte repart dès qu'il est autorisé, avec le
+        # rattrapage des messages manqués
+        from bot.startup import restore_accounts, startup
+        startup.task = asyncio.create_task(restore_accounts())
+        print("🔄 Système de restauration des redirections activé")
+        
+        # Mise en veille des clients inactifs et expiration des attentes
+        # (codes, IDs de redirection, licences), tâches partagées avec start_bot
+        start_services()
         
-        # Démarrer la restauration des redirections
+        # Serveur HTTP (ping, wake-up, send-message...) dans la même boucle
         try:
-            from bot.simple_restorer import SimpleRedirectionRestorer
-            restorer = SimpleRedirectionRestorer()
-            asyncio.create_task(restorer.start_restoration())
-            print("🔄 Système de restauration des redirections activé")
+            from http_server import start_http_server
+            await start_http_server(client)
         except Exception as e:
-            print(f"⚠️ Erreur restauration redirections: {e}")
+            print(f"⚠️ Erreur serveur HTTP: {e}")
         
         # Exécuter le bot
         await client.run_until_disconnected()